@@ -0,0 +1,122 @@
+"""Benchmark and parity check: batched closed-form face alignment vs per-face LMEDS alignment.
+
+Run from the repository root:
+    python benchmarks/bench_alignment.py --batch 16 --repeat 20
+
+Checks two things on synthetic photos with jittered landmarks:
+  * the fused warp/flip/normalize buffer is bit-identical to preprocess_image on the same transform;
+  * closed-form transforms vs cv2.estimateAffinePartial2D(LMEDS): the closed form must fit the landmarks
+    to the template at least as well on every face, and the crops must agree within --max-mean-shift /
+    --max-shift: the distance, in crop pixels, between where the two alignments put the same image point.
+    Pixel differences of the crops themselves are printed too, but depend on the texture of the photos.
+Then times both full paths for one batch.
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'embedding_service')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ml_common')))
+from preprocess import TEMPLATE_112, FaceBatchBuffer, extract_largest_face_aligned, preprocess_image, similarity_transforms
+
+
+def synthetic_faces(rng, batch):
+    images, detections = [], []
+    for _ in range(batch):
+        img = cv2.GaussianBlur(rng.integers(0, 256, (720, 960, 3), dtype=np.uint8), (7, 7), 0)
+        scale, angle = rng.uniform(1.5, 4), rng.uniform(-0.4, 0.4)
+        rot = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]) * scale
+        kps = (TEMPLATE_112 - 56) @ rot.T + rng.uniform(250, 500, 2) + rng.normal(0, 1.5, (5, 2))
+        x1, y1 = kps.min(0) - 40
+        x2, y2 = kps.max(0) + 40
+        images.append(img)
+        detections.append([{"bbox": [int(x1), int(y1), int(x2), int(y2)], "keypoints": kps.round().astype(int).ravel().tolist(), "conf": 0.9}])
+    return images, detections
+
+
+def landmark_rms(transforms, kps):
+    """RMS distance in crop pixels between the transformed landmarks and the template, per face."""
+    mapped = kps @ transforms[:, :, :2].transpose(0, 2, 1) + transforms[:, None, :, 2]
+    return np.sqrt(((mapped - TEMPLATE_112) ** 2).sum(-1).mean(-1))
+
+
+def crop_shift(transforms, reference, size=112):
+    """Largest distance, in crop pixels, between where transforms and reference put an image point of the crop, per face."""
+    grid = np.stack(np.meshgrid(np.arange(size), np.arange(size)), -1).reshape(-1, 2).astype(np.float64)
+    shifts = []
+    for M, R in zip(transforms, reference):
+        inverse = cv2.invertAffineTransform(R)
+        moved = (grid @ inverse[:, :2].T + inverse[:, 2]) @ M[:, :2].T + M[:, 2]
+        shifts.append(np.linalg.norm(moved - grid, axis=1).max())
+    return np.array(shifts)
+
+
+def legacy_path(images, detections):
+    tensors = []
+    for img, dets in zip(images, detections):
+        face, _ = extract_largest_face_aligned(img, dets)
+        tensors += [preprocess_image(face), preprocess_image(cv2.flip(face, 1))]
+    return np.vstack(tensors)
+
+
+def batched_path(buffer, images, detections):
+    kps = np.array([dets[0]["keypoints"] for dets in detections], dtype=np.float32).reshape(-1, 5, 2)
+    return buffer.fill(images, similarity_transforms(kps))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-mean-shift', type=float, default=0.5, help='crop pixels, mean over the faces')
+    parser.add_argument('--max-shift', type=float, default=6.0, help='crop pixels, any face')
+    args = parser.parse_args()
+
+    images, detections = synthetic_faces(np.random.default_rng(args.seed), args.batch)
+    buffer = FaceBatchBuffer()
+    kps = np.array([dets[0]["keypoints"] for dets in detections], dtype=np.float32).reshape(-1, 5, 2)
+    transforms = similarity_transforms(kps)
+
+    fused = buffer.fill(images, transforms).copy()
+    reference = []
+    for img, M in zip(images, transforms):
+        face = cv2.warpAffine(img, M, (112, 112), borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_LINEAR)
+        reference += [preprocess_image(face), preprocess_image(cv2.flip(face, 1))]
+    assert np.array_equal(fused, np.vstack(reference)), "fused buffer differs from preprocess_image"
+    print(f"[INFO] fused warp/flip/normalize is bit-identical on {args.batch} faces")
+
+    lmeds = np.stack([cv2.estimateAffinePartial2D(k, TEMPLATE_112, method=cv2.LMEDS)[0] for k in kps])
+    closed_rms, lmeds_rms = landmark_rms(transforms, kps), landmark_rms(lmeds, kps)
+    shift = crop_shift(transforms, lmeds)
+    crop_diff = np.abs(legacy_path(images, detections) - fused).mean(axis=(1, 2, 3)) * 127.5  # in 0-255 pixel units
+    print(f"[INFO] closed form vs LMEDS: landmark RMS {closed_rms.mean():.3f} vs {lmeds_rms.mean():.3f} px, "
+          f"crop shift mean {shift.mean():.3f} px (max {shift.max():.3f} px), {(shift < 1).mean():.0%} of faces within 1 px, "
+          f"crop mean abs diff {crop_diff.mean():.3f} (max {crop_diff.max():.3f})")
+    # least squares is the best fit of the landmarks; LMEDS only differs where it fits a subset of them
+    assert (closed_rms <= lmeds_rms + 1e-3).all(), "closed form fits the landmarks worse than LMEDS"
+    assert shift.mean() <= args.max_mean_shift, f"crops shifted by {shift.mean():.3f} px on average"
+    assert shift.max() <= args.max_shift, f"a crop shifted by {shift.max():.3f} px"
+
+    def timeit(fn):
+        times = []
+        for _ in range(args.repeat):
+            tik = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - tik)
+        return np.median(times) * 1000
+
+    legacy_ms = timeit(lambda: legacy_path(images, detections))
+    batched_ms = timeit(lambda: batched_path(buffer, images, detections))
+    print(f"{'path':<9}{'median ms':>12}")
+    print(f"{'lmeds':<9}{legacy_ms:>12.3f}")
+    print(f"{'batched':<9}{batched_ms:>12.3f}")
+    print(f"speedup: {legacy_ms / batched_ms:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
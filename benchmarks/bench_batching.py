@@ -0,0 +1,135 @@
+"""Replay a request arrival trace against fixed-window and adaptive batching.
+
+Run from the repository root:
+    python benchmarks/bench_batching.py
+    python benchmarks/bench_batching.py --save-trace trace.txt
+    python benchmarks/bench_batching.py --trace trace.txt --target-p99-ms 150
+
+The default trace is a seeded Poisson process stepping through low, medium and high load,
+so runs are reproducible. A trace file has one arrival offset in seconds per line.
+Inference is simulated as a single worker taking a + c * batch_size seconds per batch.
+For every policy it prints p50/p99 latency, mean batch size and throughput per load phase;
+throughput is the phase's completed requests over the span from its first arrival to its last completion,
+so a policy that falls behind shows it instead of the offered rate.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ml_common')))
+from batching import AdaptiveBatcher, BatchingConfig
+
+
+class FixedWindowBatcher(AdaptiveBatcher):
+    """Baseline: always waits the full max_latency window for the batch to fill."""
+
+    def window(self) -> float:
+        return self.max_window
+
+    def wait(self, pending: int, age: float) -> float:
+        return self.max_window - age
+
+
+def make_trace(phases, seed):
+    rng = np.random.default_rng(seed)
+    arrivals, start = [], 0.0
+    for rate, duration in phases:
+        t = start
+        while True:
+            t += rng.exponential(1 / rate)
+            if t >= start + duration:
+                break
+            arrivals.append(t)
+        start += duration
+    return np.array(arrivals)
+
+
+async def replay(batcher_cls, config, trace, intercept, per_item):
+    """
+    Submits every request of the trace at its offset; returns the latency and the completion offset
+    of every request (seconds) and the size of every batch its request was part of.
+    """
+    lock = asyncio.Lock()
+
+    async def run_batch(items):
+        async with lock:  # one inference worker
+            await asyncio.sleep(intercept + per_item * len(items))
+        batch_sizes[items] = len(items)
+        return items
+
+    batcher = batcher_cls(run_batch, config)
+    latencies = np.zeros(len(trace))
+    completed = np.zeros(len(trace))
+    batch_sizes = np.zeros(len(trace), dtype=int)
+    start = time.perf_counter()
+
+    async def request(i, offset):
+        await asyncio.sleep(max(offset - (time.perf_counter() - start), 0))
+        sent = time.perf_counter()
+        await batcher.submit(i)
+        done = time.perf_counter()
+        latencies[i] = done - sent
+        completed[i] = done - start
+
+    await asyncio.gather(*(request(i, offset) for i, offset in enumerate(trace)))
+    return latencies, completed, batch_sizes
+
+
+def phase_stats(trace, latencies, completed, batch_sizes, mask) -> dict:
+    """Latency percentiles (ms), mean batch size and completed requests per second of the requests in mask."""
+    latencies_ms = latencies[mask] * 1000
+    span = completed[mask].max() - trace[mask].min()
+    return {
+        "requests": int(mask.sum()),
+        "p50_ms": float(np.median(latencies_ms)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "batch_size": float(batch_sizes[mask].mean()),
+        "rps": float(mask.sum() / span),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', help='file with one arrival offset (seconds) per line')
+    parser.add_argument('--save-trace', help='write the generated trace to this file and use it')
+    parser.add_argument('--phases', default='5:3,40:3,150:3', help='rate_rps:duration_s,... of the generated trace')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-latency-ms', type=int, default=300)
+    parser.add_argument('--target-p99-ms', type=float, default=200)
+    parser.add_argument('--intercept-ms', type=float, default=20, help='simulated inference time of an empty batch')
+    parser.add_argument('--per-item-ms', type=float, default=4, help='simulated inference time per item')
+    args = parser.parse_args()
+
+    phases = [tuple(float(v) for v in phase.split(':')) for phase in args.phases.split(',')]
+    if args.trace:
+        trace = np.loadtxt(args.trace, ndmin=1)
+        bounds = [0.0, float(trace.max()) + 1e-9]
+    else:
+        trace = make_trace(phases, args.seed)
+        bounds = np.concatenate([[0.0], np.cumsum([d for _, d in phases])])
+        if args.save_trace:
+            np.savetxt(args.save_trace, trace, fmt='%.6f')
+
+    policies = {
+        'fixed': (FixedWindowBatcher, BatchingConfig(args.max_batch_size, args.max_latency_ms, 'fixed')),
+        'adaptive': (AdaptiveBatcher, BatchingConfig(args.max_batch_size, args.max_latency_ms, 'adaptive', args.target_p99_ms)),
+    }
+    print(f"{'policy':<10}{'phase':>16}{'requests':>10}{'p50 ms':>9}{'p99 ms':>9}{'batch':>7}{'req/s':>9}")
+    for name, (batcher_cls, config) in policies.items():
+        result = asyncio.run(replay(batcher_cls, config, trace, args.intercept_ms / 1000, args.per_item_ms / 1000))
+        rows = [(f'{lo:.0f}-{hi:.0f}s', (trace >= lo) & (trace < hi)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        for phase, mask in rows + [('total', np.ones(len(trace), dtype=bool))]:
+            if not mask.any():
+                continue
+            stats = phase_stats(trace, *result, mask)
+            print(f"{name:<10}{phase:>16}{stats['requests']:>10}{stats['p50_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+                  f"{stats['batch_size']:>7.1f}{stats['rps']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
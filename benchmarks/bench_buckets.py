@@ -0,0 +1,71 @@
+"""Benchmark: detector throughput with aspect-ratio shape buckets vs the square 640x640 baseline.
+
+Run from the repository root (needs the detector weights):
+    python benchmarks/bench_buckets.py --model detection_service/yolov6s_face.onnx --batch 16
+    python benchmarks/bench_buckets.py --buckets 640x640,640x384,480x640,640x480
+
+For every typical frame shape it reports the chosen bucket, the share of the tensor
+that is padding and images/s of preprocessing + inference for both policies.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'detection_service')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ml_common')))
+from buckets import DEFAULT_BUCKETS, parse_buckets, usable_buckets, select_bucket
+from model_loader import create_session
+from preprocess import BatchBuffer, letterbox_params
+
+FRAME_SHAPES = {
+    "16:9 camera": (1080, 1920),
+    "3:4 portrait": (1440, 1080),
+    "4:3 landscape": (1080, 1440),
+    "1:1 square": (1080, 1080),
+}
+
+
+def throughput(session, input_name, buffer, images, repeat):
+    times = []
+    for _ in range(repeat):
+        tik = time.perf_counter()
+        batch, _, _ = buffer.fill(images)
+        session.run(None, {input_name: batch})
+        times.append(time.perf_counter() - tik)
+    return len(images) / np.median(times)
+
+
+def padding_share(shape, bucket):
+    _, (w, h), _, _ = letterbox_params(shape, bucket)
+    return 1 - w * h / (bucket[0] * bucket[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=os.path.join(os.path.dirname(__file__), '..', 'detection_service', 'yolov6s_face.onnx'))
+    parser.add_argument('--buckets', default=DEFAULT_BUCKETS)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    session = create_session(args.model)
+    input_name = session.get_inputs()[0].name
+    buckets = usable_buckets(parse_buckets(args.buckets), session.get_inputs()[0].shape)
+    square = (max(max(b) for b in buckets),) * 2
+
+    rng = np.random.default_rng(0)
+    print(f"{'frames':<15}{'bucket':>10}{'pad %':>8}{'square pad %':>14}{'img/s':>10}{'square img/s':>14}{'speedup':>9}")
+    for label, shape in FRAME_SHAPES.items():
+        images = [rng.integers(0, 256, (*shape, 3), dtype=np.uint8) for _ in range(args.batch)]
+        bucket = select_bucket(shape, buckets)
+        bucket_ips = throughput(session, input_name, BatchBuffer(bucket), images, args.repeat)
+        square_ips = throughput(session, input_name, BatchBuffer(square), images, args.repeat)
+        print(f"{label:<15}{f'{bucket[1]}x{bucket[0]}':>10}{padding_share(shape, bucket) * 100:>8.1f}"
+              f"{padding_share(shape, square) * 100:>14.1f}{bucket_ips:>10.1f}{square_ips:>14.1f}{bucket_ips / square_ips:>8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark: reduced-resolution JPEG decode vs full decode for large phone photos.
+
+Run from the repository root:
+    python benchmarks/bench_decode.py --megapixels 12 48
+
+For each size it compares decode + letterbox to 640 for the detector, and decode for a
+face of --face-px pixels for the embedder, full decode vs the reduction the services pick.
+Peak memory is the numpy allocations seen by tracemalloc.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'detection_service')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ml_common')))
+from decode import decode_reduced, oriented_size, pick_reduction
+from preprocess import BatchBuffer
+
+
+def synthetic_photo(megapixels, seed=0):
+    """Smooth photo-like 4:3 JPEG: upscaled low-res noise plus fine grain, quality 90."""
+    height = int(np.sqrt(megapixels * 1e6 * 3 / 4))
+    width = height * 4 // 3
+    rng = np.random.default_rng(seed)
+    img = cv2.resize(rng.integers(0, 256, (height // 64, width // 64, 3), dtype=np.uint8), (width, height), interpolation=cv2.INTER_CUBIC)
+    img = cv2.add(img, rng.integers(0, 8, img.shape, dtype=np.uint8))
+    return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        tik = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - tik)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return np.median(times) * 1000, peak / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megapixels', type=float, nargs='+', default=[12, 48])
+    parser.add_argument('--face-px', type=int, default=400, help='side of the embedded face in the original photo')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    buffer = BatchBuffer((640, 640))
+    print(f"{'photo':<8}{'stage':<11}{'reduction':>10}{'full ms':>9}{'full MiB':>10}{'reduced ms':>12}{'reduced MiB':>13}")
+    for mp in args.megapixels:
+        data = synthetic_photo(mp)
+        height, width = oriented_size(data)
+        stages = {
+            'detection': pick_reduction(max(height, width) / 640),
+            'embedding': pick_reduction(args.face_px / 112),
+        }
+        for stage, reduction in stages.items():
+            def run(f):
+                img, _ = decode_reduced(data, f, (height, width))
+                if stage == 'detection':
+                    buffer.fill([img], bgr=True)
+            full = measure(lambda: run(1), args.repeat)
+            reduced = measure(lambda: run(reduction), args.repeat)
+            print(f"{f'{mp:g} MP':<8}{stage:<11}{f'1/{reduction}':>10}{full[0]:>9.1f}{full[1]:>10.1f}{reduced[0]:>12.1f}{reduced[1]:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark: JSON float lists vs binary rows for moving embeddings from the embedding service to the API.
+
+Run from the repository root:
+    python benchmarks/bench_embedding_transport.py --faces 16 --repeat 200
+
+For every format it measures the service side (normalized float32 matrix -> response body),
+the API side (response body -> vectors) and the payload size per face.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+
+def encode_json(emb):
+    return json.dumps({"faces": [{"det_id": i, "embedding": row.tolist()} for i, row in enumerate(emb)]}).encode()
+
+
+def decode_json(body):
+    return [face["embedding"] for face in json.loads(body)["faces"]]
+
+
+def binary_codec(dtype):
+    def encode(emb):
+        return emb.astype(dtype).tobytes()
+
+    def decode(body):
+        return np.frombuffer(body, dtype=dtype).reshape(-1, 512).astype(np.float32, copy=False)
+    return encode, decode
+
+
+def timeit(fn, arg, repeat):
+    times = []
+    for _ in range(repeat):
+        tik = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - tik)
+    return np.median(times) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--faces', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    emb = np.random.default_rng(0).normal(size=(args.faces, 512)).astype(np.float32)
+    emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+
+    formats = {"json": (encode_json, decode_json), "float32": binary_codec("<f4"), "float16": binary_codec("<f2")}
+    print(f"{'format':<9}{'bytes/face':>12}{'encode us':>11}{'decode us':>11}{'max abs err':>13}")
+    for name, (encode, decode) in formats.items():
+        body = encode(emb)
+        err = np.abs(np.asarray(decode(body), dtype=np.float32) - emb).max()
+        print(f"{name:<9}{len(body) / args.faces:>12.0f}{timeit(encode, emb, args.repeat):>11.1f}"
+              f"{timeit(decode, body, args.repeat):>11.1f}{err:>13.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Benchmark: uploading images to the model services vs handing them over in the shared-memory frame ring.
+
+Run from the repository root (needs the face_recognition_api requirements plus opencv / Pillow):
+    python benchmarks/bench_frame_transport.py --sizes 640x480 1920x1080 4000x3000 --requests 400 --concurrency 8
+    python benchmarks/bench_frame_transport.py --detection-url http://localhost:3000 --ring-dir /dev/shm/face-frames
+
+By default the service side is a stub server started in a subprocess that handles the image the way the
+services do before the model runs: an upload is parsed from multipart, written to a temporary file (what
+a bentoml Path input does) and read back; a frame handle is parsed from JSON and the image viewed in
+the mapped ring (ml_common/frame_ring.py). Both then read the image header and, with --decode, decode it.
+With --detection-url the real detection service is called instead (/detect_encoded vs /detect_frame), it
+has to run on this host with FRAME_RING_DIR pointing at --ring-dir.
+
+For every image size both transports send the same JPEG --requests times at --concurrency through the
+API's ServiceClient, the shm one holding a FrameRing record per request like face_services does.
+Reported: p50 / p99 request latency and requests per second.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(ROOT, 'face_recognition_api'))
+sys.path.append(os.path.join(ROOT, 'ml_common'))
+for name in ('POSTGRES_HOST', 'POSTGRES_USER', 'POSTGRES_PASSWORD', 'POSTGRES_DB'):
+    os.environ.setdefault(name, 'unused')
+
+
+def serve(port, ring_dir, decode):
+    """The stub service: /detect_encoded takes an upload, /detect_frame a frame handle."""
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    from decode import decode_reduced, oriented_size
+    from frame_ring import FrameReader
+
+    frames = FrameReader(ring_dir)
+
+    def handle(data):
+        height, width = oriented_size(data)
+        if decode:
+            decode_reduced(data)
+        return JSONResponse({"height": height, "width": width})
+
+    async def upload(request):
+        form = await request.form()
+        with tempfile.NamedTemporaryFile() as file:
+            file.write(await form["image"].read())
+            file.flush()
+            with open(file.name, "rb") as f:
+                data = f.read()
+        return handle(data)
+
+    async def frame(request):
+        return handle(frames.read((await request.json())["frame"]))
+
+    app = Starlette(routes=[Route("/detect_encoded", upload, methods=["POST"]), Route("/detect_frame", frame, methods=["POST"])])
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def jpeg(width, height, seed=0):
+    import cv2
+    rng = np.random.default_rng(seed)
+    # smooth noise compresses like a photo, not like pure noise
+    small = rng.integers(0, 256, (height // 16 + 1, width // 16 + 1, 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = cv2.add(img, rng.integers(0, 24, img.shape, dtype=np.uint8))
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+async def run(client, ring, transport, data, requests, concurrency):
+    latencies = []
+    queue = iter(range(requests))
+
+    async def worker():
+        for _ in queue:
+            tik = time.perf_counter()
+            if transport == "shm":
+                with ring.hold(data) as frame:
+                    if frame is None:
+                        raise RuntimeError("frame ring full, raise --ring-mb")
+                    await client.post("/detect_frame", json={"frame": frame, "tier": "accurate"})
+            else:
+                await client.post("/detect_encoded", files={"image": data}, data={"tier": "accurate"})
+            latencies.append(time.perf_counter() - tik)
+
+    tik = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return np.array(latencies) * 1000, requests / (time.perf_counter() - tik)
+
+
+async def bench(args, url):
+    from app.services.frame_ring import FrameRing
+    from app.services.service_client import CircuitBreaker, ServiceClient
+
+    ring = FrameRing(args.ring_dir, args.ring_mb * 2**20)
+    ring.open()
+    client = ServiceClient(
+        "detection", url, timeout_s=60, connect_timeout_s=5, max_connections=args.concurrency,
+        max_concurrency=args.concurrency, retries=0, backoff_s=0.1, breaker=CircuitBreaker(1000, 1),
+    )
+    try:
+        print(f"{'image':>11}{'KB':>7}{'transport':>11}{'p50 ms':>9}{'p99 ms':>9}{'req/s':>9}")
+        for size in args.sizes:
+            width, height = map(int, size.split("x"))
+            data = jpeg(width, height)
+            for transport in ("http", "shm"):
+                await run(client, ring, transport, data, args.concurrency * 2, args.concurrency)  # warm up
+                latencies, rate = await run(client, ring, transport, data, args.requests, args.concurrency)
+                print(f"{size:>11}{len(data) // 1024:>7}{transport:>11}{np.percentile(latencies, 50):>9.2f}"
+                      f"{np.percentile(latencies, 99):>9.2f}{rate:>9.1f}")
+    finally:
+        await client.aclose()
+        ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['640x480', '1920x1080', '4000x3000'])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--decode', action='store_true', help='stub: decode the image too, like detection does')
+    parser.add_argument('--ring-dir', default='/dev/shm/face-frames-bench')
+    parser.add_argument('--ring-mb', type=int, default=256)
+    parser.add_argument('--detection-url', default='')
+    parser.add_argument('--port', type=int, default=8791)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.ring_dir, args.decode)
+        return
+    if args.detection_url:
+        asyncio.run(bench(args, args.detection_url))
+        return
+
+    command = [sys.executable, __file__, '--serve', '--port', str(args.port), '--ring-dir', args.ring_dir]
+    server = subprocess.Popen(command + (['--decode'] if args.decode else []))
+    try:
+        import httpx
+        for _ in range(100):  # wait for the stub to listen
+            try:
+                httpx.get(f"http://127.0.0.1:{args.port}/")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        asyncio.run(bench(args, f"http://127.0.0.1:{args.port}"))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Microbenchmark: NumPy batch postprocess vs the previous torch/torchvision per-image path.
+
+Run from the repository root:
+    python benchmarks/bench_postprocess.py --batch 16 --repeat 50
+
+torch and torchvision are only needed here, for the reference implementation.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'detection_service')))
+from postprocess import non_max_suppression_face, rescale_detections
+
+
+def torch_reference(predictions, prepared_data, conf_thres, iou_thres, max_det):
+    """The per-image torch path that detect_batch used before the NumPy engine."""
+    import torch
+    import torchvision
+
+    results = []
+    for i, x in enumerate(torch.from_numpy(predictions)):
+        x = x[torch.logical_and(x[..., 14] > conf_thres, torch.max(x[..., 15:], axis=-1)[0] > conf_thres)]
+        dets = torch.zeros((0, 16))
+        if x.shape[0]:
+            x[:, 15:] *= x[:, 14:15]
+            box = x[:, :4].clone()
+            box[:, 0] = x[:, 0] - x[:, 2] / 2
+            box[:, 1] = x[:, 1] - x[:, 3] / 2
+            box[:, 2] = x[:, 0] + x[:, 2] / 2
+            box[:, 3] = x[:, 1] + x[:, 3] / 2
+            conf, class_idx = x[:, 15:].max(1, keepdim=True)
+            x = torch.cat((box, conf, class_idx.float(), x[:, 4:14]), 1)[conf.view(-1) > conf_thres]
+            if x.shape[0]:
+                keep = torchvision.ops.nms(x[:, :4] + x[:, 5:6] * 4096, x[:, 4], iou_thres)[:max_det]
+                dets = x[keep]
+
+        ratio = prepared_data[i][1]
+        dw, dh = prepared_data[i][2]
+        out = []
+        for x1, y1, x2, y2, conf, cls, *keypoints in dets:
+            coord_to_origin = lambda value, is_x: int(value / ratio - (dw if is_x else dh) / ratio)
+            out.append({
+                "bbox": [coord_to_origin(x1, True), coord_to_origin(y1, False), coord_to_origin(x2, True), coord_to_origin(y2, False)],
+                "keypoints": [coord_to_origin(c, i % 2 == 0) for i, c in enumerate(keypoints)],
+                "conf": float(conf),
+            })
+        results.append(out)
+    return results
+
+
+def numpy_engine(predictions, prepared_data, conf_thres, iou_thres, max_det):
+    dets = non_max_suppression_face(predictions, conf_thres=conf_thres, iou_thres=iou_thres, max_det=max_det)
+    return rescale_detections(dets, prepared_data)
+
+
+def synthetic_batch(rng, batch, anchors=8400, faces_per_image=(1, 12)):
+    """Raw detector output [B, anchors, 16]: clusters of overlapping candidates around a few faces."""
+    pred = np.zeros((batch, anchors, 16), dtype=np.float32)
+    pred[..., :2] = rng.uniform(0, 640, (batch, anchors, 2))
+    pred[..., 2:4] = rng.uniform(4, 40, (batch, anchors, 2))
+    pred[..., 4:14] = rng.uniform(0, 640, (batch, anchors, 10))
+    pred[..., 14] = rng.uniform(0, 0.3, (batch, anchors))
+    pred[..., 15] = rng.uniform(0.5, 1.0, (batch, anchors))
+    prepared_data = []
+    for b in range(batch):
+        for _ in range(rng.integers(*faces_per_image)):
+            cx, cy = rng.uniform(60, 580, 2)
+            size = rng.uniform(20, 200)
+            idx = rng.choice(anchors, 40, replace=False)
+            pred[b, idx, 0] = cx + rng.normal(0, size * 0.05, 40)
+            pred[b, idx, 1] = cy + rng.normal(0, size * 0.05, 40)
+            pred[b, idx, 2:4] = size * rng.uniform(0.85, 1.15, (40, 2))
+            pred[b, idx, 14] = rng.uniform(0.3, 0.95, 40)
+        ratio = float(rng.uniform(0.1, 1.0))
+        prepared_data.append((None, ratio, (float(rng.choice([0, rng.uniform(0, 200)])), float(rng.uniform(0, 10)))))
+    return pred, prepared_data
+
+
+def timeit(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        tik = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - tik)
+    return np.median(times) * 1000, np.percentile(times, 95) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--conf-thres', type=float, default=0.4)
+    parser.add_argument('--iou-thres', type=float, default=0.45)
+    parser.add_argument('--max-det', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    predictions, prepared_data = synthetic_batch(rng, args.batch)
+    params = (args.conf_thres, args.iou_thres, args.max_det)
+
+    reference = torch_reference(predictions.copy(), prepared_data, *params)
+    result = numpy_engine(predictions.copy(), prepared_data, *params)
+    assert result == reference, "NumPy postprocess differs from the torch reference"
+    print(f"[INFO] parity ok: {sum(map(len, result))} detections in {args.batch} images")
+
+    torch_ms = timeit(lambda: torch_reference(predictions.copy(), prepared_data, *params), args.repeat)
+    numpy_ms = timeit(lambda: numpy_engine(predictions, prepared_data, *params), args.repeat)
+    print(f"{'path':<8}{'median ms':>12}{'p95 ms':>12}")
+    print(f"{'torch':<8}{torch_ms[0]:>12.2f}{torch_ms[1]:>12.2f}")
+    print(f"{'numpy':<8}{numpy_ms[0]:>12.2f}{numpy_ms[1]:>12.2f}")
+    print(f"speedup: {torch_ms[0] / numpy_ms[0]:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark: fused BatchBuffer preprocessing vs the previous multi-copy detect_batch path.
+
+Run from the repository root:
+    python benchmarks/bench_preprocess.py --batch 16 --repeat 20
+
+Reports time per batch and bytes allocated (tracemalloc) for both paths and checks that
+the resulting detector tensors are identical.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'detection_service')))
+from preprocess import BatchBuffer, preprocess_images
+
+
+def legacy_path(imgs_rgb):
+    """detect_batch preprocessing before the fused buffer."""
+    imgs_bgr = [np.array(img)[:, :, ::-1] for img in imgs_rgb]
+    _, prepared_data = preprocess_images(imgs_bgr)
+    batch_tensor = np.stack([data[0][0] for data in prepared_data])
+    return batch_tensor.astype(np.float32) / 255.0
+
+
+def synthetic_images(rng, batch):
+    """Mix of 16:9 camera frames, 3:4 phone portraits and square crops."""
+    shapes = [(1080, 1920), (1440, 1080), (720, 1280), (800, 800)]
+    return [rng.integers(0, 256, (*shapes[i % len(shapes)], 3), dtype=np.uint8) for i in range(batch)]
+
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        tik = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - tik)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return np.median(times) * 1000, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    images = synthetic_images(np.random.default_rng(args.seed), args.batch)
+    buffer = BatchBuffer((640, 640))
+
+    fused, _, stats = buffer.fill(images)
+    assert np.array_equal(fused, legacy_path(images)), "fused preprocessing differs from the legacy path"
+    print(f"[INFO] parity ok on {args.batch} images, first batch allocated {stats['bytes_allocated'] / 2**20:.1f} MiB")
+
+    legacy_ms, legacy_peak = measure(lambda: legacy_path(images), args.repeat)
+    fused_ms, fused_peak = measure(lambda: buffer.fill(images), args.repeat)
+    print(f"{'path':<8}{'median ms':>12}{'peak MiB':>12}")
+    print(f"{'legacy':<8}{legacy_ms:>12.2f}{legacy_peak / 2**20:>12.1f}")
+    print(f"{'fused':<8}{fused_ms:>12.2f}{fused_peak / 2**20:>12.1f}")
+    print(f"steady-state bytes allocated per batch: {buffer.last_stats['bytes_allocated'] / 2**20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
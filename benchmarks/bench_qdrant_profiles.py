@@ -0,0 +1,119 @@
+"""Recall and latency of the Qdrant collection profiles (app/qdrant_profiles.py) against a local Qdrant.
+
+Run from the repository root (needs the face_recognition_api requirements and a running Qdrant, e.g.
+`docker compose up qdrant`):
+    python benchmarks/bench_qdrant_profiles.py --points 200000 --ef 32 64 128 256 --qdrant-url http://localhost:6333
+
+For every profile a temporary collection is created with its layout and filled with the same clustered
+unit vectors (identities with several noisy photos each, like a face gallery). Queries are other noisy
+photos of enrolled identities. Ground truth is an exact fp32 search; every profile is then searched at
+every --ef (and exact), reporting recall@1 / recall@k against it, p50 / p99 latency and the estimated
+RAM the vectors take. Local mode (--qdrant-url :memory:) runs but ignores HNSW and quantization.
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'face_recognition_api')))
+for name in ('POSTGRES_HOST', 'POSTGRES_USER', 'POSTGRES_PASSWORD', 'POSTGRES_DB'):
+    os.environ.setdefault(name, 'unused')
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import CollectionStatus, Distance, OptimizersConfigDiff, PointStruct, \
+    QuantizationSearchParams, SearchParams, SearchRequest, VectorParams
+from app.qdrant_profiles import PROFILES, hnsw_config, quantization_config, search_params
+
+DIM = 512
+UPLOAD_BATCH = 1024
+
+
+def gallery(rng, points, photos_per_identity, noise):
+    identities = rng.standard_normal((-(-points // photos_per_identity), DIM)).astype(np.float32)
+    owner = np.arange(points) // photos_per_identity
+    vectors = identities[owner] + noise * rng.standard_normal((points, DIM)).astype(np.float32)
+    return identities, vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def create(client, collection, profile, vectors):
+    if client.collection_exists(collection):
+        client.delete_collection(collection)
+    client.create_collection(
+        collection,
+        vectors_config=VectorParams(size=DIM, distance=Distance.COSINE, on_disk=profile.vectors_on_disk),
+        hnsw_config=hnsw_config(profile),
+        quantization_config=quantization_config(profile),
+        on_disk_payload=profile.payload_on_disk,
+        optimizers_config=OptimizersConfigDiff(indexing_threshold=1000),  # index small benchmark galleries too
+    )
+    for start in range(0, len(vectors), UPLOAD_BATCH):
+        client.upsert(collection, points=[
+            PointStruct(id=start + i, vector=vector.tolist())
+            for i, vector in enumerate(vectors[start:start + UPLOAD_BATCH])
+        ])
+    while client.get_collection(collection).status != CollectionStatus.GREEN:  # wait for indexing
+        time.sleep(0.5)
+
+
+def search(client, collection, queries, k, params):
+    ids, times = [], []
+    for query in queries:
+        tik = time.perf_counter()
+        hits = client.search_batch(collection, requests=[SearchRequest(vector=query.tolist(), limit=k, params=params)])[0]
+        times.append(time.perf_counter() - tik)
+        ids.append([hit.id for hit in hits])
+    return ids, np.array(times) * 1000
+
+
+def ram_mb(profile, points):
+    """Vector memory: int8 copies (quantized) plus fp32 originals unless they are on disk."""
+    quantized = points * DIM if profile.quantization else 0
+    originals = 0 if profile.vectors_on_disk else points * DIM * 4
+    return (quantized + originals) / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=100000)
+    parser.add_argument('--photos-per-identity', type=int, default=4)
+    parser.add_argument('--noise', type=float, default=0.6)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--ef', type=int, nargs='+', default=[32, 64, 128, 256])
+    parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument('--qdrant-url', default='http://localhost:6333')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    identities, vectors = gallery(rng, args.points, args.photos_per_identity, args.noise)
+    queries = identities[rng.integers(0, len(identities), args.queries)]
+    queries = queries + args.noise * rng.standard_normal(queries.shape).astype(np.float32)
+
+    client = QdrantClient(location=':memory:') if args.qdrant_url == ':memory:' else QdrantClient(url=args.qdrant_url)
+    exact = SearchParams(exact=True, quantization=QuantizationSearchParams(ignore=True))
+
+    print(f"{'profile':<11}{'ef':>7}{'recall@1':>10}{f'recall@{args.k}':>11}{'p50 ms':>9}{'p99 ms':>9}{'vector RAM MB':>15}")
+    truth = None
+    for name in args.profiles:
+        profile = PROFILES[name]
+        collection = f"bench_{name}_{uuid.uuid4().hex[:6]}"
+        try:
+            create(client, collection, profile, vectors)
+            if truth is None:
+                truth, _ = search(client, collection, queries, args.k, exact)
+            for ef in [*args.ef, None]:
+                params = search_params(profile, hnsw_ef=ef, exact=ef is None)
+                ids, times = search(client, collection, queries, args.k, params)
+                recall1 = np.mean([found[:1] == expected[:1] for found, expected in zip(ids, truth)])
+                recall_k = np.mean([len(set(found) & set(expected)) / len(expected) for found, expected in zip(ids, truth)])
+                print(f"{name:<11}{ef or 'exact':>7}{recall1:>10.3f}{recall_k:>11.3f}"
+                      f"{np.percentile(times, 50):>9.2f}{np.percentile(times, 99):>9.2f}{ram_mb(profile, args.points):>15.1f}")
+        finally:
+            client.delete_collection(collection)
+
+
+if __name__ == '__main__':
+    main()
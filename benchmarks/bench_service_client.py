@@ -0,0 +1,103 @@
+"""Timings of the API's async model-service client against a local stub server.
+
+Run from the repository root (needs the face_recognition_api requirements):
+    python benchmarks/bench_service_client.py --delay 0.2 --concurrency 16 --rounds 5
+
+The stub is a tiny keep-alive HTTP server whose endpoint answers after --delay seconds. For each
+max_concurrency the client makes --rounds rounds of --concurrency simultaneous calls and prints the
+round time, the calls per second and the per-call latency; with --delay 0 the latency is the client's
+own overhead. The behaviour (overlap, keep-alive, bounded concurrency, retries, breaker) is covered by
+tests/test_service_client.py.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'face_recognition_api')))
+for name in ('POSTGRES_HOST', 'POSTGRES_USER', 'POSTGRES_PASSWORD', 'POSTGRES_DB'):
+    os.environ.setdefault(name, 'unused')
+from app.services.service_client import CircuitBreaker, ServiceClient
+
+RESPONSE = b'{"ok": true}'
+
+
+def stub_handler(delay):
+    """HTTP/1.1 keep-alive handler answering every request after delay seconds."""
+    async def handle(reader, writer):
+        try:
+            while True:
+                if not await reader.readline():
+                    break
+                length = 0
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    key, _, value = line.decode().partition(":")
+                    if key.lower() == "content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                await asyncio.sleep(delay)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(RESPONSE), RESPONSE))
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def timed_call(client, i):
+    tik = time.perf_counter()
+    await client.post("/slow", json={"i": i})
+    return time.perf_counter() - tik
+
+
+async def run(args):
+    server = await asyncio.start_server(stub_handler(args.delay), '127.0.0.1', 0)
+    url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    rows = []
+    for max_concurrency in args.max_concurrency:
+        client = ServiceClient(
+            "stub", url, timeout_s=30, connect_timeout_s=1, max_connections=max(args.concurrency, 1),
+            max_concurrency=max_concurrency, retries=0, backoff_s=0.01, breaker=CircuitBreaker(3, reset_s=60),
+        )
+        await asyncio.gather(*(timed_call(client, i) for i in range(args.concurrency)))  # opens the connections
+        latencies, round_times = [], []
+        for _ in range(args.rounds):
+            tik = time.perf_counter()
+            latencies += await asyncio.gather(*(timed_call(client, i) for i in range(args.concurrency)))
+            round_times.append(time.perf_counter() - tik)
+        await client.aclose()
+        latencies_ms = np.array(latencies) * 1000
+        rows.append((
+            max_concurrency,
+            float(np.mean(round_times)),
+            args.concurrency * args.rounds / sum(round_times),
+            float(np.percentile(latencies_ms, 50)),
+            float(np.percentile(latencies_ms, 99)),
+        ))
+    server.close()
+    await server.wait_closed()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--delay', type=float, default=0.2)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--max-concurrency', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    print(f"{args.concurrency} simultaneous calls, stub delay {args.delay * 1000:.0f} ms, {args.rounds} rounds")
+    print(f"{'max_conc':>9}{'round s':>10}{'calls/s':>10}{'p50 ms':>9}{'p99 ms':>9}")
+    for max_concurrency, round_s, calls_per_s, p50, p99 in asyncio.run(run(args)):
+        print(f"{max_concurrency:>9}{round_s:>10.3f}{calls_per_s:>10.1f}{p50:>9.1f}{p99:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Offline evaluation of keyframe detection + tracking against per-frame detection on a video file.
+
+Run from the repository root (needs the detector weights and a local video):
+    python benchmarks/bench_tracking.py --video door_camera.mp4 --keyframe-interval 10
+
+Every frame is detected once as the reference. The tracker then replays the same frames,
+calling the detector only when it asks for a keyframe. Reported: detector calls saved,
+box IoU / center and landmark drift of tracked frames against the reference, and fps of both modes.
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'detection_service')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ml_common')))
+from model_loader import create_session
+from postprocess import non_max_suppression_face, rescale_detections
+from preprocess import BatchBuffer
+from tracking import FaceTracker, box_iou
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', required=True)
+    parser.add_argument('--model', default=os.path.join(os.path.dirname(__file__), '..', 'detection_service', 'yolov6s_face.onnx'))
+    parser.add_argument('--keyframe-interval', type=int, default=10)
+    parser.add_argument('--min-confidence', type=float, default=0.5)
+    parser.add_argument('--max-frames', type=int, default=0)
+    args = parser.parse_args()
+
+    session = create_session(args.model)
+    input_name = session.get_inputs()[0].name
+    buffer = BatchBuffer((640, 640))
+
+    def detect(frame_bgr):
+        batch, prepared_data, _ = buffer.fill([frame_bgr], bgr=True)
+        out = session.run(None, {input_name: batch})[0]
+        return rescale_detections(non_max_suppression_face(out, conf_thres=0.4, iou_thres=0.45, max_det=300), prepared_data)[0]
+
+    capture = cv2.VideoCapture(args.video)
+    frames = []
+    while not args.max_frames or len(frames) < args.max_frames:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(frame)
+    capture.release()
+    if not frames:
+        raise SystemExit(f"Could not read frames from {args.video}")
+
+    tik = time.perf_counter()
+    reference = [detect(frame) for frame in frames]
+    per_frame_fps = len(frames) / (time.perf_counter() - tik)
+
+    tracker = FaceTracker(keyframe_interval=args.keyframe_interval, min_confidence=args.min_confidence)
+    tik = time.perf_counter()
+    tracked = []
+    for frame in frames:
+        faces = tracker.propagate(frame)
+        keyframe = faces is None
+        if keyframe:
+            faces = tracker.correct(frame, detect(frame))
+        tracked.append((keyframe, faces))
+    tracking_fps = len(frames) / (time.perf_counter() - tik)
+
+    ious, center_err, landmark_err, missed, ids = [], [], [], 0, set()
+    for ref, (keyframe, faces) in zip(reference, tracked):
+        ids.update(face["track_id"] for face in faces)
+        if keyframe or not ref:
+            continue
+        if not faces:
+            missed += len(ref)
+            continue
+        ref_boxes = np.array([d["bbox"] for d in ref], dtype=np.float64)
+        iou = box_iou(ref_boxes, np.array([f["bbox"] for f in faces], dtype=np.float64))
+        for r, best in enumerate(iou.argmax(1)):
+            if iou[r, best] <= 0:
+                missed += 1
+                continue
+            size = np.sqrt(np.prod(ref_boxes[r, 2:] - ref_boxes[r, :2]))
+            ref_kps = np.array(ref[r]["keypoints"], dtype=np.float64).reshape(5, 2)
+            kps = np.array(faces[best]["keypoints"], dtype=np.float64).reshape(5, 2)
+            ref_center = (ref_boxes[r, :2] + ref_boxes[r, 2:]) / 2
+            center = (np.array(faces[best]["bbox"][:2]) + np.array(faces[best]["bbox"][2:])) / 2
+            ious.append(iou[r, best])
+            center_err.append(np.linalg.norm(center - ref_center) / size)
+            landmark_err.append(np.linalg.norm(kps - ref_kps, axis=1).mean() / size)
+
+    stats = tracker.stats()
+    print(f"frames:                  {stats['frames']}")
+    print(f"detector calls:          {stats['keyframes']} ({stats['detector_calls_saved']} saved, "
+          f"{stats['detector_calls_saved'] / stats['frames'] * 100:.1f}%)")
+    print(f"tracks:                  {len(ids)}")
+    if ious:
+        print(f"box IoU vs per-frame:    mean {np.mean(ious):.3f}, p5 {np.percentile(ious, 5):.3f}")
+        print(f"center drift:            mean {np.mean(center_err) * 100:.1f}% of face size")
+        print(f"landmark drift:          mean {np.mean(landmark_err) * 100:.1f}% of face size")
+    print(f"faces lost between keys: {missed}")
+    print(f"fps per-frame / tracked: {per_frame_fps:.1f} / {tracking_fps:.1f}")
+
+
+if __name__ == '__main__':
+    main()
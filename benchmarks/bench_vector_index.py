@@ -0,0 +1,97 @@
+"""Search latency against gallery size: the API's local in-process index vs Qdrant.
+
+Run from the repository root (needs the face_recognition_api requirements and a Qdrant to compare with):
+    python benchmarks/bench_vector_index.py --sizes 1000 10000 50000 100000 --qdrant-url http://localhost:6333
+    python benchmarks/bench_vector_index.py --qdrant-url :memory:   # no server, Qdrant's local mode (not representative)
+
+Every gallery size is filled with random unit vectors, in a temporary Qdrant collection and in a LocalIndex
+(float32 and float16). Then --queries single-embedding top-1 searches, like /api/get_person makes, are timed
+per backend; with a server the Qdrant numbers include the HTTP round-trip the local index saves.
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'face_recognition_api')))
+for name in ('POSTGRES_HOST', 'POSTGRES_USER', 'POSTGRES_PASSWORD', 'POSTGRES_DB'):
+    os.environ.setdefault(name, 'unused')
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, PointStruct, SearchRequest, VectorParams
+from app.repositories.local_index import LocalIndex
+
+DIM = 512
+UPLOAD_BATCH = 1024
+
+
+def unit(rng, n):
+    vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def latencies(search, queries):
+    times = []
+    for query in queries:
+        tik = time.perf_counter()
+        search(query)
+        times.append(time.perf_counter() - tik)
+    return np.array(times) * 1000
+
+
+def fill_qdrant(client, collection, vectors, ids):
+    if client.collection_exists(collection):
+        client.delete_collection(collection)
+    client.create_collection(collection, vectors_config=VectorParams(size=DIM, distance=Distance.COSINE))
+    for start in range(0, len(vectors), UPLOAD_BATCH):
+        client.upsert(collection, points=[
+            PointStruct(id=point_id, vector=vector.tolist(), payload={"person_id": start + i})
+            for i, (point_id, vector) in enumerate(zip(ids[start:start + UPLOAD_BATCH], vectors[start:start + UPLOAD_BATCH]))
+        ], wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000, 100000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--qdrant-url', default='http://localhost:6333')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    client = QdrantClient(location=':memory:') if args.qdrant_url == ':memory:' else QdrantClient(url=args.qdrant_url)
+    collection = f"bench_{uuid.uuid4().hex[:8]}"
+
+    print(f"{'gallery':>9}{'backend':>10}{'p50 ms':>10}{'p99 ms':>10}{'top-1 agree':>13}")
+    try:
+        for size in args.sizes:
+            vectors = unit(rng, size)
+            ids = [str(uuid.uuid4()) for _ in range(size)]
+            # queries near known points, so top-1 is meaningful and comparable between backends
+            targets = rng.integers(0, size, args.queries)
+            queries = vectors[targets] + 0.05 * rng.standard_normal((args.queries, DIM)).astype(np.float32)
+
+            fill_qdrant(client, collection, vectors, ids)
+            qdrant_top = []
+            times = latencies(lambda q: qdrant_top.append(client.search_batch(
+                collection, requests=[SearchRequest(vector=q.tolist(), limit=1, with_payload=True)])[0][0].id), queries)
+            expected = [ids[t] for t in targets]
+            rows = [("qdrant", times, np.mean([a == b for a, b in zip(qdrant_top, expected)]))]
+
+            for dtype in ("float32", "float16"):
+                index = LocalIndex(DIM, max_size=size, dtype=dtype)
+                index.rebuild([(ids, vectors, [{}] * size)])
+                local_top = []
+                times = latencies(lambda q: local_top.append(index.search(q[None], threshold=-1.0, limit=1)[0][0][0]), queries)
+                rows.append((f"local {dtype[-2:]}", times, np.mean([a == b for a, b in zip(local_top, expected)])))
+
+            for backend, times, agree in rows:
+                print(f"{size:>9}{backend:>10}{np.percentile(times, 50):>10.3f}{np.percentile(times, 99):>10.3f}{agree:>13.3f}")
+    finally:
+        client.delete_collection(collection)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Offline evaluation of the face quality gate: what every min_quality threshold rejects, saves and costs.
+
+Run from the repository root (needs the model weights and a labelled folder of face photos,
+one sub-folder per person, like eval_tiers.py):
+    python benchmarks/eval_quality_gate.py --images faces_by_person --thresholds 0 0.2 0.3 0.5 --report quality_report.json
+
+The largest face of every photo is detected and embedded with the tier of --tier and scored like the
+embedding service scores it (ml_common/quality.py, thresholds from the QUALITY_* environment variables).
+The report has, per threshold:
+    rejected: faces below it, in total and by reason (small / low_confidence / pose / blur)
+    saved: embedder forward passes not run, and the milliseconds they take at the measured per-face cost
+    identification: leave-one-out rank-1 of the accepted faces against each other, TAR at --far over their pairs
+    rejected_rank1: rank-1 the rejected faces would have had, against the whole set; lower than the
+        accepted rank-1 means the gate drops the faces that would have been misidentified
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from dataclasses import asdict
+
+import numpy as np
+
+from eval_tiers import DETECTOR, EMBEDDER, detect, embed, identification_metrics, load_dataset  # sets up sys.path
+from alignment import largest_face_id, similarity_transforms, warp_faces
+from buckets import DEFAULT_BUCKETS, parse_buckets, scale_buckets, usable_buckets
+from ml_common.model_loader import SessionConfig, create_session, resolve_model_path
+from ml_common.quality import QUALITY_REASONS, QualityConfig, face_quality
+from ml_common.tiers import TIER_NAMES, tiers_from_env
+
+
+def score_faces(images, detections, config):
+    """Quality of the largest face of every image, None where no alignable face was found."""
+    scores = []
+    for img, dets in zip(images, detections):
+        if not dets:
+            scores.append(None)
+            continue
+        detection = dets[largest_face_id(dets)]
+        transform = similarity_transforms(np.asarray(detection['keypoints'], dtype=np.float32).reshape(1, 5, 2))
+        if not np.isfinite(transform).all():
+            scores.append(None)
+            continue
+        scores.append(face_quality(detection, warp_faces(img, transform)[0], config))
+    return scores
+
+
+def rank1_of(embeddings, labels, rows):
+    """Leave-one-out rank-1 of the faces in rows, searched against every embedded face; None without any."""
+    found = ~np.isnan(embeddings).any(axis=1)
+    emb = np.where(found[:, None], embeddings, 0)
+    same = labels[:, None] == labels[None, :]
+    hits = []
+    for i in rows:
+        if same[i].sum() < 2:
+            continue
+        sim = emb @ emb[i]
+        sim[i] = -np.inf
+        sim[~found] = -np.inf
+        hits.append(bool(same[i, sim.argmax()]))
+    return float(np.mean(hits)) if hits else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='folder with one sub-folder of face photos per person')
+    parser.add_argument('--detector', default=DETECTOR)
+    parser.add_argument('--embedder', default=EMBEDDER)
+    parser.add_argument('--tier', default='accurate', choices=TIER_NAMES)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.0, 0.1, 0.2, 0.3, 0.5])
+    parser.add_argument('--max-per-person', type=int, default=10)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--far', type=float, default=0.01)
+    parser.add_argument('--report', default='quality_report.json')
+    args = parser.parse_args()
+
+    images, labels = load_dataset(args.images, args.max_per_person)
+    if not images:
+        raise SystemExit(f"No images found in {args.images}")
+
+    config = SessionConfig.from_env()
+    tier = tiers_from_env(
+        default_detection_variant=os.environ.get("DETECTION_MODEL_VARIANT", "fp32"),
+        default_embedding_variant=os.environ.get("EMBEDDING_MODEL_VARIANT", "fp32"),
+    )[args.tier]
+    detector = create_session(resolve_model_path(args.detector, tier.detection_variant), config)
+    embedder = create_session(resolve_model_path(args.embedder, tier.embedding_variant), config)
+    buckets = usable_buckets(
+        scale_buckets(parse_buckets(os.environ.get("DETECTION_BUCKETS", DEFAULT_BUCKETS)), tier.detector_size),
+        detector.get_inputs()[0].shape,
+    )
+
+    detections = detect(detector, buckets, images, args.batch)
+    embeddings = embed(embedder, images, detections, tier.flip_tta, args.batch)
+    tik = time.perf_counter()
+    quality_config = QualityConfig.from_env()
+    scores = score_faces(images, detections, quality_config)
+    score_ms = (time.perf_counter() - tik) * 1000 / max(sum(s is not None for s in scores), 1)
+
+    # per-face embedding cost, measured on full batches like the service runs them
+    sample, sample_dets = images[:args.batch], detections[:args.batch]
+    faces = sum(bool(d) for d in sample_dets)
+    embed_times = []
+    for _ in range(args.repeat):
+        tik = time.perf_counter()
+        embed(embedder, sample, sample_dets, tier.flip_tta, args.batch)
+        embed_times.append(time.perf_counter() - tik)
+    face_ms = float(np.median(embed_times)) * 1000 / max(faces, 1)
+
+    scored = [i for i, s in enumerate(scores) if s is not None]
+    report = {
+        "images": len(images), "faces": len(scored), "tier": args.tier, "config": asdict(quality_config),
+        "embed_ms_per_face": face_ms, "score_ms_per_face": score_ms, "thresholds": {},
+    }
+    for threshold in args.thresholds:
+        rejected = [i for i in scored if scores[i]["quality"] < threshold]
+        accepted = embeddings.copy()
+        accepted[rejected] = np.nan
+        identification = identification_metrics(accepted, labels, args.far)
+        identification["rank1"] = rank1_of(accepted, labels, sorted(set(scored) - set(rejected)))
+        report["thresholds"][str(threshold)] = {
+            "rejected": len(rejected),
+            "by_reason": {reason: sum(scores[i]["reason"] == reason for i in rejected) for reason in QUALITY_REASONS},
+            "saved": {
+                "forward_passes": len(rejected) * (1 + tier.flip_tta),
+                "embed_ms": len(rejected) * face_ms,
+            },
+            "identification": identification,
+            "rejected_rank1": rank1_of(embeddings, labels, rejected),
+        }
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{len(scored)} faces, embedding {face_ms:.2f} ms/face, scoring {score_ms:.2f} ms/face")
+    header = ''.join(f"{reason:>15}" for reason in QUALITY_REASONS)
+    print(f"{'min_quality':>12}{'rejected':>10}{header}{'passes':>8}{'ms saved':>10}{'rank1':>8}{'TAR':>8}{'rej rank1':>11}")
+    for threshold, r in report["thresholds"].items():
+        reasons = ''.join(f"{r['by_reason'][reason]:>15}" for reason in QUALITY_REASONS)
+        rank1, rejected_rank1 = ('-' if v is None else f"{v:.3f}" for v in (r['identification']['rank1'], r['rejected_rank1']))
+        print(f"{threshold:>12}{r['rejected']:>10}{reasons}{r['saved']['forward_passes']:>8}{r['saved']['embed_ms']:>10.1f}"
+              f"{rank1:>8}{r['identification']['tar_at_far']:>8.3f}{rejected_rank1:>11}")
+    print(f"[INFO] report written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
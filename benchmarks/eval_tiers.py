@@ -0,0 +1,200 @@
+"""Offline evaluation of the quality tiers: accuracy and throughput of fast / balanced / accurate.
+
+Run from the repository root (needs the model weights and a labelled folder of face photos,
+one sub-folder per person, e.g. an LFW-style dump):
+    python benchmarks/eval_tiers.py --images faces_by_person --report tiers_report.json
+
+Tiers are read like the services read them (TIER_<NAME>_* and *_MODEL_VARIANT environment variables),
+and every tier runs end to end: detection at its input size and variant, alignment of the largest face,
+embedding with or without flip-TTA. The report has, per tier:
+    detection: recall / precision of its boxes against the accurate tier (IoU >= --match-iou)
+    identification: leave-one-out rank-1 accuracy over people with at least two photos
+    verification: TAR at --far over all photo pairs
+    throughput: images/s of detection and faces/s of embedding on --batch sized batches
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'detection_service')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'embedding_service')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ml_common')))
+from buckets import DEFAULT_BUCKETS, group_by_bucket, parse_buckets, scale_buckets, usable_buckets
+from detection_service.postprocess import non_max_suppression_face, rescale_detections
+from detection_service.preprocess import BatchBuffer
+from embedding_service.preprocess import FaceBatchBuffer, face_slots, largest_face_id, similarity_transforms
+from ml_common.model_loader import SessionConfig, create_session, resolve_model_path
+from ml_common.tiers import TIER_NAMES, tiers_from_env
+from quantize_models import match_boxes
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DETECTOR = os.path.join(ROOT, 'detection_service', 'yolov6s_face.onnx')
+EMBEDDER = os.path.join(ROOT, 'embedding_service', 'LVFace-S_Glint360K.onnx')
+EMBEDDING_DIM = 512
+
+
+def load_dataset(folder, max_per_person):
+    images, labels = [], []
+    for person in sorted(os.listdir(folder)):
+        person_dir = os.path.join(folder, person)
+        if not os.path.isdir(person_dir):
+            continue
+        for name in sorted(os.listdir(person_dir))[:max_per_person]:
+            img = cv2.imread(os.path.join(person_dir, name))
+            if img is not None:
+                images.append(img)
+                labels.append(person)
+    return images, np.array(labels)
+
+
+def detect(session, buckets, imgs_bgr, batch):
+    """Detections of every image, grouped into buckets and batches like detect_batch does."""
+    results = [None] * len(imgs_bgr)
+    groups = group_by_bucket([img.shape[:2] for img in imgs_bgr], buckets)
+    for bucket, indices in groups.items():
+        buffer = BatchBuffer(bucket)
+        for start in range(0, len(indices), batch):
+            chunk = indices[start:start + batch]
+            tensor, prepared_data, _ = buffer.fill([imgs_bgr[i] for i in chunk], bgr=True)
+            out = session.run(None, {session.get_inputs()[0].name: tensor})[0]
+            dets = rescale_detections(non_max_suppression_face(out, conf_thres=0.4, iou_thres=0.45, max_det=300), prepared_data)
+            for i, d in zip(chunk, dets):
+                results[i] = d
+    return results
+
+
+def embed(session, imgs_bgr, detections, flip_tta, batch):
+    """Unit embedding of the largest face of every image, NaN rows where no face was found."""
+    embeddings = np.full((len(imgs_bgr), EMBEDDING_DIM), np.nan, dtype=np.float32)
+    faces = [i for i, dets in enumerate(detections) if dets]
+    buffer = FaceBatchBuffer()
+    for start in range(0, len(faces), batch):
+        chunk = faces[start:start + batch]
+        kps = np.array([detections[i][largest_face_id(detections[i])]['keypoints'] for i in chunk], dtype=np.float32)
+        transforms = similarity_transforms(kps.reshape(-1, 5, 2))
+        ok = np.isfinite(transforms).all(axis=(1, 2))
+        chunk = [i for i, keep in zip(chunk, ok) if keep]
+        if not chunk:
+            continue
+        flip = np.full(len(chunk), flip_tta)
+        out = session.run(None, {session.get_inputs()[0].name: buffer.fill([imgs_bgr[i] for i in chunk], transforms[ok], flip)})[0]
+        slots = face_slots(flip)
+        emb = out[slots]
+        emb[flip] = (emb[flip] + out[slots[flip] + 1]) / 2.0
+        embeddings[chunk] = emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+    return embeddings
+
+
+def identification_metrics(embeddings, labels, far):
+    found = ~np.isnan(embeddings).any(axis=1)
+    emb = np.where(found[:, None], embeddings, 0)
+    sim = emb @ emb.T
+    np.fill_diagonal(sim, -np.inf)
+    sim[~found] = -np.inf
+    sim[:, ~found] = -np.inf
+
+    same = labels[:, None] == labels[None, :]
+    has_pair = same.sum(axis=1) > 1
+    rank1 = (same[np.arange(len(labels)), sim.argmax(axis=1)] & found)[has_pair].mean() if has_pair.any() else 0.0
+
+    upper = np.triu_indices(len(labels), k=1)
+    pair_sim, pair_same = sim[upper], same[upper]
+    genuine, impostor = pair_sim[pair_same], pair_sim[~pair_same & np.isfinite(pair_sim)]
+    threshold = np.quantile(impostor, 1 - far) if len(impostor) else 1.0
+    tar = float((genuine > threshold).mean()) if len(genuine) else 0.0
+    return {"rank1": float(rank1), "tar_at_far": tar, "threshold": float(threshold), "faces_found": float(found.mean())}
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        tik = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - tik)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='folder with one sub-folder of face photos per person')
+    parser.add_argument('--detector', default=DETECTOR)
+    parser.add_argument('--embedder', default=EMBEDDER)
+    parser.add_argument('--max-per-person', type=int, default=10)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--far', type=float, default=0.01)
+    parser.add_argument('--match-iou', type=float, default=0.5)
+    parser.add_argument('--report', default='tiers_report.json')
+    args = parser.parse_args()
+
+    images, labels = load_dataset(args.images, args.max_per_person)
+    if not images:
+        raise SystemExit(f"No images found in {args.images}")
+
+    config = SessionConfig.from_env()
+    tiers = tiers_from_env(
+        default_detection_variant=os.environ.get("DETECTION_MODEL_VARIANT", "fp32"),
+        default_embedding_variant=os.environ.get("EMBEDDING_MODEL_VARIANT", "fp32"),
+    )
+    buckets = parse_buckets(os.environ.get("DETECTION_BUCKETS", DEFAULT_BUCKETS))
+    sample = images[:args.batch]
+
+    report = {"images": len(images), "people": len(set(labels)), "tiers": {}}
+    reference = None
+    for name in reversed(TIER_NAMES):  # accurate first, it is the detection reference
+        tier = tiers[name]
+        detector = create_session(resolve_model_path(args.detector, tier.detection_variant), config)
+        embedder = create_session(resolve_model_path(args.embedder, tier.embedding_variant), config)
+        tier_buckets = usable_buckets(scale_buckets(buckets, tier.detector_size), detector.get_inputs()[0].shape)
+
+        detections = detect(detector, tier_buckets, images, args.batch)
+        if reference is None:
+            reference = detections
+        ref_boxes = [[d["bbox"] for d in dets] for dets in reference]
+        boxes = [[d["bbox"] for d in dets] for dets in detections]
+        matched = sum(match_boxes(r, c, args.match_iou) for r, c in zip(ref_boxes, boxes))
+        embeddings = embed(embedder, images, detections, tier.flip_tta, args.batch)
+
+        sample_dets = detections[:args.batch]
+        faces = sum(bool(d) for d in sample_dets)
+        detect_s = timed(lambda: detect(detector, tier_buckets, sample, args.batch), args.repeat)
+        embed_s = timed(lambda: embed(embedder, sample, sample_dets, tier.flip_tta, args.batch), args.repeat)
+
+        report["tiers"][name] = {
+            "config": {
+                "detector_size": tier.detector_size,
+                "detection_variant": tier.detection_variant,
+                "embedding_variant": tier.embedding_variant,
+                "flip_tta": tier.flip_tta,
+            },
+            "detection": {
+                "recall": matched / max(sum(map(len, ref_boxes)), 1),
+                "precision": matched / max(sum(map(len, boxes)), 1),
+            },
+            "identification": identification_metrics(embeddings, labels, args.far),
+            "throughput": {
+                "detect_images_per_s": len(sample) / detect_s,
+                "embed_faces_per_s": faces / embed_s if faces else 0.0,
+            },
+        }
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'tier':<10}{'size':>6}{'flip':>6}{'recall':>8}{'rank1':>8}{'TAR':>8}{'det img/s':>11}{'emb face/s':>12}")
+    for name in TIER_NAMES:
+        r = report["tiers"][name]
+        print(f"{name:<10}{r['config']['detector_size']:>6}{str(r['config']['flip_tta']):>6}"
+              f"{r['detection']['recall']:>8.3f}{r['identification']['rank1']:>8.3f}{r['identification']['tar_at_far']:>8.3f}"
+              f"{r['throughput']['detect_images_per_s']:>11.1f}{r['throughput']['embed_faces_per_s']:>12.1f}")
+    print(f"[INFO] report written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Build INT8 variants of the detector and the embedder and report accuracy/latency against fp32.
+
+Run from the repository root (needs the fp32 weights, onnx and a folder of local face photos):
+    python benchmarks/quantize_models.py --images example-data --report quantization_report.json
+
+For every model it writes <model>.int8_dynamic.onnx and <model>.int8_static.onnx next to the
+fp32 file, the names resolve_model_path and the *_MODEL_VARIANT settings of the services expect.
+Static quantization is calibrated on --calibration-size of the --images photos, preprocessed exactly
+like the services do. The report is measured on other photos, never seen by the calibration: the next
+--eval-size photos of --images (in a fixed shuffled order), or the --eval-images folder.
+
+The report compares every variant with fp32:
+    detection: precision / recall of int8 boxes against the fp32 boxes (IoU >= --match-iou)
+    embedding: cosine similarity between int8 and fp32 embeddings of the same aligned faces
+    both: median / p95 latency of a --batch sized batch
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ml_common')))
+from detection_service.postprocess import non_max_suppression_face, rescale_detections
+from detection_service.preprocess import BatchBuffer
+from embedding_service.preprocess import extract_largest_face_aligned, preprocess_image
+from ml_common.model_loader import SessionConfig, create_session, resolve_model_path
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DETECTOR = os.path.join(ROOT, 'detection_service', 'yolov6s_face.onnx')
+EMBEDDER = os.path.join(ROOT, 'embedding_service', 'LVFace-S_Glint360K.onnx')
+# Sessions for the report are built from the raw files, the optimized-graph cache would hide the variant under test.
+SESSION_CONFIG = SessionConfig(providers=["CPUExecutionProvider"], cache_dir="")
+
+
+class ArrayReader(CalibrationDataReader):
+    """Feeds preprocessed calibration tensors to quantize_static one at a time."""
+
+    def __init__(self, input_name, tensors):
+        self.input_name = input_name
+        self.tensors = iter(tensors)
+
+    def get_next(self):
+        tensor = next(self.tensors, None)
+        return None if tensor is None else {self.input_name: tensor}
+
+
+def image_paths(folder):
+    return sorted(p for ext in ('jpg', 'jpeg', 'png') for p in glob.glob(os.path.join(folder, f'*.{ext}')))
+
+
+def load_images(paths):
+    images = [cv2.imread(p) for p in paths]
+    return [img for img in images if img is not None]
+
+
+def split_images(args):
+    """Disjoint (calibration, evaluation) photos."""
+    paths = image_paths(args.images)
+    paths = [paths[i] for i in np.random.default_rng(0).permutation(len(paths))]  # file order often groups by person
+    calibration = paths[:args.calibration_size]
+    if args.eval_images:
+        seen = set(calibration)
+        evaluation = [p for p in image_paths(args.eval_images) if p not in seen]
+    else:
+        evaluation = paths[args.calibration_size:args.calibration_size + args.eval_size]
+    return load_images(calibration), load_images(evaluation)
+
+
+def detect(session, imgs_bgr):
+    buffer = BatchBuffer((640, 640))
+    batch, prepared_data, _ = buffer.fill([cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in imgs_bgr])
+    out = session.run(None, {session.get_inputs()[0].name: batch})[0]
+    return rescale_detections(non_max_suppression_face(out, conf_thres=0.4, iou_thres=0.45, max_det=300), prepared_data)
+
+
+def face_tensors(imgs_bgr, detections):
+    """(2F, 3, 112, 112) tensor of every largest face and its flip, like embed_batch builds it."""
+    tensors = []
+    for img, dets in zip(imgs_bgr, detections):
+        aligned = extract_largest_face_aligned(img, dets, output_size=112)
+        if aligned is not None:
+            face, _ = aligned
+            tensors += [preprocess_image(face), preprocess_image(cv2.flip(face, 1))]
+    return np.vstack(tensors) if tensors else np.zeros((0, 3, 112, 112), dtype=np.float32)
+
+
+def embed(session, tensors):
+    emb = session.run(None, {session.get_inputs()[0].name: tensors})[0]
+    emb = (emb[0::2] + emb[1::2]) / 2.0
+    return emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+
+
+def quantize(model_path, calibration, per_channel):
+    prepared = model_path.replace('.onnx', '.preprocessed.onnx')
+    quant_pre_process(model_path, prepared, skip_symbolic_shape=True)
+    try:
+        quantize_dynamic(prepared, resolve_model_path(model_path, 'int8_dynamic'), weight_type=QuantType.QInt8)
+        input_name = create_session(model_path, SESSION_CONFIG).get_inputs()[0].name
+        quantize_static(
+            prepared,
+            resolve_model_path(model_path, 'int8_static'),
+            ArrayReader(input_name, calibration),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=per_channel,
+        )
+    finally:
+        os.remove(prepared)
+
+
+def match_boxes(reference, candidate, iou_thres):
+    """Greedy one-to-one matching, returns the number of candidate boxes matching a reference box."""
+    matched, used = 0, set()
+    for box in candidate:
+        best, best_iou = None, iou_thres
+        for j, ref in enumerate(reference):
+            if j in used:
+                continue
+            iw = max(0, min(box[2], ref[2]) - max(box[0], ref[0]))
+            ih = max(0, min(box[3], ref[3]) - max(box[1], ref[1]))
+            inter = iw * ih
+            union = (box[2] - box[0]) * (box[3] - box[1]) + (ref[2] - ref[0]) * (ref[3] - ref[1]) - inter
+            if union > 0 and inter / union >= best_iou:
+                best, best_iou = j, inter / union
+        if best is not None:
+            used.add(best)
+            matched += 1
+    return matched
+
+
+def latency(session, tensor, repeat):
+    name = session.get_inputs()[0].name
+    session.run(None, {name: tensor})
+    times = []
+    for _ in range(repeat):
+        tik = time.perf_counter()
+        session.run(None, {name: tensor})
+        times.append((time.perf_counter() - tik) * 1000)
+    return {"median_ms": float(np.median(times)), "p95_ms": float(np.percentile(times, 95))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='folder with local face photos for calibration (and evaluation)')
+    parser.add_argument('--eval-images', default='', help='folder with the evaluation photos instead of the rest of --images')
+    parser.add_argument('--detector', default=DETECTOR)
+    parser.add_argument('--embedder', default=EMBEDDER)
+    parser.add_argument('--calibration-size', type=int, default=100)
+    parser.add_argument('--eval-size', type=int, default=100, help='evaluation photos taken from --images')
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--match-iou', type=float, default=0.5)
+    parser.add_argument('--skip-quantize', action='store_true', help='only rebuild the report from existing variants')
+    parser.add_argument('--report', default='quantization_report.json')
+    args = parser.parse_args()
+
+    calibration_images, images = split_images(args)
+    if not calibration_images:
+        raise SystemExit(f"No images found in {args.images}")
+    if not images:
+        raise SystemExit("No evaluation images left: pass --eval-images or more --images than --calibration-size")
+
+    fp32_detector = create_session(args.detector, SESSION_CONFIG)
+    if not args.skip_quantize:
+        calibration_faces = face_tensors(calibration_images, detect(fp32_detector, calibration_images))
+        if not len(calibration_faces):
+            raise SystemExit("The fp32 detector found no faces in --images, nothing to calibrate the embedder on")
+        buffer = BatchBuffer((640, 640))
+        calibration = [buffer.fill([cv2.cvtColor(img, cv2.COLOR_BGR2RGB)])[0].copy() for img in calibration_images]
+        quantize(args.detector, calibration, per_channel=True)
+        quantize(args.embedder, [calibration_faces[i:i + 1] for i in range(len(calibration_faces))], per_channel=True)
+
+    fp32_dets = detect(fp32_detector, images)
+    faces = face_tensors(images, fp32_dets)
+    if not len(faces):
+        raise SystemExit("The fp32 detector found no faces in the evaluation images")
+
+    det_batch = np.random.default_rng(0).random((args.batch, 3, 640, 640), dtype=np.float32)
+    emb_batch = np.random.default_rng(0).uniform(-1, 1, (2 * args.batch, 3, 112, 112)).astype(np.float32)
+    fp32_embedder = create_session(args.embedder, SESSION_CONFIG)
+    fp32_emb = embed(fp32_embedder, faces)
+
+    report = {
+        "calibration_images": len(calibration_images), "images": len(images), "faces": len(faces) // 2,
+        "detection": {}, "embedding": {},
+    }
+    for variant in ('fp32', 'int8_dynamic', 'int8_static'):
+        detector_path = resolve_model_path(args.detector, variant)
+        detector = create_session(detector_path, SESSION_CONFIG)
+        dets = detect(detector, images)
+        reference = [[d["bbox"] for d in img_dets] for img_dets in fp32_dets]
+        candidate = [[d["bbox"] for d in img_dets] for img_dets in dets]
+        matched = sum(match_boxes(r, c, args.match_iou) for r, c in zip(reference, candidate))
+        report["detection"][variant] = {
+            "size_mb": os.path.getsize(detector_path) / 2**20,
+            "precision": matched / max(sum(map(len, candidate)), 1),
+            "recall": matched / max(sum(map(len, reference)), 1),
+            "latency": latency(detector, det_batch, args.repeat),
+        }
+
+        embedder_path = resolve_model_path(args.embedder, variant)
+        embedder = create_session(embedder_path, SESSION_CONFIG)
+        cosine = np.sum(embed(embedder, faces) * fp32_emb, axis=1)
+        report["embedding"][variant] = {
+            "size_mb": os.path.getsize(embedder_path) / 2**20,
+            "cosine_mean": float(cosine.mean()),
+            "cosine_min": float(cosine.min()),
+            "cosine_p5": float(np.percentile(cosine, 5)),
+            "latency": latency(embedder, emb_batch, args.repeat),
+        }
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'detector':<14}{'MB':>8}{'precision':>11}{'recall':>9}{'batch ms':>10}{'p95 ms':>9}")
+    for variant, r in report["detection"].items():
+        print(f"{variant:<14}{r['size_mb']:>8.1f}{r['precision']:>11.3f}{r['recall']:>9.3f}"
+              f"{r['latency']['median_ms']:>10.1f}{r['latency']['p95_ms']:>9.1f}")
+    print(f"{'embedder':<14}{'MB':>8}{'cos mean':>11}{'cos p5':>9}{'batch ms':>10}{'p95 ms':>9}")
+    for variant, r in report["embedding"].items():
+        print(f"{variant:<14}{r['size_mb']:>8.1f}{r['cosine_mean']:>11.4f}{r['cosine_p5']:>9.4f}"
+              f"{r['latency']['median_ms']:>10.1f}{r['latency']['p95_ms']:>9.1f}")
+    print(f"[INFO] report written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
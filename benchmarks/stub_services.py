@@ -0,0 +1,212 @@
+"""Stand-in for the detection and embedding services: their HTTP API without models, for load tests.
+
+    python benchmarks/stub_services.py --port 3100 --detect-ms 15 --embed-ms 6 --workers 4
+
+One process serves the endpoints of both services that the API calls over HTTP (detect_encoded,
+detect_align, embed, embed_faces, embed_binary, embed_aligned, model_info), so DETECTION_URL and
+EMBEDDING_URL can both point at it; the *_frame endpoints answer 404 and the API falls back to uploads.
+Nothing is decoded: every call holds one of --workers slots of its service for --detect-ms per image or
+--embed-ms per face (plus exponential --jitter-ms), which stands in for the batched model.
+
+Identity: an image that carries a JPEG comment "face:<identity>;<variant>" (see face_jpeg) has --faces
+faces whose embeddings are the unit vector of the identity plus --noise of the variant, so different
+images of one identity match each other and nothing else; any other image is an identity of its own.
+Aligned crops carry the two seeds in their first bytes, so embed_aligned gives the same embeddings.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+
+import numpy as np
+
+EMBEDDING_DIM = 512
+CROP_SHAPE = (112, 112, 3)
+MARKER = b"face:"
+
+
+def face_jpeg(jpeg: bytes, identity: str, variant: int = 0) -> bytes:
+    """jpeg with a comment segment naming the identity the stub embeds it as, one image per variant."""
+    comment = MARKER + f"{identity};{variant}".encode()
+    return jpeg[:2] + b"\xff\xfe" + struct.pack(">H", len(comment) + 2) + comment + jpeg[2:]
+
+
+def image_seeds(data: bytes) -> tuple[bytes, bytes]:
+    """(identity seed, variant seed) of an encoded image."""
+    start = data.find(MARKER, 0, 64)
+    if start < 0:
+        digest = hashlib.sha256(data).digest()
+        return digest, digest
+    end = data.index(b";", start)
+    return hashlib.sha256(data[start + len(MARKER):end]).digest(), hashlib.sha256(data).digest()
+
+
+def _unit(seed: bytes) -> np.ndarray:
+    vector = np.random.default_rng(int.from_bytes(seed[:8], "little")).standard_normal(EMBEDDING_DIM)
+    return vector / np.linalg.norm(vector)
+
+
+def embedding(identity: bytes, variant: bytes, face: int, noise: float) -> np.ndarray:
+    vector = _unit(hashlib.sha256(identity + bytes([face])).digest()) + noise * _unit(variant)
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def detections(count: int) -> list[dict]:
+    """count faces side by side, the first the largest."""
+    faces = []
+    for i in range(count):
+        size = 160 - 20 * min(i, 4)
+        x, y = 40 + 200 * i, 60
+        keypoints = [0.3, 0.4, 0.7, 0.4, 0.5, 0.6, 0.35, 0.8, 0.65, 0.8]
+        faces.append({
+            "bbox": [x, y, x + size, y + size],
+            "keypoints": [int(round((x, y)[k % 2] + v * size)) for k, v in enumerate(keypoints)],
+            "conf": 0.9,
+        })
+    return faces
+
+
+def selected(faces: list[dict], mode: str, max_faces) -> list[int]:
+    det_ids = list(range(len(faces)))  # already largest first
+    if mode == "largest":
+        return det_ids[:1]
+    return det_ids[:int(max_faces)] if max_faces else det_ids
+
+
+class Slots:
+    """Model capacity of one service: workers concurrent calls, each busy for its cost."""
+
+    def __init__(self, workers: int, jitter_ms: float, rng: np.random.Generator):
+        self.semaphore = asyncio.Semaphore(workers)
+        self.jitter_ms = jitter_ms
+        self.rng = rng
+
+    async def run(self, cost_ms: float):
+        async with self.semaphore:
+            jitter = self.rng.exponential(self.jitter_ms) if self.jitter_ms else 0.0
+            await asyncio.sleep((cost_ms + jitter) / 1000)
+
+
+def create_app(args):
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, Response
+    from starlette.routing import Route
+
+    rng = np.random.default_rng(0)
+    detection = Slots(args.workers, args.jitter_ms, rng)
+    embedder = Slots(args.workers, args.jitter_ms, rng)
+
+    def rows(seeds, det_ids):
+        return np.stack([embedding(*seeds, det_id, args.noise) for det_id in det_ids]) if det_ids \
+            else np.zeros((0, EMBEDDING_DIM), np.float32)
+
+    def embedding_result(matrix, det_ids, mode, embedding_format):
+        if embedding_format != "json":
+            data = matrix.astype("<f2" if embedding_format == "float16" else "<f4").tobytes()
+            return {"det_ids": det_ids, "embeddings": base64.b64encode(data).decode()}
+        if mode == "all":
+            return {"faces": [{"det_id": i, "embedding": row.tolist()} for i, row in zip(det_ids, matrix)]}
+        if not det_ids:
+            return {"error": "no_face"}
+        return {"embedding": matrix[0].tolist(), "best_det_id": det_ids[0]}
+
+    async def upload(request):
+        form = await request.form()
+        return await form["image"].read(), form
+
+    async def detect_encoded(request):
+        await upload(request)
+        await detection.run(args.detect_ms)
+        return JSONResponse(detections(args.faces))
+
+    async def detect_align(request):
+        data, form = await upload(request)
+        await detection.run(args.detect_ms)
+        faces = detections(args.faces)
+        det_ids = selected(faces, form.get("mode", "largest"), form.get("max_faces"))
+        crops = np.zeros((len(det_ids), *CROP_SHAPE), np.uint8)
+        identity, variant = image_seeds(data)
+        crops.reshape(len(det_ids), -1)[:, :64] = np.frombuffer(identity + variant, np.uint8)
+        return JSONResponse({"detections": faces, "det_ids": det_ids, "crops": base64.b64encode(crops.tobytes()).decode()})
+
+    async def embed_upload(request, mode):
+        data, form = await upload(request)
+        faces = json.loads(form["detections"])
+        det_ids = selected(faces, form.get("mode", mode), form.get("max_faces"))
+        await embedder.run(args.embed_ms * len(det_ids))
+        return rows(image_seeds(data), det_ids), det_ids, form
+
+    async def embed(request):
+        matrix, det_ids, _ = await embed_upload(request, "largest")
+        return JSONResponse(embedding_result(matrix, det_ids, "largest", "json"))
+
+    async def embed_faces(request):
+        matrix, det_ids, _ = await embed_upload(request, "all")
+        return JSONResponse(embedding_result(matrix, det_ids, "all", "json"))
+
+    async def embed_binary(request):
+        matrix, det_ids, form = await embed_upload(request, "largest")
+        dtype = form.get("dtype", "float32")
+        return Response(
+            matrix.astype("<f2" if dtype == "float16" else "<f4").tobytes(),
+            media_type="application/octet-stream",
+            headers={"X-Det-Ids": ",".join(map(str, det_ids)), "X-Embedding-Dtype": dtype},
+        )
+
+    async def embed_aligned(request):
+        body = await request.json()
+        crops = np.frombuffer(base64.b64decode(body["crops"]), np.uint8).reshape(-1, int(np.prod(CROP_SHAPE)))
+        det_ids = body["det_ids"]
+        await embedder.run(args.embed_ms * len(det_ids))
+        matrix = np.stack([embedding(crop[:32].tobytes(), crop[32:64].tobytes(), det_id, args.noise)
+                           for crop, det_id in zip(crops, det_ids)])
+        return JSONResponse(embedding_result(matrix, det_ids, body.get("mode", "all"), body.get("embedding_format", "json")))
+
+    async def not_found(request):
+        return JSONResponse({"error": "frames are not supported by the stub"}, status_code=404)
+
+    async def model_info(request):
+        return JSONResponse({"model_version": "stub", "variants": ["fp32"]})
+
+    async def health(request):
+        return JSONResponse({"status": "ok"})
+
+    routes = [
+        Route("/detect_encoded", detect_encoded, methods=["POST"]),
+        Route("/detect_align", detect_align, methods=["POST"]),
+        Route("/embed", embed, methods=["POST"]),
+        Route("/embed_faces", embed_faces, methods=["POST"]),
+        Route("/embed_binary", embed_binary, methods=["POST"]),
+        Route("/embed_aligned", embed_aligned, methods=["POST"]),
+        Route("/detect_frame", not_found, methods=["POST"]),
+        Route("/detect_align_frame", not_found, methods=["POST"]),
+        Route("/embed_frame", not_found, methods=["POST"]),
+        Route("/model_info", model_info, methods=["POST"]),
+        Route("/", health),
+    ]
+    return Starlette(routes=routes)
+
+
+def parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3100)
+    parser.add_argument('--detect-ms', type=float, default=15.0, help='model time per image')
+    parser.add_argument('--embed-ms', type=float, default=6.0, help='model time per face')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='mean of an exponential delay added to every call')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent calls per service')
+    parser.add_argument('--faces', type=int, default=1, help='faces per image')
+    parser.add_argument('--noise', type=float, default=0.5, help='weight of the per-image part of an embedding')
+    return parser
+
+
+def main():
+    import uvicorn
+    args = parser().parse_args()
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+STRIDE = 32  # largest stride of the yolov6s_face heads
+DEFAULT_BUCKETS = "640x640,640x384,480x640"  # square, 16:9 landscape, 3:4 portrait
+
+def parse_buckets(spec: str) -> list[tuple[int, int]]:
+    """
+    Parse a "WxH,WxH,..." bucket policy into a list of (height, width) input shapes.
+    Every side must be a multiple of the detector stride.
+    """
+    buckets = []
+    for item in spec.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        w, h = (int(v) for v in item.split("x"))
+        if w <= 0 or h <= 0 or w % STRIDE or h % STRIDE:
+            raise ValueError(f"Bucket {item} must have positive sides that are multiples of {STRIDE}")
+        if (h, w) not in buckets:
+            buckets.append((h, w))
+    if not buckets:
+        raise ValueError(f"Empty bucket policy: '{spec}'")
+    return buckets
+
+def usable_buckets(buckets: list[tuple[int, int]], input_shape: list) -> list[tuple[int, int]]:
+    """Keep only the buckets a model with the given [B, C, H, W] input shape accepts."""
+    height, width = input_shape[2], input_shape[3]
+    if isinstance(height, int) and isinstance(width, int):
+        if buckets != [(height, width)]:
+            logger.warning("Model input is fixed to %dx%d, shape buckets are disabled", width, height)
+        return [(height, width)]
+    return buckets
+
+def scale_buckets(buckets: list[tuple[int, int]], size: int) -> list[tuple[int, int]]:
+    """Scale a bucket policy so its longest side becomes size, sides rounded to the detector stride."""
+    base = max(max(bucket) for bucket in buckets)
+    scaled = []
+    for h, w in buckets:
+        bucket = tuple(max(STRIDE, round(side * size / base / STRIDE) * STRIDE) for side in (h, w))
+        if bucket not in scaled:
+            scaled.append(bucket)
+    return scaled
+
+def select_bucket(shape, buckets: list[tuple[int, int]]) -> tuple[int, int]:
+    """
+    Pick the smallest bucket that letterboxes an image of shape (height, width) at the same
+    scale as the largest square bucket would, so less padding costs no detail.
+    Falls back to the bucket with the largest scale.
+    """
+    base = max(max(bucket) for bucket in buckets)
+    base_ratio = min(base / shape[0], base / shape[1])
+    ratios = [min(h / shape[0], w / shape[1]) for h, w in buckets]
+
+    candidates = [i for i, r in enumerate(ratios) if r >= base_ratio * (1 - 1e-6)]
+    if candidates:
+        best = min(candidates, key=lambda i: buckets[i][0] * buckets[i][1])
+    else:
+        best = max(range(len(buckets)), key=lambda i: ratios[i])
+    return buckets[best]
+
+def group_by_bucket(shapes, buckets: list[tuple[int, int]]) -> dict[tuple[int, int], list[int]]:
+    """Indices of the images that fall into each bucket, in request order."""
+    groups: dict[tuple[int, int], list[int]] = {}
+    for idx, shape in enumerate(shapes):
+        groups.setdefault(select_bucket(shape, buckets), []).append(idx)
+    return groups
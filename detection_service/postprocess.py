@@ -1,22 +1,48 @@
-import time
 import numpy as np
-import torch
-import torchvision
 
 def xywh2xyxy(x):
     '''Convert boxes with shape [n, 4] from [x, y, w, h] to [x1, y1, x2, y2] where x1y1 is top-left, x2y2=bottom-right.'''
-    y = x.clone() if isinstance(x, torch.Tensor) else np.copy(x)
-    y[:, 0] = x[:, 0] - x[:, 2] / 2  # top left x
-    y[:, 1] = x[:, 1] - x[:, 3] / 2  # top left y
-    y[:, 2] = x[:, 0] + x[:, 2] / 2  # bottom right x
-    y[:, 3] = x[:, 1] + x[:, 3] / 2  # bottom right y
+    y = np.copy(x)
+    y[..., 0] = x[..., 0] - x[..., 2] / 2  # top left x
+    y[..., 1] = x[..., 1] - x[..., 3] / 2  # top left y
+    y[..., 2] = x[..., 0] + x[..., 2] / 2  # bottom right x
+    y[..., 3] = x[..., 1] + x[..., 3] / 2  # bottom right y
     return y
 
+def batched_nms(boxes: np.ndarray, scores: np.ndarray, groups: np.ndarray, iou_thres: float) -> np.ndarray:
+    """Greedy NMS over boxes of several independent groups (images / classes) at once.
+    Boxes only suppress boxes of the same group, so one pass over the whole batch gives the same
+    result as running torchvision.ops.nms per group.
+    Args:
+        boxes: (ndarray), with shape [N, 4] in xyxy format.
+        scores: (ndarray), with shape [N].
+        groups: (ndarray), with shape [N], integer group id of every box.
+        iou_thres: (float) iou threshold.
+    Returns:
+        indices of kept boxes, sorted by decreasing score.
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(-scores, kind='stable')
+
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.maximum(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0)
+        h = np.maximum(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter)
+        order = rest[(iou <= iou_thres) | (groups[rest] != groups[i])]
+    return np.asarray(keep, dtype=np.int64)
+
 def non_max_suppression_face(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, multi_label=False, max_det=300):
     """Runs Non-Maximum Suppression (NMS) on inference results.
-    This code is borrowed from: https://github.com/ultralytics/yolov5/blob/47233e1698b89fc437a4fb9463c815e9171be955/utils/general.py#L775
+    This code is adapted from: https://github.com/ultralytics/yolov5/blob/47233e1698b89fc437a4fb9463c815e9171be955/utils/general.py#L775
+    The whole batch is filtered and suppressed in one pass with NumPy, without torch.
     Args:
-        prediction: (tensor), with shape [N, 15 + num_classes], N is the number of bboxes.
+        prediction: (ndarray), with shape [B, N, 15 + num_classes], N is the number of bboxes.
         conf_thres: (float) confidence threshold.
         iou_thres: (float) iou threshold.
         classes: (None or list[int]), if a list is provided, nms only keep the classes you provide.
@@ -24,82 +50,102 @@ def non_max_suppression_face(prediction, conf_thres=0.25, iou_thres=0.45, classe
         multi_label: (bool), when it is set to True, one box can have multi labels, otherwise, one box only huave one label.
         max_det:(int), max number of output bboxes.
     Returns:
-         list of detections, echo item is one tensor with shape (num_boxes, 16), 16 is for [xyxy, ldmks, conf, cls].
+         list of detections, echo item is one ndarray with shape (num_boxes, 16), 16 is for [xyxy, conf, cls, ldmks].
     """
-
+    prediction = np.asarray(prediction, dtype=np.float32)
+    batch_size = prediction.shape[0]
     num_classes = prediction.shape[2] - 15  # number of classes
-    pred_candidates = torch.logical_and(prediction[..., 14] > conf_thres, torch.max(prediction[..., 15:], axis=-1)[0] > conf_thres)  # candidates
     # Check the parameters.
     assert 0 <= conf_thres <= 1, f'conf_thresh must be in 0.0 to 1.0, however {conf_thres} is provided.'
     assert 0 <= iou_thres <= 1, f'iou_thres must be in 0.0 to 1.0, however {iou_thres} is provided.'
 
     # Function settings.
-    max_wh = 4096  # maximum box width and height
-    max_nms = 30000  # maximum number of boxes put into torchvision.ops.nms()
-    time_limit = 10.0  # quit the function when nms cost time exceed the limit time.
+    max_nms = 30000  # maximum number of boxes per image put into nms
     multi_label &= num_classes > 1  # multiple labels per box
 
-    tik = time.time()
-    output = [torch.zeros((0, 16), device=prediction.device)] * prediction.shape[0]
-    for img_idx, x in enumerate(prediction):  # image index, image inference
-        x = x[pred_candidates[img_idx]]  # confidence
-
-        # If no box remains, skip the next process.
-        if not x.shape[0]:
-            continue
-
-        # confidence multiply the objectness
-        x[:, 15:] *= x[:, 14:15]  # conf = obj_conf * cls_conf
-
-        # (center x, center y, width, height) to (x1, y1, x2, y2)
-        box = xywh2xyxy(x[:, :4])
-
-        # Detections matrix's shape is  (n,16), each row represents (xyxy, conf, cls, lmdks)
-        if multi_label:
-            box_idx, class_idx = (x[:, 15:] > conf_thres).nonzero(as_tuple=False).T
-            x = torch.cat((box[box_idx], x[box_idx, class_idx + 15, None], class_idx[:, None].float(), x[box_idx, 4:14]), 1)
-        else:  # Only keep the class with highest scores.
-            conf, class_idx = x[:, 15:].max(1, keepdim=True)
-            x = torch.cat((box, conf, class_idx.float(), x[:, 4:14]), 1)[conf.view(-1) > conf_thres]
-
-        # Filter by class, only keep boxes whose category is in classes.
-        if classes is not None:
-            x = x[(x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)]
-
-        # Check shape
-        num_box = x.shape[0]  # number of boxes
-        if not num_box:  # no boxes kept.
-            continue
-        elif num_box > max_nms:  # excess max boxes' number.
-            x = x[x[:, 4].argsort(descending=True)[:max_nms]]  # sort by confidence
-
-        # Batched NMS
-        class_offset = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
-        boxes, scores = x[:, :4] + class_offset, x[:, 4]  # boxes (offset by class), scores
-        keep_box_idx = torchvision.ops.nms(boxes, scores, iou_thres)  # NMS
-        if keep_box_idx.shape[0] > max_det:  # limit detections
-            keep_box_idx = keep_box_idx[:max_det]
-
-        output[img_idx] = x[keep_box_idx]
-        if (time.time() - tik) > time_limit:
-            print(f'WARNING: NMS cost time exceed the limited {time_limit}s.')
-            break  # time limit exceeded
-
-    return output
-
-def rescale_detections(dets: list[torch.Tensor], resized_data: list[tuple]):
+    conf_thres = np.float32(conf_thres)
+    pred_candidates = np.logical_and(prediction[..., 14] > conf_thres, prediction[..., 15:].max(-1) > conf_thres)  # candidates
+    img_idx, anchor_idx = np.nonzero(pred_candidates)
+    x = prediction[img_idx, anchor_idx]  # (n, 15 + num_classes), rows grouped by image
+
+    # confidence multiply the objectness
+    x[:, 15:] *= x[:, 14:15]  # conf = obj_conf * cls_conf
+
+    # (center x, center y, width, height) to (x1, y1, x2, y2)
+    box = xywh2xyxy(x[:, :4])
+
+    # Detections matrix's shape is  (n,16), each row represents (xyxy, conf, cls, lmdks)
+    if multi_label:
+        box_idx, class_idx = np.nonzero(x[:, 15:] > conf_thres)
+        x = np.concatenate((box[box_idx], x[box_idx, class_idx + 15, None], class_idx[:, None].astype(np.float32), x[box_idx, 4:14]), 1)
+        img_idx = img_idx[box_idx]
+    else:  # Only keep the class with highest scores.
+        class_idx = x[:, 15:].argmax(1)
+        conf = x[:, 15:].max(1)
+        mask = conf > conf_thres
+        x = np.concatenate((box, conf[:, None], class_idx[:, None].astype(np.float32), x[:, 4:14]), 1)[mask]
+        img_idx = img_idx[mask]
+
+    # Filter by class, only keep boxes whose category is in classes.
+    if classes is not None:
+        mask = np.isin(x[:, 5], np.asarray(classes, dtype=np.float32))
+        x, img_idx = x[mask], img_idx[mask]
+
+    # Only keep max_nms most confident boxes of every image.
+    counts = np.bincount(img_idx, minlength=batch_size)
+    if counts.max(initial=0) > max_nms:
+        order = np.lexsort((-x[:, 4], img_idx))
+        rank = np.arange(order.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        order = order[rank < max_nms]
+        x, img_idx = x[order], img_idx[order]
+
+    # Batched NMS, every (image, class) pair is suppressed independently
+    groups = img_idx if agnostic else img_idx * max(num_classes, 1) + x[:, 5].astype(np.int64)
+    keep = batched_nms(x[:, :4], x[:, 4], groups, iou_thres)
+
+    # Limit detections, keep stays sorted by score so the first max_det of every image survive.
+    kept_img_idx = img_idx[keep]
+    order = np.argsort(kept_img_idx, kind='stable')
+    keep, kept_img_idx = keep[order], kept_img_idx[order]
+    counts = np.bincount(kept_img_idx, minlength=batch_size)
+    rank = np.arange(keep.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    keep = keep[rank < max_det]
+    counts = np.minimum(counts, max_det)
+
+    return np.split(x[keep], np.cumsum(counts)[:-1])
+
+def rescale_detections(dets: list[np.ndarray], resized_data: list[tuple]):
+    """Map boxes and landmarks of the whole batch from letterbox to original image coordinates.
+    Args:
+        dets: list of ndarray with shape (num_boxes, 16), output of non_max_suppression_face.
+        resized_data: list of (image, ratio, (dw, dh)) tuples, one per image.
+    Returns:
+        list of detections per image, every detection is a dict with bbox, keypoints and conf.
+    """
+    counts = [len(det) for det in dets]
+    if not sum(counts):
+        return [[] for _ in dets]
+
+    det = np.concatenate(dets).astype(np.float32, copy=False)
+    ratio = np.repeat(np.array([data[1] for data in resized_data], dtype=np.float32), counts)
+    offsets = np.array([(data[2][0] / data[1], data[2][1] / data[1]) for data in resized_data], dtype=np.float32)
+    offsets = np.repeat(offsets, counts, axis=0)
+
+    coords = np.concatenate((det[:, :4], det[:, 6:16]), 1)  # x1, y1, x2, y2, 5 x (x, y)
+    coords = coords / ratio[:, None] - np.tile(offsets, 7)
+    coords = coords.astype(np.int64).tolist()  # truncates toward zero like int()
+    confs = det[:, 4].tolist()
+
     out = []
-    for ind, det in enumerate(dets):
-        ratio = resized_data[ind][1]
-        dw, dh = resized_data[ind][2]
-        out.append([])
-        for x1, y1, x2, y2, conf, cls, *keypoints in det:
-            coord_to_origin = lambda value, is_x: int(value / ratio - (dw if is_x else dh) / ratio)
-            origin_bbox = [coord_to_origin(x1, True), coord_to_origin(y1, False), coord_to_origin(x2, True), coord_to_origin(y2, False)]
-            origin_keypoints = [coord_to_origin(c, i % 2 ==0) for i, c in enumerate(keypoints)]
-            out[len(out) - 1].append({
-                "bbox": origin_bbox,
-                "keypoints": origin_keypoints,
-                "conf": float(conf),
-            })
-    return out
\ No newline at end of file
+    start = 0
+    for count in counts:
+        out.append([
+            {
+                "bbox": coords[i][:4],
+                "keypoints": coords[i][4:],
+                "conf": confs[i],
+            }
+            for i in range(start, start + count)
+        ])
+        start += count
+    return out
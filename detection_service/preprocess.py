@@ -1,14 +1,9 @@
+import time
 import cv2
 import numpy as np
 
-def letterbox(im, new_shape=(640, 640), color=(114, 114, 114)):
-    """
-    Preprocess image. For details, see:    
-    https://github.com/meituan/YOLOv6/issues/613
-    """
-    
-    # Resize and pad image while meeting stride-multiple constraints
-    shape = im.shape[:2]  # current shape [height, width]
+def letterbox_params(shape, new_shape=(640, 640)):
+    """Scale ratio, resized (w, h), half padding (dw, dh) and (top, bottom, left, right) borders of letterbox."""
     if isinstance(new_shape, int):
         new_shape = (new_shape, new_shape)
 
@@ -21,9 +16,21 @@ def letterbox(im, new_shape=(640, 640), color=(114, 114, 114)):
 
     dw /= 2  # divide padding into 2 sides
     dh /= 2
-    im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
     top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
     left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    return r, new_unpad, (dw, dh), (top, bottom, left, right)
+
+def letterbox(im, new_shape=(640, 640), color=(114, 114, 114)):
+    """
+    Preprocess image. For details, see:    
+    https://github.com/meituan/YOLOv6/issues/613
+    """
+    
+    # Resize and pad image while meeting stride-multiple constraints
+    shape = im.shape[:2]  # current shape [height, width]
+    r, new_unpad, (dw, dh), (top, bottom, left, right) = letterbox_params(shape, new_shape)
+
+    im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
     im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)  # add border
     return im, r, (dw, dh)
         
@@ -40,4 +47,61 @@ def preprocess_images(img_list: list[np.ndarray]):
         image = np.ascontiguousarray(image)
         im = image.astype(np.float32)
         prepared_data.append((im,ratio,dwdh))
-    return origin_imgs, prepared_data
\ No newline at end of file
+    return origin_imgs, prepared_data
+
+class BatchBuffer:
+    """
+    Reusable (B, 3, H, W) float32 detector input.
+    Every image is resized once and written straight into its slot of the buffer,
+    HWC->CHW transpose and /255 normalization are fused into that single write.
+    The buffer grows to the largest batch seen and is reused afterwards.
+    """
+
+    def __init__(self, new_shape=(640, 640), color=(114, 114, 114)):
+        if isinstance(new_shape, int):
+            new_shape = (new_shape, new_shape)
+        self.new_shape = tuple(new_shape)
+        self.pad_value = np.asarray(color, dtype=np.float32) / np.float32(255)
+        self.buffer = np.empty((0, 3, *self.new_shape), dtype=np.float32)
+        self.last_stats: dict = {}
+
+    def fill(self, img_list: list[np.ndarray], bgr: bool = False):
+        """
+        Letterbox RGB (or BGR with bgr=True) uint8 images into the buffer as RGB.
+        Returns the (B, 3, H, W) batch view, prepared_data as (None, ratio, dwdh) per image
+        (the format rescale_detections expects) and the preprocessing stats of this batch.
+        """
+        tik = time.perf_counter()
+        bytes_allocated = 0
+
+        batch_size = len(img_list)
+        if self.buffer.shape[0] < batch_size:
+            self.buffer = np.empty((batch_size, 3, *self.new_shape), dtype=np.float32)
+            bytes_allocated += self.buffer.nbytes
+        batch = self.buffer[:batch_size]
+
+        prepared_data = []
+        for dst, img in zip(batch, img_list):
+            r, new_unpad, dwdh, (top, bottom, left, right) = letterbox_params(img.shape[:2], self.new_shape)
+            if new_unpad != (img.shape[1], img.shape[0]):
+                img = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
+                bytes_allocated += img.nbytes
+
+            h, w = img.shape[:2]
+            pad = self.pad_value[:, None, None]
+            dst[:, :top] = pad
+            dst[:, top + h:] = pad
+            dst[:, top:top + h, :left] = pad
+            dst[:, top:top + h, left + w:] = pad
+            chw = img.transpose((2, 0, 1))
+            if bgr:
+                chw = chw[::-1]
+            np.divide(chw, np.float32(255), out=dst[:, top:top + h, left:left + w], casting='unsafe')
+            prepared_data.append((None, r, dwdh))
+
+        self.last_stats = {
+            "batch_size": batch_size,
+            "preprocess_ms": (time.perf_counter() - tik) * 1000,
+            "bytes_allocated": bytes_allocated,
+        }
+        return batch, prepared_data, self.last_stats
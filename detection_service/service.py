@@ -1,50 +1,427 @@
+import asyncio
+import base64
 import bentoml
+import cv2
+import logging
+import os
 import numpy as np
-import torch
+from pathlib import Path
 from PIL import Image as PILImage
-from typing import List
+from bentoml.exceptions import NotFound
+from pydantic import BaseModel
+from typing import Any, Dict, List, Literal, Optional
 
-from preprocess import preprocess_images
+from preprocess import BatchBuffer
+from buckets import DEFAULT_BUCKETS, parse_buckets, scale_buckets, usable_buckets, group_by_bucket
 from postprocess import non_max_suppression_face, rescale_detections
-from model_loader import create_session
+from model_loader import SessionConfig, create_session, model_version, resolve_model_path, warmup
+from pipeline import BufferPool, StagedPipeline
+from decode import decode_reduced, oriented_size, pick_reduction
+from alignment import ALIGNED_SIZE, largest_face_id, select_faces, similarity_transforms, warp_faces
+from frame_ring import DEFAULT_RING_DIR, FrameReader, FrameUnavailable
+from tracking import FaceTracker, StreamTrackers
+from batching import AdaptiveBatcher, BatchingConfig
+from tiers import DEFAULT_TIER, tiers_from_env
 
+logger = logging.getLogger(__name__)
+
+BATCHING = BatchingConfig.from_env("DETECTION")
+# images the API put in the shared frame ring, read in place (per process)
+FRAMES = FrameReader(os.environ.get("FRAME_RING_DIR", DEFAULT_RING_DIR))
+
+class DetectionInput(BaseModel):
+    image: Optional[Path] = None
+    frame: Optional[Dict[str, Any]] = None  # instead of image: handle of the upload in the frame ring
+    tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER
+    # detect_align_batch only: faces to crop, like the embedding service selects them
+    mode: Literal["largest", "all"] = "largest"
+    max_faces: Optional[int] = None
+    rank_by: Literal["size", "conf"] = "size"
+
+def with_tier(image: PILImage.Image, tier: str) -> PILImage.Image:
+    """detect_batch takes bare images, their tier travels in the image info (kept when pickled)."""
+    image.info["tier"] = tier
+    return image
 
 @bentoml.service()
 class FaceDetectionBatchService:
     def __init__(self):
-        self.session = create_session("yolov6s_face.onnx")
-        self.input_name = self.session.get_inputs()[0].name
+        session_config = SessionConfig.from_env()
+        self.tiers = tiers_from_env(default_detection_variant=os.environ.get("DETECTION_MODEL_VARIANT", "fp32"))
+        model_paths = {
+            variant: resolve_model_path("yolov6s_face.onnx", variant)
+            for variant in {tier.detection_variant for tier in self.tiers.values()}
+        }
+        self.sessions = {variant: create_session(path, session_config) for variant, path in model_paths.items()}
+        session = next(iter(self.sessions.values()))
+        self.input_name = session.get_inputs()[0].name
+        buckets = parse_buckets(os.environ.get("DETECTION_BUCKETS", DEFAULT_BUCKETS))
+        # every tier letterboxes into the bucket policy scaled to its detector input size
+        self.buckets = {
+            name: usable_buckets(scale_buckets(buckets, tier.detector_size), session.get_inputs()[0].shape)
+            for name, tier in self.tiers.items()
+        }
+        self.model_version = model_version(list(model_paths.values()), repr((self.tiers, self.buckets)))
+        for variant, variant_session in self.sessions.items():
+            shapes = {
+                bucket for name, tier in self.tiers.items() if tier.detection_variant == variant
+                for bucket in self.buckets[name]
+            }
+            warmup(
+                variant_session,
+                [(3, *bucket) for bucket in sorted(shapes)],
+                session_config.batch_sizes(BATCHING.max_batch_size),
+            )
 
-    @bentoml.api(batchable=True, max_batch_size=16, max_latency_ms=300)
-    async def detect_batch(self, images: List[PILImage.Image]) -> List[List[dict]]:
-        imgs_bgr = [np.array(img)[:, :, ::-1] for img in images]
+        queue_size = int(os.environ.get("PIPELINE_QUEUE_SIZE", 2))
+        # one buffer being filled, queue_size waiting for inference and one in inference
+        self.buffer_pools = {
+            bucket: BufferPool(lambda bucket=bucket: BatchBuffer(bucket), queue_size + 2)
+            for bucket in {bucket for tier_buckets in self.buckets.values() for bucket in tier_buckets}
+        }
+        self.pipeline = StagedPipeline(self._preprocess, self._infer, self._postprocess, queue_size, self._discard)
 
-        _, prepared_data = preprocess_images(imgs_bgr)
+    def _preprocess(self, item):
+        tier, bucket, images = item
+        if images and isinstance(images[0], (bytes, memoryview)):  # encoded uploads, frames are views of the ring
+            imgs, scales = self._decode(bucket, images)
+            bgr = True
+        elif images and isinstance(images[0], tuple):  # (BGR image, scale) decoded by detect_align_batch
+            imgs, scales = [img for img, _ in images], [scale for _, scale in images]
+            bgr = True
+        else:
+            imgs = [np.asarray(img if img.mode == "RGB" else img.convert("RGB")) for img in images]
+            scales = [1.0] * len(imgs)
+            bgr = False
 
-        batch_tensor = np.stack([data[0][0] for data in prepared_data])
-        batch_tensor = batch_tensor.astype(np.float32) / 255.0
+        buffer = self.buffer_pools[bucket].acquire()
+        try:
+            batch_tensor, prepared_data, stats = buffer.fill(imgs, bgr=bgr)
+        except Exception:
+            self.buffer_pools[bucket].release(buffer)
+            raise
+        logger.debug("Preprocessed batch of %d into %dx%d in %.2f ms, %d bytes allocated",
+                     stats["batch_size"], bucket[1], bucket[0], stats["preprocess_ms"], stats["bytes_allocated"])
+        # boxes are rescaled straight to the original resolution of reduced decodes
+        prepared_data = [(None, ratio / scale, dwdh) for (_, ratio, dwdh), scale in zip(prepared_data, scales)]
+        return tier, bucket, buffer, batch_tensor, prepared_data
 
-        ort_outs = self.session.run(None, {self.input_name: batch_tensor})
-        predictions = torch.from_numpy(ort_outs[0])
+    def _decode(self, bucket, encoded: List[bytes]):
+        """Decode every image at the smallest JPEG scale that still covers its letterbox in the bucket."""
+        imgs, scales = [], []
+        for data in encoded:
+            height, width = oriented_size(data)
+            ratio = min(bucket[0] / height, bucket[1] / width)
+            img, scale = decode_reduced(data, pick_reduction(1 / ratio), (height, width))
+            if img is None:  # corrupt body behind a valid header, detect nothing
+                img, scale = np.full((bucket[0], bucket[1], 3), 114, dtype=np.uint8), 1.0
+            imgs.append(img)
+            scales.append(scale)
+        return imgs, scales
 
-        results = []
-        for i, pred in enumerate(predictions):
-            dets = non_max_suppression_face(
-                pred.unsqueeze(0),
-                conf_thres=0.4,
-                iou_thres=0.45,
-                max_det=300
-            )
-            final = rescale_detections(dets, [prepared_data[i]])
-            results.append(final[0])
+    def _discard(self, stage, item):
+        if stage == "inference":  # preprocessed, its buffer is still checked out
+            _, bucket, buffer, _, _ = item
+            self.buffer_pools[bucket].release(buffer)
+
+    def _infer(self, item):
+        tier, bucket, buffer, batch_tensor, prepared_data = item
+        try:
+            ort_outs = self.sessions[self.tiers[tier].detection_variant].run(None, {self.input_name: batch_tensor})
+        finally:
+            self.buffer_pools[bucket].release(buffer)
+        return ort_outs[0], prepared_data
 
+    def _postprocess(self, item):
+        predictions, prepared_data = item
+        dets = non_max_suppression_face(
+            predictions,
+            conf_thres=0.4,
+            iou_thres=0.45,
+            max_det=300
+        )
+        return rescale_detections(dets, prepared_data)
+
+    def _groups(self, tiers: List[str], shapes) -> dict[tuple[str, tuple[int, int]], list[int]]:
+        """Indices of the items grouped by (tier, bucket), so a batch may mix tiers."""
+        by_tier: dict[str, list[int]] = {}
+        for idx, tier in enumerate(tiers):
+            by_tier.setdefault(tier, []).append(idx)
+        groups: dict[tuple[str, tuple[int, int]], list[int]] = {}
+        for tier, indices in by_tier.items():
+            for bucket, sub in group_by_bucket([shapes[i] for i in indices], self.buckets[tier]).items():
+                groups[(tier, bucket)] = [indices[j] for j in sub]
+        return groups
+
+    async def _run_groups(self, groups: dict, items: list) -> List[List[dict]]:
+        """Run every (tier, bucket) group through the pipeline, results in input order."""
+        outputs = await asyncio.gather(*(
+            self.pipeline.submit((tier, bucket, [items[i] for i in indices]))
+            for (tier, bucket), indices in groups.items()
+        ))
+        results: List[List[dict]] = [[] for _ in items]
+        for indices, group_results in zip(groups.values(), outputs):
+            for i, dets in zip(indices, group_results):
+                results[i] = dets
         return results
+
+    @staticmethod
+    def _read(inputs: List[DetectionInput]):
+        """
+        Encoded bytes (views of the frame ring for frames) and oriented shapes of the inputs that are images,
+        with their indices.
+        """
+        encoded, shapes, valid = [], [], []
+        for idx, inp in enumerate(inputs):
+            try:
+                data = FRAMES.read(inp.frame) if inp.frame is not None else Path(inp.image).read_bytes()
+                shapes.append(oriented_size(data))
+            except FrameUnavailable as e:  # released since the entry service checked it, the caller is gone
+                logger.warning("Skipping frame: %s", e)
+                continue
+            except Exception:  # not an image
+                continue
+            encoded.append(data)
+            valid.append(idx)
+        return encoded, shapes, valid
+
+    @staticmethod
+    def _released(inp: DetectionInput) -> bool:
+        """Whether the input is a frame the writer released while it was decoded, its bytes may have been overwritten."""
+        if inp.frame is None or FRAMES.valid(inp.frame):
+            return False
+        logger.warning("Skipping frame: released while it was decoded")
+        return True
+
+    def _align(self, inp: DetectionInput, data: bytes, img, scale: float, detections: List[dict]) -> Dict[str, Any]:
+        """
+        Aligned 112x112 crops of the selected faces, warped from the image decoded for detection.
+        Only when that decode was reduced too far for the smallest face to keep 112 px is it decoded again.
+        """
+        if not detections:
+            return {"detections": detections, "det_ids": [], "crops": b""}
+        if inp.mode == "all":
+            det_ids = select_faces(detections, inp.max_faces, inp.rank_by)
+        else:
+            det_ids = [largest_face_id(detections)]
+        if not det_ids:
+            return {"detections": detections, "det_ids": [], "crops": b""}
+
+        smallest = min(
+            min(detections[i]['bbox'][2] - detections[i]['bbox'][0], detections[i]['bbox'][3] - detections[i]['bbox'][1])
+            for i in det_ids
+        )
+        reduction = pick_reduction(smallest / ALIGNED_SIZE)
+        if scale > reduction * 1.01:
+            img, scale = decode_reduced(data, reduction)
+        keypoints = np.array([detections[i]['keypoints'] for i in det_ids], dtype=np.float32).reshape(-1, 5, 2) / scale
+        transforms = similarity_transforms(keypoints)
+        ok = np.isfinite(transforms).all(axis=(1, 2))
+        return {
+            "detections": detections,
+            "det_ids": [det_id for det_id, keep in zip(det_ids, ok) if keep],
+            "crops": warp_faces(img, transforms[ok]).tobytes(),
+        }
+
+    @bentoml.api(**BATCHING.batch_api_options())
+    async def detect_batch(self, images: List[PILImage.Image]) -> List[List[dict]]:
+        tiers = [img.info.get("tier", DEFAULT_TIER) for img in images]
+        return await self._run_groups(self._groups(tiers, [(img.height, img.width) for img in images]), images)
+
+    @bentoml.api(batchable=True, max_batch_size=BATCHING.max_batch_size, max_latency_ms=BATCHING.max_latency_ms)
+    async def detect_encoded_batch(self, inputs: List[DetectionInput]) -> List[List[dict]]:
+        """Detection on the raw encoded uploads, large JPEGs are decoded at reduced resolution."""
+        results = [[] for _ in inputs]
+        encoded, shapes, valid = self._read(inputs)
+        groups = self._groups([inputs[i].tier for i in valid], shapes)
+        for i, dets in zip(valid, await self._run_groups(groups, encoded)):
+            if not self._released(inputs[i]):
+                results[i] = dets
+        return results
+
+    @bentoml.api(batchable=True, max_batch_size=BATCHING.max_batch_size, max_latency_ms=BATCHING.max_latency_ms)
+    async def detect_align_batch(self, inputs: List[DetectionInput]) -> List[Dict[str, Any]]:
+        """
+        Detection plus aligned crops of the selected faces from the same decoded image,
+        so the embedding service gets 112x112 crops instead of the upload.
+        """
+        results = [{"detections": [], "det_ids": [], "crops": b""} for _ in inputs]
+        encoded, shapes, valid = self._read(inputs)
+        groups = self._groups([inputs[i].tier for i in valid], shapes)
+        decoded = [None] * len(encoded)
+        for (_, bucket), indices in groups.items():
+            imgs, scales = await asyncio.to_thread(self._decode, bucket, [encoded[i] for i in indices])
+            for i, img, scale in zip(indices, imgs, scales):
+                decoded[i] = (img, scale)
+
+        detections = await self._run_groups(groups, decoded)
+        aligned = await asyncio.gather(*(
+            asyncio.to_thread(self._align, inputs[idx], encoded[i], *decoded[i], detections[i])
+            for i, idx in enumerate(valid)
+        ))
+        for idx, result in zip(valid, aligned):
+            if not self._released(inputs[idx]):
+                results[idx] = result
+        return results
+
+    @bentoml.api()
+    async def pipeline_stats(self) -> dict:
+        return self.pipeline.stats()
+
+    @bentoml.api()
+    async def model_info(self) -> dict:
+        return {"model_version": self.model_version, "variants": sorted(self.sessions)}
     
 @bentoml.service()
 class FaceDetectionService:
     batch_service = bentoml.depends(FaceDetectionBatchService)
 
-    @bentoml.api()
-    async def detect(self, image: PILImage.Image) -> List[dict]:
+    def __init__(self):
+        self.batcher = AdaptiveBatcher(self._run_batch, BATCHING) if BATCHING.mode == "adaptive" else None
+        # trackers of the camera streams sent to detect_stream (per process, a stream sticks to one worker)
+        self.streams = StreamTrackers(
+            idle_s=float(os.environ.get("DETECTION_STREAM_IDLE_S", 30)),
+            max_streams=int(os.environ.get("DETECTION_MAX_STREAMS", 256)),
+        )
+
+    async def _run_batch(self, images: List[PILImage.Image]) -> List[List[dict]]:
+        return await self.batch_service.to_async.detect_batch(images)
+
+    @staticmethod
+    def _check_frame(frame: Dict[str, Any]):
+        """404 when the frame cannot be read here, the API then uploads the image instead."""
+        try:
+            FRAMES.read(frame)
+        except FrameUnavailable as e:
+            raise NotFound(f"Frame unavailable: {e}") from None
+
+    async def _detect(self, image: PILImage.Image) -> List[dict]:
+        if self.batcher is not None:
+            return await self.batcher.submit(image)
         batch_result = await self.batch_service.to_async.detect_batch([image])
-        return batch_result[0]
\ No newline at end of file
+        return batch_result[0]
+
+    @bentoml.api()
+    async def detect(self, image: PILImage.Image, tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER) -> List[dict]:
+        return await self._detect(with_tier(image, tier))
+
+    @bentoml.api()
+    async def detect_encoded(self, image: Path, tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER) -> List[dict]:
+        batch_result = await self.batch_service.to_async.detect_encoded_batch([DetectionInput(image=image, tier=tier)])
+        return batch_result[0]
+
+    @bentoml.api()
+    async def detect_align(
+        self,
+        image: Path,
+        tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER,
+        mode: Literal["largest", "all"] = "largest",
+        max_faces: Optional[int] = None,
+        rank_by: Literal["size", "conf"] = "size",
+    ) -> Dict[str, Any]:
+        """
+        Detections of the upload plus the aligned faces to embed (the largest, or all / the top max_faces),
+        decoded once: {"detections", "det_ids", "crops": base64 of (F, 112, 112, 3) uint8 BGR}.
+        The crops go to the embedding service's embed_aligned instead of the image.
+        """
+        inp = DetectionInput(image=image, tier=tier, mode=mode, max_faces=max_faces, rank_by=rank_by)
+        result = (await self.batch_service.to_async.detect_align_batch([inp]))[0]
+        return {**result, "crops": base64.b64encode(result["crops"]).decode()}
+
+    @bentoml.api()
+    async def detect_frame(
+        self,
+        frame: Dict[str, Any],
+        tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER,
+    ) -> List[dict]:
+        """detect_encoded of an image the API put in the shared frame ring, frame is its handle."""
+        self._check_frame(frame)
+        batch_result = await self.batch_service.to_async.detect_encoded_batch([DetectionInput(frame=frame, tier=tier)])
+        return batch_result[0]
+
+    @bentoml.api()
+    async def detect_align_frame(
+        self,
+        frame: Dict[str, Any],
+        tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER,
+        mode: Literal["largest", "all"] = "largest",
+        max_faces: Optional[int] = None,
+        rank_by: Literal["size", "conf"] = "size",
+    ) -> Dict[str, Any]:
+        """detect_align of an image the API put in the shared frame ring, frame is its handle."""
+        self._check_frame(frame)
+        inp = DetectionInput(frame=frame, tier=tier, mode=mode, max_faces=max_faces, rank_by=rank_by)
+        result = (await self.batch_service.to_async.detect_align_batch([inp]))[0]
+        return {**result, "crops": base64.b64encode(result["crops"]).decode()}
+
+    @bentoml.api()
+    async def detect_stream(
+        self,
+        image: PILImage.Image,
+        stream_id: str,
+        keyframe_interval: int = 10,
+        tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER,
+    ) -> dict:
+        """
+        Faces with stable track ids in the next frame of a camera stream.
+        The stream's tracker is kept between calls, so the detector only runs on its keyframes.
+        Streams idle for DETECTION_STREAM_IDLE_S are dropped and start over with new track ids.
+        """
+        stream = self.streams.get(stream_id, keyframe_interval)
+        frame = cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+        async with stream.lock:
+            faces = await asyncio.to_thread(stream.tracker.propagate, frame)
+            keyframe = faces is None
+            if keyframe:
+                detections = await self._detect(with_tier(image, tier))
+                faces = stream.tracker.correct(frame, detections)
+            return {"stream_id": stream_id, "keyframe": keyframe, "faces": faces, **stream.tracker.stats()}
+
+    @bentoml.api()
+    async def close_stream(self, stream_id: str) -> dict:
+        """Drop the tracker of a stream that ended, with its final stats."""
+        stats = self.streams.close(stream_id)
+        if stats is None:
+            raise NotFound(f"Unknown stream: {stream_id}")
+        return stats
+
+    @bentoml.api()
+    async def detect_video(
+        self,
+        video: Path,
+        keyframe_interval: int = 10,
+        max_frames: int = 0,
+        tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER,
+    ) -> dict:
+        """
+        Faces with stable track ids for every frame of a video file.
+        The detector only runs on keyframes, faces are tracked in between.
+        Offline harness for the tracker, live cameras send their frames to detect_stream.
+        """
+        tracker = FaceTracker(keyframe_interval=keyframe_interval)
+        capture = cv2.VideoCapture(str(video))
+        frames = []
+        try:
+            while not max_frames or len(frames) < max_frames:
+                ok, frame = await asyncio.to_thread(capture.read)
+                if not ok:
+                    break
+                faces = await asyncio.to_thread(tracker.propagate, frame)
+                keyframe = faces is None
+                if keyframe:
+                    image = with_tier(PILImage.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), tier)
+                    detections = (await self.batch_service.to_async.detect_batch([image]))[0]
+                    faces = tracker.correct(frame, detections)
+                frames.append({"frame": len(frames), "keyframe": keyframe, "faces": faces})
+        finally:
+            capture.release()
+        return {"frames": frames, **tracker.stats()}
+
+    @bentoml.api()
+    async def model_info(self) -> dict:
+        """Content hash of the loaded weights, clients key cached results on it."""
+        return await self.batch_service.to_async.model_info()
+
+    @bentoml.api()
+    async def batching_stats(self) -> dict:
+        return self.batcher.stats() if self.batcher is not None else {"mode": BATCHING.mode}
\ No newline at end of file
@@ -0,0 +1,203 @@
+import asyncio
+import cv2
+import numpy as np
+import time
+from dataclasses import dataclass, field
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of xyxy boxes with shapes [N, 4] and [M, 4]."""
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+@dataclass
+class Track:
+    track_id: int
+    bbox: np.ndarray  # (4,) xyxy
+    keypoints: np.ndarray  # (5, 2)
+    conf: float  # detector confidence at the last keyframe
+    confidence: float = 1.0  # tracking confidence since the last keyframe
+
+    def as_detection(self) -> dict:
+        return {
+            "bbox": [int(v) for v in self.bbox],
+            "keypoints": [int(v) for v in self.keypoints.reshape(-1)],
+            "conf": self.conf,
+            "track_id": self.track_id,
+        }
+
+class FaceTracker:
+    """
+    Keyframe detection with median-flow tracking in between.
+
+    On keyframes the detections are matched to the current tracks by IoU, so a face keeps its
+    track_id for as long as it stays in view. Between keyframes every track is moved with
+    pyramidal Lucas-Kanade flow: a grid of points inside the box gives the median translation
+    and scale of the box, the five landmarks follow their own flow when it is reliable.
+    The share of points passing the forward-backward check is the tracking confidence;
+    propagate asks for a new keyframe when it drops or after keyframe_interval frames.
+    """
+
+    def __init__(
+        self,
+        keyframe_interval: int = 10,
+        min_confidence: float = 0.5,
+        match_iou: float = 0.3,
+        grid: int = 5,
+        max_fb_error: float = 1.0,
+    ):
+        self.keyframe_interval = keyframe_interval
+        self.min_confidence = min_confidence
+        self.match_iou = match_iou
+        self.grid = grid
+        self.max_fb_error = max_fb_error
+        self.tracks: list[Track] = []
+        self.prev_gray: np.ndarray | None = None
+        self.pending_gray: np.ndarray | None = None
+        self.since_keyframe = 0
+        self.next_id = 0
+        self.frames = 0
+        self.keyframes = 0
+        self.lk_params = dict(winSize=(21, 21), maxLevel=3,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+    def propagate(self, frame_bgr: np.ndarray) -> list[dict] | None:
+        """Track the faces into a new frame, or return None when the frame has to be a keyframe."""
+        gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
+        if self.prev_gray is None or self.since_keyframe + 1 >= self.keyframe_interval:
+            self.pending_gray = gray
+            return None
+
+        tracks = [self._track(track, self.prev_gray, gray) for track in self.tracks]
+        if any(track.confidence < self.min_confidence for track in tracks):
+            self.pending_gray = gray
+            return None
+
+        self.tracks = tracks
+        self.prev_gray = gray
+        self.since_keyframe += 1
+        self.frames += 1
+        return [track.as_detection() for track in self.tracks]
+
+    def correct(self, frame_bgr: np.ndarray, detections: list[dict]) -> list[dict]:
+        """Start a keyframe from fresh detections of the frame propagate declined."""
+        gray = self.pending_gray if self.pending_gray is not None else cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
+        self.pending_gray = None
+
+        boxes = np.array([d["bbox"] for d in detections], dtype=np.float32).reshape(-1, 4)
+        previous = np.array([t.bbox for t in self.tracks], dtype=np.float32).reshape(-1, 4)
+        ids = [None] * len(detections)
+        if len(previous) and len(boxes):
+            iou = box_iou(boxes, previous)
+            while True:
+                d, t = np.unravel_index(np.argmax(iou), iou.shape)
+                if iou[d, t] < self.match_iou:
+                    break
+                ids[d] = self.tracks[t].track_id
+                iou[d, :] = -1
+                iou[:, t] = -1
+
+        self.tracks = []
+        for det, track_id in zip(detections, ids):
+            if track_id is None:
+                track_id = self.next_id
+                self.next_id += 1
+            self.tracks.append(Track(
+                track_id=track_id,
+                bbox=np.array(det["bbox"], dtype=np.float32),
+                keypoints=np.array(det["keypoints"], dtype=np.float32).reshape(5, 2),
+                conf=float(det["conf"]),
+            ))
+        self.prev_gray = gray
+        self.since_keyframe = 0
+        self.frames += 1
+        self.keyframes += 1
+        return [track.as_detection() for track in self.tracks]
+
+    def _track(self, track: Track, prev_gray: np.ndarray, gray: np.ndarray) -> Track:
+        x1, y1, x2, y2 = track.bbox
+        xs, ys = np.meshgrid(np.linspace(x1, x2, self.grid + 2)[1:-1], np.linspace(y1, y2, self.grid + 2)[1:-1])
+        grid = np.stack([xs.ravel(), ys.ravel()], axis=1)
+        points = np.concatenate([grid, track.keypoints]).astype(np.float32).reshape(-1, 1, 2)
+
+        forward, status_f, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, **self.lk_params)
+        backward, status_b, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, forward, None, **self.lk_params)
+        fb_error = np.linalg.norm(points - backward, axis=2).ravel()
+        good = (status_f.ravel() == 1) & (status_b.ravel() == 1) & (fb_error < self.max_fb_error)
+
+        n_grid = len(grid)
+        good_grid = good[:n_grid]
+        confidence = float(good_grid.mean())
+        if good_grid.sum() < 2:
+            return Track(track.track_id, track.bbox, track.keypoints, track.conf, confidence=0.0)
+
+        src = points[:n_grid, 0][good_grid]
+        dst = forward[:n_grid, 0][good_grid]
+        shift = np.median(dst - src, axis=0)
+        i, j = np.triu_indices(len(src), k=1)
+        src_dist = np.linalg.norm(src[i] - src[j], axis=1)
+        dst_dist = np.linalg.norm(dst[i] - dst[j], axis=1)
+        valid = src_dist > 1e-3
+        scale = float(np.median(dst_dist[valid] / src_dist[valid])) if valid.any() else 1.0
+
+        center = (track.bbox[:2] + track.bbox[2:]) / 2
+        new_center = center + shift
+        half = (track.bbox[2:] - track.bbox[:2]) / 2 * scale
+        bbox = np.concatenate([new_center - half, new_center + half])
+
+        # Landmarks with reliable flow follow it, the rest move with the box.
+        keypoints = (track.keypoints - center) * scale + new_center
+        good_kps = good[n_grid:]
+        keypoints[good_kps] = forward[n_grid:, 0][good_kps]
+        return Track(track.track_id, bbox, keypoints, track.conf, confidence=min(confidence, track.confidence))
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "keyframes": self.keyframes,
+            "detector_calls_saved": self.frames - self.keyframes,
+        }
+
+
+@dataclass
+class Stream:
+    tracker: FaceTracker
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # frames of a stream are tracked in order
+    used_at: float = field(default_factory=time.monotonic)
+
+
+class StreamTrackers:
+    """
+    One FaceTracker per camera stream, kept across requests.
+
+    A stream is dropped after idle_s without a frame, and the least recently used one when
+    max_streams are open, so clients that never close their stream do not leak trackers.
+    """
+
+    def __init__(self, idle_s: float = 30.0, max_streams: int = 256):
+        self.idle_s = idle_s
+        self.max_streams = max_streams
+        self.streams: dict[str, Stream] = {}
+
+    def get(self, stream_id: str, keyframe_interval: int) -> Stream:
+        now = time.monotonic()
+        self.evict_idle(now)
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            if len(self.streams) >= self.max_streams:
+                del self.streams[min(self.streams, key=lambda key: self.streams[key].used_at)]
+            stream = self.streams[stream_id] = Stream(FaceTracker(keyframe_interval=keyframe_interval))
+        stream.tracker.keyframe_interval = keyframe_interval
+        stream.used_at = now
+        return stream
+
+    def evict_idle(self, now: float):
+        for stream_id in [key for key, stream in self.streams.items() if now - stream.used_at > self.idle_s]:
+            del self.streams[stream_id]
+
+    def close(self, stream_id: str) -> dict | None:
+        stream = self.streams.pop(stream_id, None)
+        return stream.tracker.stats() if stream is not None else None
@@ -2,6 +2,8 @@ import numpy as np
 import cv2
 from typing import List, Dict, Any
 
+from alignment import TEMPLATE_112, largest_face_id, select_faces, similarity_transforms
+
 def preprocess_image(img_bgr: np.ndarray, input_size=(112, 112)) -> np.ndarray:
     img = cv2.resize(img_bgr, input_size)
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
@@ -10,14 +12,6 @@ def preprocess_image(img_bgr: np.ndarray, input_size=(112, 112)) -> np.ndarray:
     img = img[np.newaxis, ...]
     return img
 
-TEMPLATE_112 = np.array([
-    [38.2946, 51.6963],
-    [73.5318, 51.5014],
-    [56.0252, 71.7366],
-    [41.5493, 92.3655],
-    [70.7299, 92.2041]
-], dtype=np.float32)
-
 def extract_largest_face_aligned(
     img: np.ndarray,
     detections: List[Dict[str, Any]],
@@ -26,8 +20,7 @@ def extract_largest_face_aligned(
     if not detections:
         return None
 
-    areas = [(d['bbox'][2] - d['bbox'][0]) * (d['bbox'][3] - d['bbox'][1]) for d in detections]
-    best_det_id = np.argmax(areas)
+    best_det_id = largest_face_id(detections)
     best = detections[best_det_id]
     kps = np.array(best['keypoints']).reshape(5, 2).astype(np.float32)
 
@@ -42,4 +35,41 @@ def extract_largest_face_aligned(
         borderMode=cv2.BORDER_REPLICATE,
         flags=cv2.INTER_LINEAR
     )
-    return aligned, best_det_id
\ No newline at end of file
+    return aligned, best_det_id
+
+def face_slots(flip: np.ndarray) -> np.ndarray:
+    """Batch row of every face when face i is followed by its flipped copy only where flip[i]."""
+    sizes = 1 + np.asarray(flip, dtype=np.int64)
+    return np.cumsum(sizes) - sizes
+
+class FaceBatchBuffer:
+    """
+    Reusable (F, 3, 112, 112) float32 embedder input.
+    Every face is warped once and written straight into its slot as normalized RGB CHW,
+    the horizontally flipped copy for test-time augmentation goes into the next slot
+    for the faces that ask for it (see face_slots).
+    """
+
+    def __init__(self, output_size: int = 112):
+        self.output_size = output_size
+        self.buffer = np.empty((0, 3, output_size, output_size), dtype=np.float32)
+
+    def fill(self, images: List[np.ndarray], transforms: np.ndarray, flip: bool | np.ndarray = True) -> np.ndarray:
+        """Warp image i with transforms[i] ((N, 2, 3)), returns the batch view."""
+        size = self.output_size
+        flip = np.broadcast_to(np.asarray(flip, dtype=bool), (len(images),))
+        slots = face_slots(flip)
+        rows = int(slots[-1] + 1 + flip[-1]) if len(images) else 0
+        if self.buffer.shape[0] < rows:
+            self.buffer = np.empty((rows, 3, size, size), dtype=np.float32)
+        batch = self.buffer[:rows]
+
+        for img, M, slot, flipped in zip(images, transforms, slots, flip):
+            face = cv2.warpAffine(img, M, (size, size), borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_LINEAR)
+            dst = batch[slot]
+            np.divide(face.transpose((2, 0, 1))[::-1], np.float32(255), out=dst, casting='unsafe')  # BGR -> RGB
+            dst -= np.float32(0.5)
+            dst /= np.float32(0.5)
+            if flipped:
+                batch[slot + 1] = dst[:, :, ::-1]
+        return batch
@@ -1,78 +1,438 @@
+import base64
+import binascii
+import json
+import logging
 import numpy as np
 from pathlib import Path
 from pydantic import BaseModel
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Literal, Optional
 import bentoml
-import cv2
+from bentoml.exceptions import BadInput, NotFound
+import os
 
-from preprocess import preprocess_image, extract_largest_face_aligned
-from model_loader import create_session
+from preprocess import FaceBatchBuffer, face_slots, largest_face_id, select_faces, similarity_transforms
+from alignment import ALIGNED_SIZE, warp_faces
+from model_loader import SessionConfig, create_session, model_version, resolve_model_path, warmup
+from pipeline import BufferPool, StagedPipeline
+from decode import decode_reduced, pick_reduction
+from batching import AdaptiveBatcher, BatchingConfig
+from tiers import DEFAULT_TIER, tiers_from_env
+from frame_ring import DEFAULT_RING_DIR, FrameReader, FrameUnavailable
+from quality import QUALITY_REASONS, QualityConfig, face_quality
+
+logger = logging.getLogger(__name__)
+
+BATCHING = BatchingConfig.from_env("EMBEDDING")
+QUALITY = QualityConfig.from_env()
+# binary embedding formats: raw little-endian rows of an (F, 512) matrix
+BINARY_DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2")}
+
+IDENTITY = np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float64)  # transform of a crop that is already aligned
+# images the API put in the shared frame ring, read in place (per process)
+FRAMES = FrameReader(os.environ.get("FRAME_RING_DIR", DEFAULT_RING_DIR))
 
 class BatchInput(BaseModel):
-    image: Path
-    detections: List[Dict[str, Any]]
+    image: Optional[Path] = None
+    frame: Optional[Dict[str, Any]] = None  # instead of image: handle of the upload in the frame ring
+    detections: List[Dict[str, Any]] = []
+    # instead of image + detections: (F, 112, 112, 3) uint8 BGR crops aligned by the detection service
+    # (detections then only serve the quality gate)
+    aligned: Optional[bytes] = None
+    aligned_det_ids: List[int] = []
+    # "largest" embeds the largest face only, "all" embeds every detection (or the top max_faces by rank_by)
+    mode: Literal["largest", "all"] = "largest"
+    max_faces: Optional[int] = None
+    rank_by: Literal["size", "conf"] = "size"
+    # "json" returns float lists, "float32" / "float16" return {"det_ids", "embeddings": bytes}
+    embedding_format: Literal["json", "float32", "float16"] = "json"
+    tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER
+    # faces scoring below it (see quality.face_quality) are not embedded but returned in "rejected"; 0 embeds all
+    min_quality: float = 0.0
 
 @bentoml.service()
 class FaceEmbeddingBatchService:
 
     def __init__(self):
-        self.session = create_session("LVFace-S_Glint360K.onnx")
-        self.input_name = self.session.get_inputs()[0].name
+        session_config = SessionConfig.from_env()
+        self.tiers = tiers_from_env(default_embedding_variant=os.environ.get("EMBEDDING_MODEL_VARIANT", "fp32"))
+        self.sessions = {}
+        model_paths = []
+        for variant in {tier.embedding_variant for tier in self.tiers.values()}:
+            model_paths.append(resolve_model_path("LVFace-S_Glint360K.onnx", variant))
+            session = create_session(model_paths[-1], session_config)
+            # faces are embedded alone or together with their flipped copy
+            flips = {tier.flip_tta for tier in self.tiers.values() if tier.embedding_variant == variant}
+            batch_sizes = sorted({
+                (1 + flip) * b for flip in flips for b in session_config.batch_sizes(BATCHING.max_batch_size)
+            })
+            warmup(session, [(3, 112, 112)], batch_sizes)
+            self.sessions[variant] = session
+        self.input_name = next(iter(self.sessions.values())).get_inputs()[0].name
+        self.model_version = model_version(model_paths, repr(self.tiers))
 
-    @bentoml.api(batchable=True, max_batch_size=16, max_latency_ms=300)
-    async def embed_batch(self, inputs: List[BatchInput]) -> List[Dict[str, Any]]:
-        img_bgr_list = [cv2.imread(str(inp.image)) for inp in inputs]
-        detections_list = [inp.detections for inp in inputs]
-
-        aligned_faces: List[np.ndarray | None] = []
-        best_det_ids: List[int] = []
-        for img_bgr, dets in zip(img_bgr_list, detections_list):
-            face, best_det_id = extract_largest_face_aligned(img_bgr, dets, output_size=112)
-            aligned_faces.append(face)
-            best_det_ids.append(int(best_det_id))
-
-        batch_tensors = []
-        valid_indices = []
-        for idx, face in enumerate(aligned_faces):
-            if face is not None:
-                tensor = preprocess_image(face)
-                flipped = cv2.flip(face, 1)
-                tensor_flip = preprocess_image(flipped)
-                batch_tensors.append(tensor)
-                batch_tensors.append(tensor_flip)
-                valid_indices.append(idx)
-
-        results = [None] * len(inputs)
-        if batch_tensors:
-            batch_input = np.vstack(batch_tensors)
-
-            embeddings: np.ndarray = self.session.run(None, {self.input_name: batch_input})[0]
-
-            num_valid = len(valid_indices)
-            for i in range(num_valid):
-                orig_idx = valid_indices[i]
-                emb_orig = embeddings[2 * i]
-                emb_flip = embeddings[2 * i + 1]
-                avg_emb = (emb_orig + emb_flip) / 2.0
-                norm_avg = np.linalg.norm(avg_emb)
-                final_emb = avg_emb / norm_avg if norm_avg != 0 else avg_emb
-                results[orig_idx] = {
-                    "embedding": final_emb.tolist(),
-                    "best_det_id": best_det_ids[i]
-                }
-
-        for i, res in enumerate(results):
-            if res is None:
-                results[i] = {"error": "no_face"}
-        
+        queue_size = int(os.environ.get("PIPELINE_QUEUE_SIZE", 2))
+        # a batch mixing tiers holds one buffer per model variant
+        self.buffer_pool = BufferPool(FaceBatchBuffer, (queue_size + 2) * len(self.sessions))
+        self.pipeline = StagedPipeline(self._preprocess, self._infer, self._postprocess, queue_size, self._discard)
+        self.quality_counters = {"scored": 0, "rejected": dict.fromkeys(QUALITY_REASONS, 0), "forward_passes_saved": 0}
+
+    def _preprocess(self, inputs: List[BatchInput]):
+        """
+        Align the selected faces of every input into one batch per model variant,
+        faces of all images using the same variant share a single run.
+        """
+        images = []
+        keypoints = []  # None for crops that are already aligned
+        faces = []  # (input index, detection id) of every aligned face
+        for idx, inp in enumerate(inputs):
+            if inp.aligned is not None:
+                crops = np.frombuffer(inp.aligned, dtype=np.uint8).reshape(-1, ALIGNED_SIZE, ALIGNED_SIZE, 3)
+                for crop, det_id in zip(crops, inp.aligned_det_ids):
+                    images.append(crop)
+                    keypoints.append(None)
+                    faces.append((idx, det_id))
+                continue
+            if not inp.detections:
+                continue
+            if inp.mode == "all":
+                det_ids = select_faces(inp.detections, inp.max_faces, inp.rank_by)
+            else:
+                det_ids = [largest_face_id(inp.detections)]
+            if not det_ids:
+                continue
+            img_bgr, detections = self._decode(inp, det_ids)
+            if img_bgr is None:
+                continue
+            for det_id in det_ids:
+                images.append(img_bgr)
+                keypoints.append(detections[det_id]['keypoints'])
+                faces.append((idx, det_id))
+
+        rejected: List[List[dict]] = [[] for _ in inputs]
+        if not images:
+            return inputs, [], rejected
+
+        # one closed-form similarity transform per face, degenerate landmarks are dropped
+        transforms = np.broadcast_to(IDENTITY, (len(images), 2, 3)).copy()
+        to_align = [i for i, kps in enumerate(keypoints) if kps is not None]
+        if to_align:
+            transforms[to_align] = similarity_transforms(
+                np.array([keypoints[i] for i in to_align], dtype=np.float32).reshape(-1, 5, 2)
+            )
+        ok = np.isfinite(transforms).all(axis=(1, 2))
+        self._quality_gate(inputs, images, keypoints, faces, transforms, ok, rejected)
+
+        by_variant: dict[str, list[int]] = {}
+        for i, (idx, _) in enumerate(faces):
+            if ok[i]:
+                by_variant.setdefault(self.tiers[inputs[idx].tier].embedding_variant, []).append(i)
+
+        runs = []
+        acquired = []
+        try:
+            for variant, indices in by_variant.items():
+                flip = np.array([self.tiers[inputs[faces[i][0]].tier].flip_tta for i in indices])
+                buffer = self.buffer_pool.acquire()
+                acquired.append(buffer)
+                batch_input = buffer.fill([images[i] for i in indices], transforms[indices], flip)
+                runs.append((variant, buffer, batch_input, [faces[i] for i in indices], flip))
+        except Exception:
+            for buffer in acquired:
+                self.buffer_pool.release(buffer)
+            raise
+        return inputs, runs, rejected
+
+    def _quality_gate(self, inputs, images, keypoints, faces, transforms, ok, rejected):
+        """
+        Scores the faces of inputs with a min_quality on their detection and aligned crop, and drops (ok[i] = False)
+        the ones below it, so they take no slot in the batch; their det_id, quality and reason go to rejected.
+        """
+        for i, (idx, det_id) in enumerate(faces):
+            inp = inputs[idx]
+            if not inp.min_quality or not ok[i]:
+                continue
+            crop = images[i] if keypoints[i] is None else warp_faces(images[i], transforms[i:i + 1])[0]
+            detection = inp.detections[det_id] if det_id < len(inp.detections) else None
+            quality = face_quality(detection, crop, QUALITY)
+            self.quality_counters["scored"] += 1
+            if quality["quality"] < inp.min_quality:
+                ok[i] = False
+                rejected[idx].append({"det_id": det_id, **quality})
+                self.quality_counters["rejected"][quality["reason"]] += 1
+                self.quality_counters["forward_passes_saved"] += 1 + self.tiers[inp.tier].flip_tta
+
+    def _decode(self, inp: BatchInput, det_ids: List[int]):
+        """
+        Decode the upload at the smallest JPEG scale that keeps the smallest face to embed
+        at least 112 px, with the detections mapped into the reduced image.
+        """
+        if inp.frame is not None:
+            try:
+                data = FRAMES.read(inp.frame)
+            except FrameUnavailable as e:  # released since the entry service checked it, the caller is gone
+                logger.warning("Skipping frame: %s", e)
+                return None, inp.detections
+        else:
+            data = Path(inp.image).read_bytes()
+        sides = [
+            (inp.detections[i]['bbox'][2] - inp.detections[i]['bbox'][0], inp.detections[i]['bbox'][3] - inp.detections[i]['bbox'][1])
+            for i in det_ids
+        ]
+        face_w, face_h = min(sides, key=lambda side: side[0] * side[1])
+        img_bgr, scale = decode_reduced(data, pick_reduction(min(face_w, face_h) / 112))
+        if inp.frame is not None and not FRAMES.valid(inp.frame):
+            logger.warning("Skipping frame: released while it was decoded")
+            return None, inp.detections
+        if scale == 1.0:
+            return img_bgr, inp.detections
+        detections = [
+            {**d, 'bbox': [v / scale for v in d['bbox']], 'keypoints': [v / scale for v in d['keypoints']]}
+            for d in inp.detections
+        ]
+        return img_bgr, detections
+
+    def _discard(self, stage, item):
+        if stage == "inference":  # preprocessed, its buffers are still checked out
+            for _, buffer, _, _, _ in item[1]:
+                self.buffer_pool.release(buffer)
+
+    def _infer(self, item):
+        inputs, runs, rejected = item
+        outputs = []
+        try:
+            for variant, buffer, batch_input, faces, flip in runs:
+                outputs.append((self.sessions[variant].run(None, {self.input_name: batch_input})[0], faces, flip))
+        finally:
+            for _, buffer, _, _, _ in runs:
+                self.buffer_pool.release(buffer)
+        return inputs, outputs, rejected
+
+    def _postprocess(self, item) -> List[Dict[str, Any]]:
+        inputs, outputs, rejected = item
+        embedded = []
+        all_faces = []
+        for embeddings, faces, flip in outputs:
+            slots = face_slots(flip)
+            emb = embeddings[slots]
+            # average with the flipped copy where the tier asked for test-time augmentation
+            emb[flip] = (emb[flip] + embeddings[slots[flip] + 1]) / 2.0
+            embedded.append(emb)
+            all_faces += faces
+
+        rows: List[List[int]] = [[] for _ in inputs]  # rows of final_emb per input, in detection order
+        det_ids: List[List[int]] = [[] for _ in inputs]
+        final_emb = None
+        if all_faces:
+            avg_emb = np.concatenate(embedded)
+            norm_avg = np.linalg.norm(avg_emb, axis=1, keepdims=True)
+            final_emb = avg_emb / np.where(norm_avg != 0, norm_avg, 1)
+            for row, (orig_idx, det_id) in enumerate(all_faces):
+                rows[orig_idx].append(row)
+                det_ids[orig_idx].append(det_id)
+
+        results = []
+        for inp, inp_rows, inp_det_ids, inp_rejected in zip(inputs, rows, det_ids, rejected):
+            if inp.mode == "largest":
+                inp_rows, inp_det_ids = inp_rows[:1], inp_det_ids[:1]
+            if inp.embedding_format != "json":
+                # no per-float Python objects: the rows go out as one contiguous little-endian buffer
+                data = final_emb[inp_rows].astype(BINARY_DTYPES[inp.embedding_format]).tobytes() if inp_rows else b""
+                result = {"det_ids": inp_det_ids, "embeddings": data}
+            elif not inp_rows:
+                result = {"error": "low_quality" if inp_rejected else "no_face"}
+            elif inp.mode == "all":
+                result = {"faces": [
+                    {"det_id": det_id, "embedding": final_emb[row].tolist()} for row, det_id in zip(inp_rows, inp_det_ids)
+                ]}
+            else:
+                result = {"embedding": final_emb[inp_rows[0]].tolist(), "best_det_id": inp_det_ids[0]}
+            if inp.min_quality:
+                result["rejected"] = inp_rejected
+            results.append(result)
         return results
 
+    @bentoml.api(**BATCHING.batch_api_options())
+    async def embed_batch(self, inputs: List[BatchInput]) -> List[Dict[str, Any]]:
+        return await self.pipeline.submit(inputs)
+
+    @bentoml.api()
+    async def pipeline_stats(self) -> dict:
+        return self.pipeline.stats()
+
+    @bentoml.api()
+    async def quality_stats(self) -> dict:
+        return self.quality_counters
+
+    @bentoml.api()
+    async def model_info(self) -> dict:
+        return {"model_version": self.model_version, "variants": sorted(self.sessions)}
+
 @bentoml.service()
 class FaceEmbeddingService:
     batch_service = bentoml.depends(FaceEmbeddingBatchService)
 
+    def __init__(self):
+        self.batcher = AdaptiveBatcher(self._run_batch, BATCHING) if BATCHING.mode == "adaptive" else None
+
+    async def _run_batch(self, inputs: List[BatchInput]) -> List[Dict[str, Any]]:
+        return await self.batch_service.to_async.embed_batch(inputs)
+
+    @bentoml.api()
+    async def embed(
+        self,
+        image: Path,
+        detections: List[Dict[str, Any]],
+        tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER,
+        min_quality: float = 0.0,
+    ) -> Dict[str, Any]:
+        """
+        Embed the largest face of one image. With min_quality the face is first scored (size, confidence,
+        pose, sharpness) and below it not embedded: {"error": "low_quality", "rejected": [{"det_id", "quality", "reason"}]}.
+        """
+        batch_input = BatchInput(image=image, detections=detections, tier=tier, min_quality=min_quality)
+        if self.batcher is not None:
+            return await self.batcher.submit(batch_input)
+        results = await self.batch_service.to_async.embed_batch([batch_input])
+        return results[0]
+
+    @bentoml.api()
+    async def embed_faces(
+        self,
+        image: Path,
+        detections: List[Dict[str, Any]],
+        max_faces: Optional[int] = None,
+        rank_by: Literal["size", "conf"] = "size",
+        tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER,
+        min_quality: float = 0.0,
+    ) -> Dict[str, Any]:
+        """
+        Embed every detected face (or the top max_faces) of one image, faces in detection order.
+        With min_quality the faces below it are listed in "rejected" instead.
+        """
+        batch_input = BatchInput(
+            image=image, detections=detections, mode="all", max_faces=max_faces, rank_by=rank_by, tier=tier,
+            min_quality=min_quality,
+        )
+        if self.batcher is not None:
+            return await self.batcher.submit(batch_input)
+        results = await self.batch_service.to_async.embed_batch([batch_input])
+        return results[0]
+
+    @bentoml.api()
+    async def embed_binary(
+        self,
+        image: Path,
+        detections: List[Dict[str, Any]],
+        ctx: bentoml.Context,
+        mode: Literal["largest", "all"] = "largest",
+        max_faces: Optional[int] = None,
+        rank_by: Literal["size", "conf"] = "size",
+        dtype: Literal["float32", "float16"] = "float32",
+        tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER,
+        min_quality: float = 0.0,
+    ) -> bytes:
+        """
+        Embeddings as raw little-endian rows of an (F, 512) dtype matrix, F = 0 when no face was embedded.
+        The detection id of every row is in the X-Det-Ids header (comma separated), faces rejected by
+        min_quality in X-Rejected (JSON).
+        """
+        batch_input = BatchInput(
+            image=image, detections=detections, mode=mode, max_faces=max_faces, rank_by=rank_by,
+            embedding_format=dtype, tier=tier, min_quality=min_quality,
+        )
+        if self.batcher is not None:
+            result = await self.batcher.submit(batch_input)
+        else:
+            result = (await self.batch_service.to_async.embed_batch([batch_input]))[0]
+        ctx.response.metadata["Content-Type"] = "application/octet-stream"
+        ctx.response.metadata["X-Det-Ids"] = ",".join(map(str, result["det_ids"]))
+        ctx.response.metadata["X-Embedding-Dtype"] = dtype
+        if min_quality:
+            ctx.response.metadata["X-Rejected"] = json.dumps(result["rejected"])
+        return result["embeddings"]
+
+    @bentoml.api()
+    async def embed_aligned(
+        self,
+        crops: str,
+        det_ids: List[int],
+        mode: Literal["largest", "all"] = "all",
+        embedding_format: Literal["json", "float32", "float16"] = "json",
+        tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER,
+        min_quality: float = 0.0,
+        detections: List[Dict[str, Any]] = [],
+    ) -> Dict[str, Any]:
+        """
+        Embed faces the detection service already aligned (its detect_align output): crops is base64 of
+        (F, 112, 112, 3) uint8 BGR crops, det_ids their detection ids. No image is uploaded, decoded or
+        written to disk. Results are those of embed / embed_faces, binary formats return
+        {"det_ids", "embeddings": base64 of the (F, 512) matrix}. The quality gate scores the crops, and
+        size, confidence and pose too when the detections are passed.
+        """
+        try:
+            aligned = base64.b64decode(crops, validate=True)
+        except binascii.Error as e:
+            raise BadInput(f"crops is not base64: {e}") from None
+        crop_bytes = ALIGNED_SIZE * ALIGNED_SIZE * 3
+        if len(aligned) != len(det_ids) * crop_bytes:
+            raise BadInput(
+                f"crops holds {len(aligned)} bytes, the {len(det_ids)} det_ids need {len(det_ids) * crop_bytes} "
+                f"({ALIGNED_SIZE}x{ALIGNED_SIZE}x3 per face)"
+            )
+        batch_input = BatchInput(
+            aligned=aligned, aligned_det_ids=det_ids, detections=detections, mode=mode,
+            embedding_format=embedding_format, tier=tier, min_quality=min_quality,
+        )
+        if self.batcher is not None:
+            result = await self.batcher.submit(batch_input)
+        else:
+            result = (await self.batch_service.to_async.embed_batch([batch_input]))[0]
+        if embedding_format != "json":
+            result = {**result, "embeddings": base64.b64encode(result["embeddings"]).decode()}
+        return result
+
+    @bentoml.api()
+    async def embed_frame(
+        self,
+        frame: Dict[str, Any],
+        detections: List[Dict[str, Any]],
+        mode: Literal["largest", "all"] = "largest",
+        max_faces: Optional[int] = None,
+        rank_by: Literal["size", "conf"] = "size",
+        embedding_format: Literal["json", "float32", "float16"] = "json",
+        tier: Literal["fast", "balanced", "accurate"] = DEFAULT_TIER,
+        min_quality: float = 0.0,
+    ) -> Dict[str, Any]:
+        """
+        embed / embed_faces of an image the API put in the shared frame ring, frame is its handle.
+        404 when the frame cannot be read here. Binary formats return {"det_ids", "embeddings": base64}.
+        """
+        try:
+            FRAMES.read(frame)
+        except FrameUnavailable as e:
+            raise NotFound(f"Frame unavailable: {e}") from None
+        batch_input = BatchInput(
+            frame=frame, detections=detections, mode=mode, max_faces=max_faces, rank_by=rank_by,
+            embedding_format=embedding_format, tier=tier, min_quality=min_quality,
+        )
+        if self.batcher is not None:
+            result = await self.batcher.submit(batch_input)
+        else:
+            result = (await self.batch_service.to_async.embed_batch([batch_input]))[0]
+        if embedding_format != "json":
+            result = {**result, "embeddings": base64.b64encode(result["embeddings"]).decode()}
+        return result
+
+    @bentoml.api()
+    async def model_info(self) -> dict:
+        """Content hash of the loaded weights, clients key cached results on it."""
+        return await self.batch_service.to_async.model_info()
+
+    @bentoml.api()
+    async def quality_stats(self) -> dict:
+        """Faces scored and rejected (by reason) by the quality gate, and the embedder passes that saved."""
+        return await self.batch_service.to_async.quality_stats()
+
     @bentoml.api()
-    async def embed(self, image: Path, detections: List[Dict[str, Any]]) -> Dict[str, Any]:
-        batch_input = [BatchInput(image=image, detections=detections)]
-        results = await self.batch_service.to_async.embed_batch(batch_input)
-        return results[0]
\ No newline at end of file
+    async def batching_stats(self) -> dict:
+        return self.batcher.stats() if self.batcher is not None else {"mode": BATCHING.mode}
\ No newline at end of file
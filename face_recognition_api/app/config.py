@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 import os
+from typing import Optional
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 env_file_path = os.path.join(current_dir, "../../.env")
@@ -8,20 +9,102 @@ class Settings(BaseSettings):
     detection_url: str = "http://detection-service:3000"
     embedding_url: str = "http://embedding-service:3000"
 
+    # pooled async clients of the model services
+    service_timeout_s: float = 30.0
+    service_connect_timeout_s: float = 2.0
+    service_max_connections: int = 32
+    service_max_concurrency: int = 16
+    service_retries: int = 2
+    service_backoff_s: float = 0.1
+    breaker_failure_threshold: int = 5
+    breaker_reset_s: float = 10.0
+    # "aligned": the image goes to the detection service only, which decodes it once and sends back the
+    # aligned face crops for the embedding service; "split" uploads the image to both services
+    recognition_transport: str = "aligned"
+    # "http" uploads the images to the model services; "shm" (services on the same host, sharing
+    # frame_ring_dir) copies them into a shared-memory ring and sends only a handle, uploading when it is full
+    image_transport: str = "http"
+    frame_ring_dir: str = "/dev/shm/face-frames"
+    frame_ring_mb: int = 64
+    # min_quality of requests that do not set one: faces scoring below it on size, detector confidence,
+    # pose and blur are not embedded (thresholds: the QUALITY_* variables of the embedding service); 0 embeds all
+    min_face_quality: float = 0.0
+    # "json" (float lists) or a binary transport: "float32" / "float16" little-endian rows
+    embedding_format: str = "json"
+
     postgres_host: str
     postgres_port: int = 5432
     postgres_user: str
     postgres_password: str
     postgres_db: str
+    database_url: str = ""  # overrides the postgres_* settings, e.g. sqlite+aiosqlite:///persons.db
+
+    # async engine pool
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout_s: float = 10.0
+    db_pool_recycle_s: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_timeout_ms: int = 5000
 
     qdrant_host: str = "qdrant"
     qdrant_port: int = 6333
+    # qdrant-client's embedded local mode instead of the server: ":memory:" or a directory to persist to;
+    # one process only and searched by brute force, for tests and benchmarks/load_stack.py
+    qdrant_location: str = ""
     qdrant_collection: str = "face_embeddings"
+    # collection layout, see app/qdrant_profiles.py: "default", "quantized" or "on_disk"; the overrides
+    # below replace single values of the profile. An existing collection is migrated to it at startup.
+    qdrant_profile: str = "default"
+    qdrant_apply_profile: bool = True
+    qdrant_quantization: Optional[bool] = None
+    qdrant_hnsw_m: Optional[int] = None
+    qdrant_hnsw_ef_construct: Optional[int] = None
+    qdrant_vectors_on_disk: Optional[bool] = None
+    qdrant_payload_on_disk: Optional[bool] = None
+    qdrant_hnsw_ef: Optional[int] = None
+    qdrant_oversampling: Optional[float] = None
 
     embedding_dim: int = 512
 
+    # recognition reads id and name from the Qdrant payload; with the check on, every match is
+    # confirmed against Postgres (one more round-trip) and a missing row is reported as an inconsistency
+    person_consistency_check: bool = False
+    person_cache_size: int = 10000  # persons of payload-less (not yet backfilled) points
+    person_cache_ttl_s: float = 300
+
+    identify_batch_max_images: int = 64
+
+    # worker processes of the API, read from the variable uvicorn / gunicorn take their default from
+    web_concurrency: int = 1
+
+    # in-process copy of the collection searched instead of Qdrant while it has at most max_size points;
+    # it follows the upserts / deletes of this process and is turned off when web_concurrency > 1.
+    # Writes by other processes are picked up when a search finds the point count changed (checked every
+    # sync_s), until then confirm_misses still finds faces enrolled elsewhere
+    local_index_enabled: bool = False
+    local_index_max_size: int = 100_000
+    local_index_dtype: str = "float32"  # or "float16": half the memory, but widening it per search makes it ~10x slower
+    local_index_path: str = ""  # memory-map the matrix from "<path>.<pid>" instead of the heap
+    local_index_confirm_misses: bool = True
+    local_index_sync_s: float = 5.0
+
+    # bulk enrollment: items embedded concurrently, and persons checked / inserted / upserted together
+    bulk_enroll_concurrency: int = 32
+    bulk_enroll_batch: int = 128
+    bulk_enroll_flush_s: float = 1.0  # a partial batch is written once its oldest item waited this long
+
+    # content-addressed cache of detection / embedding results
+    result_cache_enabled: bool = True
+    result_cache_max_mb: int = 256
+    result_cache_ttl_s: float = 3600
+    result_cache_path: str = ""  # SQLite file shared by the API workers, empty keeps the cache per process
+    model_version_refresh_s: float = 30
+
     def get_database_url(self) -> str:
-        return f"postgresql://{self.postgres_user}:{self.postgres_password}@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}"
+        if self.database_url:
+            return self.database_url
+        return f"postgresql+asyncpg://{self.postgres_user}:{self.postgres_password}@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}"
 
     model_config = SettingsConfigDict(env_file=env_file_path)
 
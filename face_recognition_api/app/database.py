@@ -1,12 +1,21 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
 from app.config import settings
 
-engine = create_engine(
-    settings.get_database_url(),
-    echo=False,
-    future=True
-)
+def _engine_kwargs() -> dict:
+    url = settings.get_database_url()
+    kwargs = {"echo": False, "pool_pre_ping": settings.db_pool_pre_ping}
+    if url.startswith("sqlite"):  # local stand-in, no server side pool or statement settings
+        return kwargs
+    return {
+        **kwargs,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout_s,
+        "pool_recycle": settings.db_pool_recycle_s,
+        "connect_args": {"server_settings": {"statement_timeout": str(settings.db_statement_timeout_ms)}},
+    }
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+engine = create_async_engine(settings.get_database_url(), **_engine_kwargs())
+
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
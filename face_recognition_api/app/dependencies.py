@@ -1,25 +1,27 @@
 from fastapi import Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from qdrant_client import QdrantClient
-from typing import Annotated, Generator
+from typing import Annotated, AsyncGenerator
 
 from app.database import SessionLocal
 from app.config import settings
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-_qdrant_client = QdrantClient(
-    host=settings.qdrant_host,
-    port=settings.qdrant_port,
-    timeout=10.0
-)
+if settings.qdrant_location == ":memory:":
+    _qdrant_client = QdrantClient(location=":memory:")
+elif settings.qdrant_location:
+    _qdrant_client = QdrantClient(path=settings.qdrant_location)
+else:
+    _qdrant_client = QdrantClient(
+        host=settings.qdrant_host,
+        port=settings.qdrant_port,
+        timeout=10.0
+    )
 def get_qdrant() -> QdrantClient:
     return _qdrant_client
 
-DbSession = Annotated[Session, Depends(get_db)]
+DbSession = Annotated[AsyncSession, Depends(get_db)]
 QdrantDep = Annotated[QdrantClient, Depends(get_qdrant)]
\ No newline at end of file
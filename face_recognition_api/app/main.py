@@ -1,11 +1,15 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 import logging
 
 from app.models.person_model import Base
 from app.routers.person import router as person_router
-from app.database import engine
-from app.qdrant_init import init_qdrant_collection
+from app.database import SessionLocal, engine
+from app.qdrant_init import backfill_person_payload, init_qdrant_collection, rebuild_local_index
+from app.config import settings
+from app.services.frame_ring import frame_ring
+from app.services.service_client import ServiceUnavailableError, close_service_clients
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,14 +21,25 @@ logger = logging.getLogger("face-api")
 async def lifespan(app: FastAPI):
     logger.info("Starting Face Recognition API...")
     logger.info("Creating database tables if not exist...")
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
     logger.info("Database tables ready")
 
     logger.info("Initializing Qdrant collection if not exist...")
     init_qdrant_collection()
+    async with SessionLocal() as db:
+        backfilled = await backfill_person_payload(db)
+    if backfilled:
+        logger.info("Stored person id and name in the payload of %d Qdrant points", backfilled)
+    rebuild_local_index()
     logger.info("Qdrant ready")
+    if settings.image_transport == "shm":
+        frame_ring.open()
     yield
     logger.info("Shutting down Face Recognition API...")
+    await close_service_clients()
+    frame_ring.close()
+    await engine.dispose()
 
 app = FastAPI(
     title="Face Recognition API",
@@ -35,6 +50,10 @@ app = FastAPI(
 
 app.include_router(person_router)
 
+@app.exception_handler(ServiceUnavailableError)
+async def service_unavailable_handler(request: Request, exc: ServiceUnavailableError):
+    return JSONResponse(status_code=503, content={"detail": f"{exc.service} service unavailable"})
+
 @app.get("/health")
 async def health():
     return {"status": "ok", "message": "API is running"}
\ No newline at end of file
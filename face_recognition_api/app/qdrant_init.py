@@ -1,18 +1,140 @@
-from qdrant_client.http.models import VectorParams, Distance
+import logging
+
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import VectorParams, Distance, Filter, IsEmptyCondition, PayloadField, \
+    SetPayload, SetPayloadOperation, CollectionParamsDiff, Disabled, IntegerIndexParams, KeywordIndexParams, \
+    PayloadSchemaType, VectorParamsDiff
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from app.config import settings
 from app.dependencies import get_qdrant
+from app.qdrant_profiles import CollectionProfile, collection_profile, hnsw_config, quantization_config
+from app.repositories.local_index import WRITTEN_AT, local_index
+from app.repositories.person_repo import get_persons_by_qdrant_ids, person_payload
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH = 256
 
 def init_qdrant_collection() -> None:
     client = get_qdrant()
     collection_name = settings.qdrant_collection
+    profile = collection_profile
     
-    try:
-        client.get_collection(collection_name)
-    except Exception as e:
+    if not client.collection_exists(collection_name):
         client.create_collection(
             collection_name=collection_name,
             vectors_config=VectorParams(
                 size=settings.embedding_dim,
-                distance=Distance.COSINE
+                distance=Distance.COSINE,
+                on_disk=profile.vectors_on_disk,
+            ),
+            hnsw_config=hnsw_config(profile),
+            quantization_config=quantization_config(profile),
+            on_disk_payload=profile.payload_on_disk,
+        )
+    elif settings.qdrant_apply_profile:
+        apply_collection_profile(client, collection_name, profile)
+    if profile.payload_indexes:
+        create_payload_indexes(client, collection_name, profile)
+
+def apply_collection_profile(client: QdrantClient, collection_name: str, profile: CollectionProfile) -> list[str]:
+    """
+    Migrates an existing collection to the profile: only the settings that differ are updated,
+    Qdrant rebuilds the affected segments in the background and keeps serving searches meanwhile.
+    Returns the names of the changed settings.
+    """
+    config = client.get_collection(collection_name).config
+    update, changed = {}, []
+
+    hnsw = config.hnsw_config
+    wanted_hnsw = hnsw_config(profile)
+    if any(
+        getattr(wanted_hnsw, key) is not None and getattr(wanted_hnsw, key) != (getattr(hnsw, key) or False)
+        for key in ("m", "ef_construct", "on_disk")
+    ):
+        update["hnsw_config"] = wanted_hnsw
+        changed.append("hnsw")
+
+    quantization = quantization_config(profile)
+    if (quantization is None) != (config.quantization_config is None) or (
+        quantization is not None and quantization.scalar != getattr(config.quantization_config, "scalar", None)
+    ):
+        update["quantization_config"] = quantization or Disabled.DISABLED
+        changed.append("quantization")
+
+    if (config.params.vectors.on_disk or False) != profile.vectors_on_disk:
+        update["vectors_config"] = {"": VectorParamsDiff(on_disk=profile.vectors_on_disk)}
+        changed.append("vectors_on_disk")
+
+    if (config.params.on_disk_payload or False) != profile.payload_on_disk:
+        update["collection_params"] = CollectionParamsDiff(on_disk_payload=profile.payload_on_disk)
+        changed.append("payload_on_disk")
+
+    if update:
+        logger.info("Migrating collection %s to profile %s: %s", collection_name, profile.name, ", ".join(changed))
+        client.update_collection(collection_name=collection_name, **update)
+    return changed
+
+def create_payload_indexes(client: QdrantClient, collection_name: str, profile: CollectionProfile) -> None:
+    existing = client.get_collection(collection_name).payload_schema
+    indexes = {
+        "person_id": IntegerIndexParams(type=PayloadSchemaType.INTEGER, lookup=True, range=False, on_disk=profile.payload_on_disk),
+        "name": KeywordIndexParams(type=PayloadSchemaType.KEYWORD, on_disk=profile.payload_on_disk),
+    }
+    for field, schema in indexes.items():
+        if field not in existing:
+            client.create_payload_index(collection_name=collection_name, field_name=field, field_schema=schema)
+
+async def backfill_person_payload(db: AsyncSession) -> int:
+    """
+    Migration of points enrolled before the payload carried the person: copies id and name from
+    Postgres into every point without a person_id. Idempotent, a no-op scroll once all points are done.
+    Returns the number of points updated.
+    """
+    client = get_qdrant()
+    collection_name = settings.qdrant_collection
+    missing = Filter(must=[IsEmptyCondition(is_empty=PayloadField(key="person_id"))])
+
+    updated, offset = 0, None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            scroll_filter=missing,
+            limit=BACKFILL_BATCH,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+        persons = await get_persons_by_qdrant_ids(db, [str(point.id) for point in points])
+        if len(persons) < len(points):
+            logger.warning("%d Qdrant points have no person in Postgres", len(points) - len(persons))
+        if persons:
+            client.batch_update_points(
+                collection_name=collection_name,
+                update_operations=[
+                    SetPayloadOperation(set_payload=SetPayload(payload=person_payload(person), points=[qdrant_id]))
+                    for qdrant_id, person in persons.items()
+                ],
             )
-        )
\ No newline at end of file
+            updated += len(persons)
+        if offset is None:
+            return updated
+
+def rebuild_local_index() -> None:
+    """Loads the collection into the local index, unless it is disabled, the gallery is above its size or there are several workers."""
+    if not settings.local_index_enabled:
+        return
+    if settings.web_concurrency > 1:
+        # each worker's index would only follow its own writes and keep serving what the others deleted
+        logger.warning("Local index disabled: it needs a single API worker, WEB_CONCURRENCY is %d", settings.web_concurrency)
+        return
+    client = get_qdrant()
+    if WRITTEN_AT not in client.get_collection(settings.qdrant_collection).payload_schema:
+        # sync orders by it to find the latest write
+        client.create_payload_index(
+            collection_name=settings.qdrant_collection,
+            field_name=WRITTEN_AT,
+            field_schema=IntegerIndexParams(type=PayloadSchemaType.INTEGER, lookup=False, range=True),
+        )
+    local_index.load(client, settings.qdrant_collection)
@@ -0,0 +1,76 @@
+from dataclasses import dataclass, replace
+
+from qdrant_client.http.models import HnswConfigDiff, QuantizationSearchParams, ScalarQuantization, \
+    ScalarQuantizationConfig, ScalarType, SearchParams
+
+from app.config import Settings, settings
+
+@dataclass(frozen=True)
+class CollectionProfile:
+    """
+    Storage and index layout of the face collection, with the search parameters that go with it.
+    None leaves a setting to Qdrant's default.
+    """
+    name: str
+    quantization: bool = False  # int8 scalar quantization of the vectors, kept in RAM
+    quantile: float = 0.99
+    hnsw_m: int | None = None
+    hnsw_ef_construct: int | None = None
+    hnsw_on_disk: bool = False
+    vectors_on_disk: bool = False  # originals on disk, only read to rescore quantized candidates
+    payload_on_disk: bool = False
+    payload_indexes: bool = False  # person_id / name indexes, for filters and the payload backfill
+    hnsw_ef: int | None = None  # search-time beam width
+    rescore: bool = True
+    oversampling: float = 1.0
+
+PROFILES = {
+    # the original layout: full fp32 vectors and HNSW graph in RAM, Qdrant defaults
+    "default": CollectionProfile("default"),
+    # int8 copies searched in RAM (4x less vector memory traffic), rescored with the fp32 originals in RAM
+    "quantized": CollectionProfile(
+        "quantized", quantization=True, hnsw_m=16, hnsw_ef_construct=128, payload_indexes=True,
+        hnsw_ef=128, oversampling=1.5,
+    ),
+    # multi-million galleries: only the int8 copies and the graph stay in RAM, originals and payload on disk
+    "on_disk": CollectionProfile(
+        "on_disk", quantization=True, hnsw_m=16, hnsw_ef_construct=128, vectors_on_disk=True,
+        payload_on_disk=True, payload_indexes=True, hnsw_ef=128, oversampling=2.0,
+    ),
+}
+
+def profile_from_settings(settings: Settings) -> CollectionProfile:
+    """QDRANT_PROFILE with the QDRANT_* overrides that are set applied."""
+    if settings.qdrant_profile not in PROFILES:
+        raise ValueError(f"Unknown QDRANT_PROFILE {settings.qdrant_profile!r}, expected one of {list(PROFILES)}")
+    overrides = {
+        "quantization": settings.qdrant_quantization,
+        "hnsw_m": settings.qdrant_hnsw_m,
+        "hnsw_ef_construct": settings.qdrant_hnsw_ef_construct,
+        "vectors_on_disk": settings.qdrant_vectors_on_disk,
+        "payload_on_disk": settings.qdrant_payload_on_disk,
+        "hnsw_ef": settings.qdrant_hnsw_ef,
+        "oversampling": settings.qdrant_oversampling,
+    }
+    return replace(PROFILES[settings.qdrant_profile], **{k: v for k, v in overrides.items() if v is not None})
+
+def hnsw_config(profile: CollectionProfile) -> HnswConfigDiff:
+    return HnswConfigDiff(m=profile.hnsw_m, ef_construct=profile.hnsw_ef_construct, on_disk=profile.hnsw_on_disk)
+
+def quantization_config(profile: CollectionProfile) -> ScalarQuantization | None:
+    if not profile.quantization:
+        return None
+    return ScalarQuantization(
+        scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=profile.quantile, always_ram=True)
+    )
+
+def search_params(profile: CollectionProfile, hnsw_ef: int | None = None, exact: bool = False) -> SearchParams:
+    """Search parameters of the profile, hnsw_ef / exact override them for one request."""
+    return SearchParams(
+        hnsw_ef=hnsw_ef or profile.hnsw_ef,
+        exact=exact,
+        quantization=QuantizationSearchParams(rescore=profile.rescore, oversampling=profile.oversampling)
+        if profile.quantization else None,
+    )
+
+collection_profile = profile_from_settings(settings)
@@ -0,0 +1,234 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+from qdrant_client.http.models import Direction, OrderBy
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+FLOAT16_CHUNK = 16384  # float16 rows are widened to float32 in chunks of this many for the BLAS product
+INITIAL_CAPACITY = 1024
+SCROLL_BATCH = 1024
+# payload field with the time.time_ns() of the upsert that wrote the point, the collection's update marker
+WRITTEN_AT = "written_at"
+
+
+class LocalIndex:
+    """
+    In-process copy of the Qdrant collection for galleries up to max_size points: unit embeddings
+    in a (capacity, dim) matrix, optionally memory-mapped from path, so a search is one matrix product
+    and an argpartition instead of a network hop.
+
+    It is loaded from a Qdrant scroll at startup and then follows the upserts and deletes made through
+    person_repo. Writes made elsewhere (another replica, a script using person_repo) are caught by sync:
+    every sync_s it compares the point count and the latest WRITTEN_AT of the collection with its own and
+    reloads on a mismatch, so a delete followed by an enrollment is caught too. While the gallery is above
+    max_size it is inactive and searches go to Qdrant, sync keeps reloading it until it fits again.
+    """
+
+    def __init__(self, dim: int, max_size: int, dtype: str = "float32", path: str = "", sync_s: float = 5.0):
+        self.dim = dim
+        self.max_size = max_size
+        self.dtype = np.dtype(dtype)
+        self.path = path
+        self.sync_s = sync_s
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.synced_at = 0.0
+        self.loaded = False  # sync only follows an index that was loaded (enabled, single worker)
+        self.active = False
+        self._reset(capacity=0)  # nothing is allocated (or written to path) before the load
+
+    def _reset(self, capacity: int):
+        self.matrix = self._allocate(capacity)
+        self.ids: List[str] = []
+        self.payloads: List[dict] = []
+        self.rows: Dict[str, int] = {}
+        self.written_at = 0  # latest WRITTEN_AT of the points held
+
+    def _allocate(self, capacity: int) -> np.ndarray:
+        if not self.path or not capacity:
+            return np.zeros((capacity, self.dim), dtype=self.dtype)
+        # one file per process: memmaps opened "w+" by several workers would truncate each other's
+        path = f"{self.path}.{os.getpid()}"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return np.memmap(path, dtype=self.dtype, mode="w+", shape=(capacity, self.dim))
+
+    def _grow(self, needed: int):
+        capacity = len(self.matrix)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        old = np.array(self.matrix[:len(self.ids)])
+        if isinstance(self.matrix, np.memmap):
+            del self.matrix  # the file is recreated at the new size
+        self.matrix = self._allocate(capacity)
+        self.matrix[:len(old)] = old
+
+    def rebuild(self, batches):
+        """Replaces the contents with the (ids, vectors, payloads) batches of a scroll and activates the index."""
+        with self.lock:
+            self.active = False
+            self._reset(capacity=INITIAL_CAPACITY)
+            for ids, vectors, payloads in batches:
+                if len(self.ids) + len(ids) > self.max_size:
+                    logger.info("Gallery larger than %d points, searching Qdrant", self.max_size)
+                    self._reset(capacity=0)
+                    return
+                self._upsert(ids, vectors, payloads)
+            self.active = True
+            logger.info("Local index of %d points ready", len(self.ids))
+
+    def upsert(self, ids: List[str], vectors, payloads: List[dict]):
+        with self.lock:
+            if not self.active:
+                return
+            self._upsert(ids, vectors, payloads)
+            if len(self.ids) > self.max_size:
+                logger.info("Gallery grew above %d points, searching Qdrant until the next rebuild", self.max_size)
+                self.active = False
+                self._reset(capacity=0)
+
+    def _upsert(self, ids: List[str], vectors, payloads: List[dict]):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        self._grow(len(self.ids) + len(ids))
+        for point_id, vector, payload in zip(ids, vectors, payloads):
+            row = self.rows.get(point_id)
+            if row is None:
+                row = self.rows[point_id] = len(self.ids)
+                self.ids.append(point_id)
+                self.payloads.append(payload)
+            else:
+                self.payloads[row] = payload
+            self.matrix[row] = vector
+            self.written_at = max(self.written_at, payload.get(WRITTEN_AT, 0))
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            if not self.active:
+                return
+            latest_deleted = False
+            for point_id in ids:
+                row = self.rows.pop(point_id, None)
+                if row is None:
+                    continue
+                latest_deleted |= self.payloads[row].get(WRITTEN_AT, 0) == self.written_at
+                last = len(self.ids) - 1  # the last row moves into the hole
+                if row != last:
+                    self.matrix[row] = self.matrix[last]
+                    self.ids[row], self.payloads[row] = self.ids[last], self.payloads[last]
+                    self.rows[self.ids[row]] = row
+                self.ids.pop()
+                self.payloads.pop()
+            if latest_deleted:
+                self.written_at = max((payload.get(WRITTEN_AT, 0) for payload in self.payloads), default=0)
+
+    def search(self, embeddings, threshold: float, limit: int) -> List[List[tuple]]:
+        """Same result as person_repo.search_candidates: up to limit (id, similarity, payload) per embedding, best first."""
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        with self.lock:
+            n = len(self.ids)
+            if n == 0:
+                return [[] for _ in queries]
+            scores = self._scores(queries, n)
+            k = min(limit, n)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < n else np.tile(np.arange(n), (len(queries), 1))
+            results = []
+            for query_scores, rows in zip(scores, top):
+                rows = rows[np.argsort(-query_scores[rows])]
+                results.append([
+                    (self.ids[row], float(query_scores[row]), self.payloads[row])
+                    for row in rows if query_scores[row] >= threshold
+                ])
+            return results
+
+    def _scores(self, queries: np.ndarray, n: int) -> np.ndarray:
+        if self.dtype == np.float32:
+            return queries @ self.matrix[:n].T
+        scores = np.empty((len(queries), n), dtype=np.float32)
+        for start in range(0, n, FLOAT16_CHUNK):
+            end = min(start + FLOAT16_CHUNK, n)
+            scores[:, start:end] = queries @ self.matrix[start:end].astype(np.float32).T
+        return scores
+
+    def load(self, client, collection_name: str):
+        """Rebuilds the index from the collection, unless it has more than max_size points."""
+        self.loaded = True
+        self.synced_at = time.monotonic()
+        points = client.count(collection_name=collection_name, exact=True).count
+        if points > self.max_size:
+            logger.info("Gallery of %d points is above LOCAL_INDEX_MAX_SIZE, searching Qdrant", points)
+            with self.lock:
+                self.active = False
+                self._reset(capacity=0)
+            return
+
+        def batches():
+            offset = None
+            while True:
+                records, offset = client.scroll(
+                    collection_name=collection_name,
+                    limit=SCROLL_BATCH,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=True,
+                )
+                yield [str(r.id) for r in records], [r.vector for r in records], [r.payload or {} for r in records]
+                if offset is None:
+                    return
+
+        self.rebuild(batches())
+
+    def sync(self, client, collection_name: str):
+        """
+        Reloads the index if another process wrote to the collection since the last check, at most every sync_s.
+        An inactive index counts the collection on every check and reloads as soon as the gallery fits in max_size.
+        """
+        if not self.loaded or time.monotonic() - self.synced_at < self.sync_s:
+            return
+        if not self.sync_lock.acquire(blocking=False):
+            return  # another thread is checking, its search goes on with the current contents
+        try:
+            if time.monotonic() - self.synced_at < self.sync_s:
+                return
+            self.synced_at = time.monotonic()
+            if not self.active:
+                self.load(client, collection_name)
+                return
+            points = client.count(collection_name=collection_name, exact=True).count
+            latest, _ = client.scroll(
+                collection_name=collection_name,
+                limit=1,
+                order_by=OrderBy(key=WRITTEN_AT, direction=Direction.DESC),
+                with_payload=[WRITTEN_AT],
+                with_vectors=False,
+            )
+            written_at = (latest[0].payload or {}).get(WRITTEN_AT, 0) if latest else 0
+            if (points, written_at) != (len(self.ids), self.written_at):
+                logger.info(
+                    "Collection has %d points written up to %d, local index %d up to %d: written elsewhere, reloading",
+                    points, written_at, len(self.ids), self.written_at,
+                )
+                self.load(client, collection_name)
+        finally:
+            self.sync_lock.release()
+
+    def stats(self) -> dict:
+        return {"active": self.active, "points": len(self.ids), "max_size": self.max_size, "dtype": self.dtype.name}
+
+
+local_index = LocalIndex(
+    settings.embedding_dim,
+    max_size=settings.local_index_max_size if settings.local_index_enabled else 0,
+    dtype=settings.local_index_dtype,
+    path=settings.local_index_path if settings.local_index_enabled else "",
+    sync_s=settings.local_index_sync_s,
+)
@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from app.config import settings
+
+
+class PersonRecord(NamedTuple):
+    """The fields of a person a recognition response needs, detached from any DB session."""
+    id: int
+    name: str
+    qdrant_id: str
+
+
+class PersonCache:
+    """
+    Read-through LRU of person rows by Qdrant point id, for points whose payload does not carry
+    the person yet. Entries expire after ttl_s so a person deleted through another worker is not
+    served for long; delete_person invalidates the entry of its own worker immediately.
+    """
+
+    def __init__(self, max_entries: int, ttl_s: float):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.entries: OrderedDict[str, tuple[PersonRecord, float]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(("hits", "misses", "invalidations"), 0)
+
+    def get(self, qdrant_id: str) -> PersonRecord | None:
+        with self.lock:
+            entry = self.entries.get(qdrant_id)
+            if entry is not None and entry[1] >= time.monotonic():
+                self.entries.move_to_end(qdrant_id)
+                self.counters["hits"] += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[qdrant_id]
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, person: PersonRecord):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries.pop(person.qdrant_id, None)
+            self.entries[person.qdrant_id] = (person, time.monotonic() + self.ttl_s)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, qdrant_id: str):
+        with self.lock:
+            if self.entries.pop(qdrant_id, None) is not None:
+                self.counters["invalidations"] += 1
+
+    def stats(self) -> dict:
+        return {**self.counters, "entries": len(self.entries), "max_entries": self.max_entries}
+
+
+person_cache = PersonCache(settings.person_cache_size, settings.person_cache_ttl_s)
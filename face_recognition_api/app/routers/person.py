@@ -1,14 +1,50 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status
+from fastapi.responses import StreamingResponse
+from typing import List, Literal, Optional
+import asyncio
+import json
+import logging
+import shutil
+import tempfile
+import zipfile
+from pathlib import PurePosixPath
 
 from app.dependencies import DbSession, QdrantDep
-from app.repositories.person_repo import delete_person_by_id, get_person_by_name, create_person, get_person_by_qdrant_id, \
-    search_similar_face, upsert_embedding, get_person_by_id, delete_from_qdrant
-from app.services.face_services import detect_faces, get_embedding
-from app.schemas.person_schemas import Detection, PersonResponse
+from app.repositories.local_index import local_index
+from app.repositories.person_cache import person_cache
+from app.repositories.person_repo import delete_person_by_id, get_person_by_name, create_person, resolve_person, \
+    search_similar_face, upsert_embedding, get_person_by_id, delete_from_qdrant, search_similar_faces, \
+    resolve_persons, search_candidates
+from app.services.enrollment import STATUSES, ImageReader, enroll_bulk
+from app.services.frame_ring import frame_ring
+from app.services.face_services import detect_and_embed
+from app.services.result_cache import result_cache
+from app.services.service_client import ServiceUnavailableError, detection_client, embedding_client
+from app.schemas.person_schemas import Detection, PersonResponse, FaceMatch, FacesResponse, Candidate, \
+    ImageIdentification, BatchIdentifyResponse, RejectedFace
+from app.config import settings
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api", tags=["persons"])
 
 SIMILARITY_THRESHOLD = 0.35
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+UPLOAD_SPOOL_BYTES = 16 * 2**20  # bulk uploads are kept in memory up to this size, then in a temporary file
+Tier = Literal["fast", "balanced", "accurate"]
+TIER_DESCRIPTION = "fast: small detector input, no flip-TTA; balanced: medium input, no flip-TTA; accurate: full quality"
+HNSW_EF_DESCRIPTION = "Search beam width, higher is more accurate and slower (default: the collection profile's)"
+EXACT_DESCRIPTION = "Exact search over all faces instead of the HNSW index"
+MIN_QUALITY_DESCRIPTION = "Faces of a lower quality (size, confidence, pose, blur; 0.0–1.0) are not embedded (default: the server's)"
+
+def _min_quality(min_quality: Optional[float]) -> float:
+    return settings.min_face_quality if min_quality is None else min_quality
+
+def _embedding_error(result: dict) -> str:
+    if result["error"] == "low_quality":
+        worst = max(result["rejected"], key=lambda face: face["quality"])
+        return f"Face quality too low ({worst['reason']}, quality {worst['quality']})"
+    return "No alignable face found"
 
 @router.post("/new_person", response_model=PersonResponse, status_code=201)
 async def new_person(
@@ -16,28 +52,34 @@ async def new_person(
     qdrant: QdrantDep,
     name: str = Form(..., description="Person name"),
     file: UploadFile = File(..., media_type="image/*"),
+    min_quality: Optional[float] = Form(None, ge=0.0, le=1.0, description=MIN_QUALITY_DESCRIPTION),
 ):
-    if get_person_by_name(db, name):
+    if await get_person_by_name(db, name):
         raise HTTPException(409, detail=f"Person '{name}' already exists")
 
     image_bytes = await file.read()
     if not image_bytes:
         raise HTTPException(400, detail="Empty file")
 
-    detections = detect_faces(image_bytes)
+    detections, embedding_result = await detect_and_embed(image_bytes, min_quality=_min_quality(min_quality))
     if not detections:
         raise HTTPException(422, detail="No faces found")
 
-    embedding_result = get_embedding(image_bytes, detections)
+    if "error" in embedding_result:
+        raise HTTPException(422, detail=_embedding_error(embedding_result))
     embedding = embedding_result["embedding"]
     best_det_id = embedding_result["best_det_id"]
 
-    exists_qdrant_id, similarity = search_similar_face(qdrant, embedding, threshold=SIMILARITY_THRESHOLD)
+    exists_qdrant_id, similarity, _ = search_similar_face(qdrant, embedding, threshold=SIMILARITY_THRESHOLD)
     if exists_qdrant_id is not None:
         raise HTTPException(409, detail=f"Similar person already exists")
 
-    qdrant_id = upsert_embedding(qdrant, name, embedding)
-    person = create_person(db, name, qdrant_id)
+    person = await create_person(db, name)
+    try:
+        upsert_embedding(qdrant, person, embedding)
+    except Exception:
+        await delete_person_by_id(db, person.id)
+        raise
 
     return PersonResponse(
         id=person.id,
@@ -48,31 +90,131 @@ async def new_person(
     )
 
 
+def _entry_reader(archive: zipfile.ZipFile, entry: zipfile.ZipInfo) -> ImageReader:
+    async def read() -> bytes:
+        return archive.read(entry)
+    return read
+
+def _span_reader(spool, start: int, length: int) -> ImageReader:
+    async def read() -> bytes:
+        spool.seek(start)  # no await between seek and read, concurrent readers cannot interleave
+        return spool.read(length)
+    return read
+
+def _spool(uploads: List[UploadFile]) -> tuple[tempfile.SpooledTemporaryFile, list[tuple[int, int]]]:
+    """
+    The uploads copied one after another into a spool owned by the response, with the (start, length) of
+    each: the form files are closed when the handler returns, before the streamed body reads them.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    spans = []
+    for upload in uploads:
+        upload.file.seek(0)
+        start = spool.tell()
+        shutil.copyfileobj(upload.file, spool)
+        spans.append((start, spool.tell() - start))
+    return spool, spans
+
+def _archive_items(archive_file) -> tuple[zipfile.ZipFile, list[tuple[str, ImageReader]]]:
+    """
+    The opened zip archive and its (name, reader) pairs, the name of a person is the file name without
+    extension. Only the directory is read here, an image when its reader is called; the archive has to
+    stay open until then.
+    """
+    try:
+        archive = zipfile.ZipFile(archive_file)
+    except zipfile.BadZipFile:
+        raise HTTPException(400, detail="Invalid zip archive")
+    return archive, [
+        (PurePosixPath(entry.filename).stem, _entry_reader(archive, entry))
+        for entry in archive.infolist()
+        if not entry.is_dir()
+        and PurePosixPath(entry.filename).suffix.lower() in IMAGE_EXTENSIONS
+        and not any(part.startswith((".", "__MACOSX")) for part in PurePosixPath(entry.filename).parts)
+    ]
+
+@router.post("/bulk_enroll")
+async def bulk_enroll(
+    qdrant: QdrantDep,
+    files: Optional[List[UploadFile]] = File(None, description="Images, paired with names by position"),
+    names: Optional[List[str]] = Form(None, description="Person names, one per file"),
+    archive: Optional[UploadFile] = File(None, description="Zip of images named <person name>.<ext>, instead of files/names"),
+    threshold: float = Form(SIMILARITY_THRESHOLD, ge=0.0, le=1.0, description="Similarity of a duplicate (0.0–1.0)"),
+    tier: Tier = Form("accurate", description=TIER_DESCRIPTION),
+    min_quality: Optional[float] = Form(None, ge=0.0, le=1.0, description=MIN_QUALITY_DESCRIPTION),
+):
+    """
+    Enrolls many persons at once. The response is newline-delimited JSON streamed while the upload
+    is processed: one line per item as it finishes ({"index", "name", "status", ...} with status one of
+    enrolled / exists / duplicate / no_face / low_quality / error), then a {"summary": {status: count}} line.
+    Large directories should be sent as an archive, multipart forms are limited to 1000 files.
+    Images are read from a copy of the upload only when their item is scheduled.
+    """
+    if archive is not None:
+        uploads = [archive]
+    elif files and names and len(files) == len(names):
+        uploads = files
+    else:
+        raise HTTPException(400, detail="Send an archive, or files and names of the same length")
+    spool, spans = await asyncio.to_thread(_spool, uploads)
+    opened = None
+    try:
+        if archive is not None:
+            opened, items = _archive_items(spool)
+        else:
+            items = [(name, _span_reader(spool, *span)) for name, span in zip(names, spans)]
+        if not items:
+            raise HTTPException(400, detail="No images")
+    except BaseException:
+        if opened is not None:
+            opened.close()
+        spool.close()
+        raise
+
+    async def lines():
+        summary = dict.fromkeys(STATUSES, 0)
+        try:
+            async for item in enroll_bulk(qdrant, items, threshold=threshold, tier=tier, min_quality=_min_quality(min_quality)):
+                summary[item["status"]] += 1
+                yield json.dumps(item) + "\n"
+        finally:
+            if opened is not None:
+                opened.close()
+            spool.close()
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @router.post("/get_person", response_model=PersonResponse)
 async def get_person(
     db: DbSession,
     qdrant: QdrantDep,
     file: UploadFile = File(..., media_type="image/*"),
     threshold: float = Form(SIMILARITY_THRESHOLD, ge=0.0, le=1.0, description="Min similarity (0.0–1.0)"),
+    tier: Tier = Form("accurate", description=TIER_DESCRIPTION),
+    hnsw_ef: Optional[int] = Form(None, ge=1, description=HNSW_EF_DESCRIPTION),
+    exact: bool = Form(False, description=EXACT_DESCRIPTION),
+    min_quality: Optional[float] = Form(None, ge=0.0, le=1.0, description=MIN_QUALITY_DESCRIPTION),
 ):
     image_bytes = await file.read()
     if not image_bytes:
         raise HTTPException(400, detail="Empty file")
 
-    detections = detect_faces(image_bytes)
+    detections, result = await detect_and_embed(image_bytes, tier=tier, min_quality=_min_quality(min_quality))
     if not detections:
         raise HTTPException(422, detail="No faces found")
 
-    result = get_embedding(image_bytes, detections)
+    if "error" in result:
+        raise HTTPException(422, detail=_embedding_error(result))
     embedding = result["embedding"]
     best_det_id = result["best_det_id"]
 
-    qdrant_id, similarity = search_similar_face(qdrant, embedding, threshold=threshold)
+    qdrant_id, similarity, payload = search_similar_face(qdrant, embedding, threshold=threshold, hnsw_ef=hnsw_ef, exact=exact)
 
     if not qdrant_id or not similarity:
         raise HTTPException(404, detail="Person not found")
     
-    person = get_person_by_qdrant_id(db, qdrant_id)
+    person = await resolve_person(db, qdrant_id, payload)
     if not person:
         raise HTTPException(500, detail="Inconsistency: name found in Qdrant but not in Postgres")
 
@@ -85,20 +227,139 @@ async def get_person(
         detections=[Detection(**d) for d in detections],
     )
 
+@router.post("/identify_faces", response_model=FacesResponse)
+async def identify_faces(
+    db: DbSession,
+    qdrant: QdrantDep,
+    file: UploadFile = File(..., media_type="image/*"),
+    threshold: float = Form(SIMILARITY_THRESHOLD, ge=0.0, le=1.0, description="Min similarity (0.0–1.0)"),
+    max_faces: Optional[int] = Form(None, ge=1, description="Identify only the top N faces"),
+    rank_by: Literal["size", "conf"] = Form("size", description="Ranking of faces for max_faces"),
+    tier: Tier = Form("accurate", description=TIER_DESCRIPTION),
+    hnsw_ef: Optional[int] = Form(None, ge=1, description=HNSW_EF_DESCRIPTION),
+    exact: bool = Form(False, description=EXACT_DESCRIPTION),
+    min_quality: Optional[float] = Form(None, ge=0.0, le=1.0, description=MIN_QUALITY_DESCRIPTION),
+):
+    image_bytes = await file.read()
+    if not image_bytes:
+        raise HTTPException(400, detail="Empty file")
+
+    detections, result = await detect_and_embed(
+        image_bytes, tier=tier, mode="all", max_faces=max_faces, rank_by=rank_by, min_quality=_min_quality(min_quality)
+    )
+    if not detections:
+        raise HTTPException(422, detail="No faces found")
+
+    faces = result.get("faces", [])
+    matches = search_similar_faces(
+        qdrant, [face["embedding"] for face in faces], threshold=threshold, hnsw_ef=hnsw_ef, exact=exact
+    )
+    persons = await resolve_persons(db, [(qdrant_id, payload) for qdrant_id, _, payload in matches if qdrant_id is not None])
+
+    response_faces = []
+    for face, (qdrant_id, similarity, _) in zip(faces, matches):
+        person = persons.get(str(qdrant_id)) if qdrant_id is not None else None
+        response_faces.append(FaceMatch(
+            det_id=face["det_id"],
+            detection=Detection(**detections[face["det_id"]]),
+            id=person.id if person else None,
+            name=person.name if person else None,
+            similarity=round(similarity, 4) if person else None,
+        ))
+
+    rejected = [
+        RejectedFace(det_id=face["det_id"], detection=Detection(**detections[face["det_id"]]),
+                     quality=face["quality"], reason=face["reason"])
+        for face in result.get("rejected", [])
+    ]
+    return FacesResponse(faces_detected=len(detections), faces=response_faces, rejected=rejected)
+
+@router.post("/identify_batch", response_model=BatchIdentifyResponse)
+async def identify_batch(
+    db: DbSession,
+    qdrant: QdrantDep,
+    files: List[UploadFile] = File(..., description="Images to identify, the largest face of each"),
+    threshold: float = Form(SIMILARITY_THRESHOLD, ge=0.0, le=1.0, description="Min similarity (0.0–1.0)"),
+    top_k: int = Form(1, ge=1, le=20, description="Candidates per image, best first"),
+    tier: Tier = Form("accurate", description=TIER_DESCRIPTION),
+    hnsw_ef: Optional[int] = Form(None, ge=1, description=HNSW_EF_DESCRIPTION),
+    exact: bool = Form(False, description=EXACT_DESCRIPTION),
+    min_quality: Optional[float] = Form(None, ge=0.0, le=1.0, description=MIN_QUALITY_DESCRIPTION),
+):
+    """
+    Identifies many images at once: they are detected and embedded concurrently (the model services
+    batch them), all embeddings are searched in one Qdrant batch request and their persons resolved in
+    one lookup. Images that cannot be identified get an error, the others up to top_k candidates.
+    Only an unavailable model service fails the whole batch (503): every other image would fail the same way.
+    """
+    if len(files) > settings.identify_batch_max_images:
+        raise HTTPException(400, detail=f"At most {settings.identify_batch_max_images} images per request")
+
+    results = [ImageIdentification(index=i, filename=file.filename) for i, file in enumerate(files)]
+    min_quality = _min_quality(min_quality)
+
+    async def embed(result: ImageIdentification, file: UploadFile):
+        image_bytes = await file.read()
+        if not image_bytes:
+            result.error = "Empty file"
+            return None
+        try:
+            detections, embedding_result = await detect_and_embed(image_bytes, tier=tier, min_quality=min_quality)
+        except ServiceUnavailableError:
+            raise
+        except Exception as e:  # e.g. a 4xx of a model service for an undecodable image
+            logger.warning("Identification of image %d (%r) failed: %r", result.index, result.filename, e)
+            result.error = str(e)
+            return None
+        result.faces_detected = len(detections)
+        if not detections:
+            result.error = "No faces found"
+            return None
+        if "error" in embedding_result:
+            result.error = _embedding_error(embedding_result)
+            return None
+        result.best_det_id = embedding_result["best_det_id"]
+        return embedding_result["embedding"]
+
+    embeddings = await asyncio.gather(*(embed(result, file) for result, file in zip(results, files)))
+    embedded = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+    candidates = search_candidates(
+        qdrant, [embeddings[i] for i in embedded], threshold=threshold, limit=top_k, hnsw_ef=hnsw_ef, exact=exact
+    )
+    persons = await resolve_persons(db, [(qdrant_id, payload) for hits in candidates for qdrant_id, _, payload in hits])
+
+    for i, hits in zip(embedded, candidates):
+        results[i].candidates = [
+            Candidate(id=person.id, name=person.name, similarity=round(similarity, 4))
+            for qdrant_id, similarity, _ in hits
+            if (person := persons.get(str(qdrant_id))) is not None
+        ]
+    return BatchIdentifyResponse(results=results)
+
 @router.delete("/delete_person", status_code=204)
 async def delete_person(
     db: DbSession,
     qdrant: QdrantDep,
     id: int = Form(..., description="Person id")
 ):
-    person = get_person_by_id(db, id)
+    person = await get_person_by_id(db, id)
     if person is None:
         raise HTTPException(status_code=404, detail="Person not found")
     try:
         delete_from_qdrant(qdrant, str(person.qdrant_id))
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to delete person")
-    success = delete_person_by_id(db, id)
+    success = await delete_person_by_id(db, id)
     if not success:
         raise HTTPException(status_code=500, detail="Failed to delete person")
-    return
\ No newline at end of file
+    return
+
+@router.get("/service_stats")
+async def service_stats():
+    """Calls, retries, failures and circuit breaker state of the model service clients, use of the frame ring."""
+    return {"detection": detection_client.stats(), "embedding": embedding_client.stats(), "frames": frame_ring.stats()}
+
+@router.get("/cache_stats")
+async def cache_stats():
+    """Hit rate, evictions and size of the detection / embedding result cache, the person cache and the local index."""
+    return {**result_cache.stats(), "persons": person_cache.stats(), "local_index": local_index.stats()}
@@ -12,4 +12,38 @@ class PersonResponse(BaseModel):
     similarity: Optional[float] = None
     faces_detected: int
     best_det_id: int
-    detections: List[Detection]
\ No newline at end of file
+    detections: List[Detection]
+
+class FaceMatch(BaseModel):
+    det_id: int
+    detection: Detection
+    id: Optional[int] = None
+    name: Optional[str] = None
+    similarity: Optional[float] = None
+
+class RejectedFace(BaseModel):
+    det_id: int
+    detection: Detection
+    quality: float
+    reason: str
+
+class FacesResponse(BaseModel):
+    faces_detected: int
+    faces: List[FaceMatch]
+    rejected: List[RejectedFace] = []
+
+class Candidate(BaseModel):
+    id: int
+    name: str
+    similarity: float
+
+class ImageIdentification(BaseModel):
+    index: int
+    filename: Optional[str] = None
+    faces_detected: int = 0
+    best_det_id: Optional[int] = None
+    candidates: List[Candidate] = []
+    error: Optional[str] = None
+
+class BatchIdentifyResponse(BaseModel):
+    results: List[ImageIdentification]
\ No newline at end of file
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+import numpy as np
+from qdrant_client import QdrantClient
+
+from app.config import settings
+from app.database import SessionLocal
+from app.repositories.person_repo import create_persons, delete_persons_by_ids, get_existing_names, \
+    search_similar_faces, upsert_embeddings
+from app.services.face_services import detect_and_embed
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ("enrolled", "exists", "duplicate", "no_face", "low_quality", "error")
+
+ImageReader = Callable[[], Awaitable[bytes]]
+
+
+def _status(index: int, name: str, status: str, **fields: Any) -> Dict[str, Any]:
+    return {"index": index, "name": name, "status": status, **fields}
+
+
+async def enroll_bulk(
+    qdrant: QdrantClient,
+    items: List[Tuple[str, ImageReader]],
+    threshold: float,
+    tier: str = "accurate",
+    min_quality: float = 0.0,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Enrolls many (name, image reader) pairs, yielding the status of every item as soon as it is known.
+
+    Detection and embedding of up to bulk_enroll_concurrency items run concurrently, so the batch
+    services see full batches; the next item is started (and its image read) when one of them finishes,
+    so only that many images are held at a time. Embedded items are collected into batches of bulk_enroll_batch that
+    share one Qdrant search for the duplicate check (against enrolled persons and the rest of the batch),
+    one Postgres transaction for the rows and one Qdrant upsert, a partial batch is written once its
+    oldest item waited bulk_enroll_flush_s. Earlier batches are already in Qdrant
+    when a later one is checked, so the upload is deduplicated as a whole. Items whose face is below
+    min_quality are reported as low_quality and not enrolled.
+    """
+    names = [name for name, _ in items]
+    async with SessionLocal() as db:
+        existing = await get_existing_names(db, names)
+
+    todo = []
+    for index, (name, _) in enumerate(items):
+        if not name:
+            yield _status(index, name, "error", detail="Empty name")
+        elif name in existing:
+            yield _status(index, name, "exists", detail=f"Person '{name}' already exists")
+        else:
+            existing.add(name)  # the same name further down the upload
+            todo.append(index)
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def embed(index: int):
+        """Puts exactly one status or (index, embedding, best_det_id) on the queue."""
+        name, read = items[index]
+        try:
+            image_bytes = await read()
+            if not image_bytes:
+                await queue.put(_status(index, name, "error", detail="Empty file"))
+                return
+            detections, result = await detect_and_embed(image_bytes, tier=tier, min_quality=min_quality)
+            if not detections:
+                await queue.put(_status(index, name, "no_face", detail="No faces found"))
+                return
+            if result.get("error") == "low_quality":
+                worst = max(result["rejected"], key=lambda face: face["quality"])
+                await queue.put(_status(index, name, "low_quality", detail="Face quality too low",
+                                        reason=worst["reason"], quality=worst["quality"]))
+            elif "error" in result:
+                await queue.put(_status(index, name, "no_face", detail="No alignable face found"))
+            else:
+                await queue.put((index, result["embedding"], result["best_det_id"]))
+        except Exception as e:
+            logger.warning("Bulk enrollment of %r failed: %r", name, e)
+            await queue.put(_status(index, name, "error", detail=str(e)))
+
+    tasks = set()
+    started = received = 0
+
+    def schedule():
+        nonlocal started
+        while started < len(todo) and started - received < settings.bulk_enroll_concurrency:
+            task = asyncio.create_task(embed(todo[started]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            started += 1
+
+    try:
+        schedule()
+        batch, batch_started = [], 0.0
+        while received < len(todo) or batch:
+            item = None
+            if received < len(todo):
+                timeout = batch_started + settings.bulk_enroll_flush_s - time.monotonic() if batch else None
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    pass  # the partial batch is due
+                else:
+                    received += 1
+                    schedule()
+            if isinstance(item, dict):
+                yield item
+            elif item is not None:
+                if not batch:
+                    batch_started = time.monotonic()
+                batch.append(item)
+            if batch and (
+                len(batch) >= settings.bulk_enroll_batch
+                or received == len(todo)
+                or time.monotonic() - batch_started >= settings.bulk_enroll_flush_s
+            ):
+                async for status in _write_batch(qdrant, items, batch, threshold):
+                    yield status
+                batch = []
+    finally:
+        for task in list(tasks):
+            task.cancel()
+
+
+async def _write_batch(
+    qdrant: QdrantClient,
+    items: List[Tuple[str, ImageReader]],
+    batch: List[Tuple[int, Any, int]],
+    threshold: float,
+) -> AsyncIterator[Dict[str, Any]]:
+    embeddings = np.asarray([embedding for _, embedding, _ in batch], dtype=np.float32)
+    unit = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    matches = search_similar_faces(qdrant, list(embeddings), threshold=threshold)
+
+    accepted = []
+    for k, ((index, _, _), (qdrant_id, similarity, payload)) in enumerate(zip(batch, matches)):
+        name = items[index][0]
+        if qdrant_id is not None:
+            yield _status(index, name, "duplicate", detail="Similar person already exists",
+                          similar_to=payload.get("name"), similarity=round(similarity, 4))
+            continue
+        if accepted:
+            similarities = unit[accepted] @ unit[k]
+            best = int(similarities.argmax())
+            if similarities[best] >= threshold:
+                yield _status(index, name, "duplicate", detail="Similar person earlier in the upload",
+                              similar_to=items[batch[accepted[best]][0]][0], similarity=round(float(similarities[best]), 4))
+                continue
+        accepted.append(k)
+    if not accepted:
+        return
+
+    names = [items[batch[k][0]][0] for k in accepted]
+    try:
+        async with SessionLocal() as db:
+            persons = await create_persons(db, names)
+            try:
+                upsert_embeddings(qdrant, persons, [embeddings[k] for k in accepted])
+            except Exception:
+                await delete_persons_by_ids(db, [person.id for person in persons])
+                raise
+    except Exception as e:
+        logger.warning("Bulk enrollment batch of %d persons failed: %r", len(accepted), e)
+        for k in accepted:
+            yield _status(batch[k][0], items[batch[k][0]][0], "error", detail="Failed to store person")
+        return
+
+    for k, person in zip(accepted, persons):
+        index, _, best_det_id = batch[k]
+        yield _status(index, person.name, "enrolled", id=person.id, best_det_id=best_det_id)
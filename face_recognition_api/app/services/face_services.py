@@ -1,26 +1,267 @@
-import requests
+import base64
+import httpx
 import json
 import logging
+import numpy as np
 from typing import List, Dict, Any
 from app.config import settings
+from app.services.frame_ring import frame_ring
+from app.services.result_cache import content_key, result_cache
+from app.services.service_client import ServiceClient, detection_client, embedding_client
 
 
-def detect_faces(image_bytes: bytes) -> List[Dict[str, Any]]:
-    response = requests.post(
-        f"{settings.detection_url}/detect",
-        files={"image": image_bytes}
+async def _post_frame(client: ServiceClient, path: str, image_bytes: bytes, payload: Dict[str, Any]) -> httpx.Response | None:
+    """
+    With the shm image transport: the image copied into the shared frame ring and only its handle posted
+    (JSON) to the frame endpoint of the service. None when the image has to be uploaded instead: the
+    transport is off, the ring has no room, or the service cannot read the ring (which turns it off).
+    """
+    with frame_ring.hold(image_bytes) as frame:
+        if frame is None:
+            return None
+        try:
+            return await client.post(path, json={"frame": frame, **payload})
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                raise
+            reason = f"{client.name} {path}: {e.response.text[:200]}"
+    frame_ring.disable(reason)
+    return None
+
+
+async def detect_faces(image_bytes: bytes, tier: str = "accurate") -> List[Dict[str, Any]]:
+    return await result_cache.get_or_compute(
+        "detections", content_key(image_bytes), (tier,), lambda: _detect_faces(image_bytes, tier)
     )
-    response.raise_for_status()
+
+async def _detect_faces(image_bytes: bytes, tier: str) -> List[Dict[str, Any]]:
+    response = await _post_frame(detection_client, "/detect_frame", image_bytes, {"tier": tier})
+    if response is None:
+        response = await detection_client.post(
+            "/detect_encoded",
+            files={"image": image_bytes},
+            data={"tier": tier}
+        )
     return response.json()
 
 logger = logging.getLogger(__name__)
-def get_embedding(image_bytes: bytes, detections: List[Dict[str, Any]]) -> List[float]:
-    response = requests.post(
-        f"{settings.embedding_url}/embed",
+async def get_embedding(
+    image_bytes: bytes,
+    detections: List[Dict[str, Any]],
+    tier: str = "accurate",
+    min_quality: float = 0.0,
+) -> Dict[str, Any]:
+    params = (tier, settings.embedding_format, min_quality, json.dumps(detections))
+    return await result_cache.get_or_compute(
+        "embedding", content_key(image_bytes), params, lambda: _get_embedding(image_bytes, detections, tier, min_quality)
+    )
+
+async def _get_embedding(image_bytes: bytes, detections: List[Dict[str, Any]], tier: str, min_quality: float) -> Dict[str, Any]:
+    if settings.embedding_format != "json":
+        det_ids, embeddings, rejected = await get_embeddings_binary(
+            image_bytes, detections, mode="largest", tier=tier, min_quality=min_quality
+        )
+        return _binary_result(det_ids, embeddings, rejected, mode="largest")
+    response = await _post_frame(embedding_client, "/embed_frame", image_bytes, {
+        "detections": detections, "tier": tier, "min_quality": min_quality,
+    })
+    if response is None:
+        response = await embedding_client.post(
+            "/embed",
+            files={"image": image_bytes},
+            data = {
+                "detections": json.dumps(detections),
+                "tier": tier,
+                "min_quality": str(min_quality),
+            }
+        )
+    return response.json()
+
+async def get_face_embeddings(
+    image_bytes: bytes,
+    detections: List[Dict[str, Any]],
+    max_faces: int | None = None,
+    rank_by: str = "size",
+    tier: str = "accurate",
+    min_quality: float = 0.0,
+) -> Dict[str, Any]:
+    params = (tier, max_faces, rank_by, settings.embedding_format, min_quality, json.dumps(detections))
+    return await result_cache.get_or_compute(
+        "faces", content_key(image_bytes), params,
+        lambda: _get_face_embeddings(image_bytes, detections, max_faces, rank_by, tier, min_quality),
+    )
+
+async def _get_face_embeddings(
+    image_bytes: bytes,
+    detections: List[Dict[str, Any]],
+    max_faces: int | None,
+    rank_by: str,
+    tier: str,
+    min_quality: float,
+) -> Dict[str, Any]:
+    if settings.embedding_format != "json":
+        det_ids, embeddings, rejected = await get_embeddings_binary(
+            image_bytes, detections, mode="all", max_faces=max_faces, rank_by=rank_by, tier=tier, min_quality=min_quality
+        )
+        return _binary_result(det_ids, embeddings, rejected, mode="all")
+    response = await _post_frame(embedding_client, "/embed_frame", image_bytes, {
+        "detections": detections, "mode": "all", "max_faces": max_faces, "rank_by": rank_by, "tier": tier,
+        "min_quality": min_quality,
+    })
+    if response is not None:
+        return response.json()
+    data = {
+        "detections": json.dumps(detections),
+        "rank_by": rank_by,
+        "tier": tier,
+        "min_quality": str(min_quality),
+    }
+    if max_faces is not None:
+        data["max_faces"] = str(max_faces)
+    response = await embedding_client.post(
+        "/embed_faces",
+        files={"image": image_bytes},
+        data=data
+    )
+    return response.json()
+
+async def get_embeddings_binary(
+    image_bytes: bytes,
+    detections: List[Dict[str, Any]],
+    mode: str = "largest",
+    max_faces: int | None = None,
+    rank_by: str = "size",
+    tier: str = "accurate",
+    min_quality: float = 0.0,
+) -> tuple[List[int], np.ndarray, List[Dict[str, Any]] | None]:
+    """
+    Embeddings over the binary transport: detection ids and an (F, dim) float32 matrix
+    viewed straight from the response body, no per-float Python objects. With a min_quality
+    also the faces the quality gate rejected, None without.
+    """
+    response = await _post_frame(embedding_client, "/embed_frame", image_bytes, {
+        "detections": detections, "mode": mode, "max_faces": max_faces, "rank_by": rank_by,
+        "embedding_format": settings.embedding_format, "tier": tier, "min_quality": min_quality,
+    })
+    if response is not None:
+        result = response.json()
+        det_ids = result["det_ids"]
+        return det_ids, _embedding_rows(base64.b64decode(result["embeddings"]), len(det_ids)), result.get("rejected")
+    data = {
+        "detections": json.dumps(detections),
+        "mode": mode,
+        "rank_by": rank_by,
+        "dtype": settings.embedding_format,
+        "tier": tier,
+        "min_quality": str(min_quality),
+    }
+    if max_faces is not None:
+        data["max_faces"] = str(max_faces)
+    response = await embedding_client.post(
+        "/embed_binary",
         files={"image": image_bytes},
-        data = {
-            "detections": json.dumps(detections)
-        }
+        data=data
     )
-    response.raise_for_status()
-    return response.json()
\ No newline at end of file
+    det_ids_header = response.headers.get("X-Det-Ids", "")
+    det_ids = [int(i) for i in det_ids_header.split(",")] if det_ids_header else []
+    rejected = json.loads(response.headers["X-Rejected"]) if "X-Rejected" in response.headers else None
+    return det_ids, _embedding_rows(response.content, len(det_ids), response.headers.get("X-Embedding-Dtype")), rejected
+
+def _embedding_rows(data: bytes, count: int, dtype: str | None = None) -> np.ndarray:
+    """(count, dim) float32 view of binary embedding rows in dtype (default: the configured embedding_format)."""
+    dtype = np.dtype("<f2") if (dtype or settings.embedding_format) == "float16" else np.dtype("<f4")
+    embeddings = np.frombuffer(data, dtype=dtype).reshape(count, settings.embedding_dim)
+    return embeddings.astype(np.float32, copy=False)
+
+def _binary_result(
+    det_ids: List[int],
+    embeddings: np.ndarray,
+    rejected: List[Dict[str, Any]] | None,
+    mode: str,
+) -> Dict[str, Any]:
+    """Binary embedding rows in the shape of the JSON results of get_embedding / get_face_embeddings."""
+    if mode == "all":
+        result = {"faces": [{"det_id": det_id, "embedding": emb} for det_id, emb in zip(det_ids, embeddings)]}
+    elif det_ids:
+        result = {"embedding": embeddings[0], "best_det_id": det_ids[0]}
+    else:
+        result = {"error": "low_quality" if rejected else "no_face"}
+    if rejected is not None:
+        result["rejected"] = rejected
+    return result
+
+async def detect_and_embed(
+    image_bytes: bytes,
+    tier: str = "accurate",
+    mode: str = "largest",
+    max_faces: int | None = None,
+    rank_by: str = "size",
+    min_quality: float = 0.0,
+) -> tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Detections and embeddings of one upload: the result of get_embedding (mode "largest") or
+    get_face_embeddings (mode "all"). With the "aligned" recognition transport the image is uploaded
+    and decoded once, by the detection service, which sends back the aligned 112x112 crops that are
+    then embedded; "split" uploads the image to both services.
+
+    With a min_quality the embedding service scores every face first and does not embed the ones below
+    it, they are listed in result["rejected"] with their quality and reason; a rejected largest face
+    gives {"error": "low_quality", "rejected": [...]}.
+    """
+    if settings.recognition_transport == "split":
+        detections = await detect_faces(image_bytes, tier=tier)
+        if not detections:
+            return detections, {"error": "no_face"} if mode == "largest" else {"faces": []}
+        if mode == "largest":
+            return detections, await get_embedding(image_bytes, detections, tier=tier, min_quality=min_quality)
+        return detections, await get_face_embeddings(
+            image_bytes, detections, max_faces=max_faces, rank_by=rank_by, tier=tier, min_quality=min_quality
+        )
+
+    params = (tier, mode, max_faces, rank_by, settings.embedding_format, min_quality)
+    return await result_cache.get_or_compute(
+        "recognition", content_key(image_bytes), params,
+        lambda: _detect_and_embed(image_bytes, tier, mode, max_faces, rank_by, min_quality),
+    )
+
+async def _detect_and_embed(
+    image_bytes: bytes,
+    tier: str,
+    mode: str,
+    max_faces: int | None,
+    rank_by: str,
+    min_quality: float,
+) -> tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    response = await _post_frame(detection_client, "/detect_align_frame", image_bytes, {
+        "tier": tier, "mode": mode, "max_faces": max_faces, "rank_by": rank_by,
+    })
+    if response is None:
+        data = {"tier": tier, "mode": mode, "rank_by": rank_by}
+        if max_faces is not None:
+            data["max_faces"] = str(max_faces)
+        response = await detection_client.post("/detect_align", files={"image": image_bytes}, data=data)
+    aligned = response.json()
+    detections = aligned["detections"]
+
+    if aligned["det_ids"]:
+        response = await embedding_client.post("/embed_aligned", json={
+            "crops": aligned["crops"],
+            "det_ids": aligned["det_ids"],
+            "mode": mode,
+            "embedding_format": settings.embedding_format,
+            "tier": tier,
+            "min_quality": min_quality,
+            # size, confidence and pose of the crops for the quality gate
+            "detections": detections if min_quality else [],
+        })
+        result = response.json()
+    else:
+        result = {"det_ids": [], "embeddings": ""} if settings.embedding_format != "json" else {"error": "no_face"}
+
+    if settings.embedding_format != "json":
+        det_ids = result["det_ids"]
+        embeddings = _embedding_rows(base64.b64decode(result["embeddings"]), len(det_ids))
+        result = _binary_result(det_ids, embeddings, result.get("rejected"), mode)
+    elif mode == "all" and "error" in result:
+        result = {"faces": [], **({"rejected": result["rejected"]} if "rejected" in result else {})}
+    return detections, result
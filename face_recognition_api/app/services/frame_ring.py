@@ -0,0 +1,159 @@
+import fcntl
+import glob
+import logging
+import mmap
+import os
+import struct
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# ring file layout, shared with the reader of the model services (ml_common/frame_ring.py)
+RING_SUFFIX = ".ring"
+MAGIC = b"FACERING"
+VERSION = 1
+RING_HEADER = struct.Struct("<8sI4x16sQ")
+RECORD_HEADER = struct.Struct("<QQ")
+HEADER_SIZE = 64
+ALIGNMENT = 64
+
+
+class _Record:
+    __slots__ = ("offset", "end", "seq", "released")
+
+    def __init__(self, offset: int, end: int, seq: int):
+        self.offset = offset
+        self.end = end
+        self.seq = seq
+        self.released = False
+
+
+class FrameRing:
+    """
+    Write side of the shared-memory image transport: a ring file of capacity bytes in directory (a tmpfs
+    the model services mount too), uploads copied into it and only a handle sent to the services.
+
+    Records are allocated in order and freed from the oldest once released, so a frame is never
+    overwritten while its request is in flight; a slow request holds back the space behind it and when
+    the ring is full hold() yields None and the image is uploaded instead. The file lives as long as
+    the process: it is locked while open and removed on close, and open() removes the rings of
+    processes that died without closing (their lock is gone). Used from the event loop only.
+    """
+
+    def __init__(self, directory: str, capacity: int):
+        self.directory = directory
+        self.capacity = capacity
+        self.path = ""
+        self.file = None
+        self.map = None
+        self.token = b""
+        self.records: deque[_Record] = deque()
+        self.seq = 0
+        self.counters = dict.fromkeys(("frames", "bytes", "full", "too_large"), 0)
+
+    @property
+    def active(self) -> bool:
+        return self.map is not None
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._remove_stale()
+        self.token = uuid.uuid4().bytes
+        self.path = os.path.join(self.directory, f"face-api-{self.token.hex()[:12]}{RING_SUFFIX}")
+        self.file = open(self.path, "w+b")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        self.file.truncate(self.capacity)
+        self.map = mmap.mmap(self.file.fileno(), self.capacity)
+        RING_HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.token, self.capacity)
+        logger.info("Frame ring of %d MB at %s", self.capacity // 2**20, self.path)
+
+    def _remove_stale(self):
+        for path in glob.glob(os.path.join(self.directory, f"*{RING_SUFFIX}")):
+            try:
+                with open(path, "rb") as file:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.remove(path)
+                logger.info("Removed frame ring %s of a stopped process", path)
+            except (BlockingIOError, FileNotFoundError):  # in use by another worker, or just removed
+                continue
+
+    def close(self):
+        if self.map is None:
+            return
+        self.map.close()
+        self.map = None
+        os.remove(self.path)
+        self.file.close()  # releases the lock
+        self.records.clear()
+
+    def disable(self, reason: str):
+        """Stops using the ring (the services cannot read it), images are uploaded from now on."""
+        if self.map is not None:
+            logger.error("Shared-memory image transport disabled, uploading images: %s", reason)
+            self.close()
+
+    def _allocate(self, size: int) -> int | None:
+        if not self.records:
+            return HEADER_SIZE if HEADER_SIZE + size <= self.capacity else None
+        oldest, newest = self.records[0].offset, self.records[-1].end
+        if self.records[-1].offset >= oldest:  # not wrapped: free space after the newest and before the oldest
+            if newest + size <= self.capacity:
+                return newest
+            return HEADER_SIZE if HEADER_SIZE + size <= oldest else None
+        return newest if newest + size <= oldest else None
+
+    @contextmanager
+    def hold(self, data: bytes) -> Iterator[Dict[str, Any] | None]:
+        """
+        The handle of data copied into the ring, valid until the block exits; None when the ring is not
+        active or has no room for it.
+        """
+        if self.map is None:
+            yield None
+            return
+        size = -(-(RECORD_HEADER.size + len(data)) // ALIGNMENT) * ALIGNMENT
+        offset = self._allocate(size)
+        if offset is None:
+            self.counters["too_large" if HEADER_SIZE + size > self.capacity else "full"] += 1
+            yield None
+            return
+
+        self.seq += 1
+        record = _Record(offset, offset + size, self.seq)
+        start = offset + RECORD_HEADER.size
+        self.map[start:start + len(data)] = data
+        RECORD_HEADER.pack_into(self.map, offset, record.seq, len(data))  # the header last, readers check it
+        self.records.append(record)
+        self.counters["frames"] += 1
+        self.counters["bytes"] += len(data)
+        try:
+            yield {
+                "ring": os.path.basename(self.path),
+                "token": self.token.hex(),
+                "offset": offset,
+                "length": len(data),
+                "seq": record.seq,
+            }
+        finally:
+            self._release(record)
+
+    def _release(self, record: _Record):
+        record.released = True
+        if self.map is None:  # closed while the request was in flight
+            return
+        RECORD_HEADER.pack_into(self.map, record.offset, 0, 0)
+        while self.records and self.records[0].released:
+            self.records.popleft()
+
+    def stats(self) -> dict:
+        in_use = sum(record.end - record.offset for record in self.records)
+        return {**self.counters, "active": self.active, "capacity": self.capacity, "in_use": in_use,
+                "in_flight": sum(not record.released for record in self.records)}
+
+
+frame_ring = FrameRing(settings.frame_ring_dir, settings.frame_ring_mb * 2**20)
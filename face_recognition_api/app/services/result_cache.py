@@ -0,0 +1,289 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+import numpy as np
+
+from app.config import settings
+from app.services.service_client import ServiceClient, detection_client, embedding_client
+
+logger = logging.getLogger(__name__)
+
+
+VALUE_FORMAT = "json+arrays/1"  # part of every key, entries of an older encoding are never read
+HEADER = struct.Struct("<I")
+
+
+def content_key(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def encode_value(value: Any) -> bytes:
+    """
+    A result as JSON followed by the raw bytes of its numpy arrays (binary embeddings), which the JSON
+    refers to by offset. Unlike pickle, decoding a value from the shared file cannot run any code.
+    """
+    arrays, offset = [], 0
+
+    def plain(obj):
+        nonlocal offset
+        if isinstance(obj, np.ndarray):
+            data = np.ascontiguousarray(obj).tobytes()
+            arrays.append(data)
+            ref = {"__array__": [offset, obj.dtype.str, list(obj.shape)]}
+            offset += len(data)
+            return ref
+        if isinstance(obj, dict):
+            return {key: plain(item) for key, item in obj.items()}
+        if isinstance(obj, tuple):
+            return {"__tuple__": [plain(item) for item in obj]}
+        if isinstance(obj, list):
+            return [plain(item) for item in obj]
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return obj
+
+    document = json.dumps(plain(value), separators=(",", ":")).encode()
+    return HEADER.pack(len(document)) + document + b"".join(arrays)
+
+
+def decode_value(data: bytes) -> Any:
+    (length,) = HEADER.unpack_from(data)
+    blob = memoryview(data)[HEADER.size + length:]
+
+    def array(offset, dtype, shape):
+        dtype = np.dtype(dtype)
+        return np.frombuffer(blob, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+    def hook(obj):
+        if "__array__" in obj:
+            return array(*obj["__array__"])
+        if "__tuple__" in obj:
+            return tuple(obj["__tuple__"])
+        return obj
+
+    return json.loads(data[HEADER.size:HEADER.size + length], object_hook=hook)
+
+
+class ModelVersions:
+    """
+    Combined model version of the detection and embedding services, polled from their
+    model_info endpoints at most every refresh_s seconds, so cache hits never call them.
+    None while a service is unreachable, results are then not cached.
+    """
+
+    def __init__(self, clients: list[ServiceClient], refresh_s: float):
+        self.clients = clients
+        self.refresh_s = refresh_s
+        self.version: str | None = None
+        self.checked_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def get(self) -> str | None:
+        async with self.lock:
+            if time.monotonic() - self.checked_at < self.refresh_s:
+                return self.version
+            self.checked_at = time.monotonic()
+            try:
+                versions = []
+                for client in self.clients:
+                    response = await client.post("/model_info", json={}, timeout_s=5)
+                    versions.append(response.json()["model_version"])
+                self.version = ":".join(versions)
+            except Exception as e:
+                logger.warning("Model version check failed, result cache bypassed: %s", e)
+                self.version = None
+            return self.version
+
+
+class SharedStore:
+    """
+    SQLite file shared by the API workers of one host (e.g. on a common volume).
+    Values are encode_value bytes: data only, reading them never executes anything from the file.
+    Its methods block (disk I/O, up to the 5 s busy timeout), ResultCache calls them in a thread.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, version TEXT, value BLOB, size INTEGER, expires REAL, accessed REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    def get(self, key: str) -> bytes | None:
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT value, expires FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            self.db.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, version: str, value: bytes, ttl_s: float) -> int:
+        """Store a value, returns the number of entries evicted to stay within max_bytes."""
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, version, value, len(value), now + ttl_s, now),
+            )
+            evicted = self.db.execute("DELETE FROM results WHERE expires < ?", (now,)).rowcount
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            while total > self.max_bytes:
+                oldest = self.db.execute("SELECT key, size FROM results ORDER BY accessed LIMIT 64").fetchall()
+                if not oldest:
+                    break
+                self.db.executemany("DELETE FROM results WHERE key = ?", [(k,) for k, _ in oldest])
+                total -= sum(size for _, size in oldest)
+                evicted += len(oldest)
+            return evicted
+
+    def drop_other_versions(self, version: str) -> int:
+        with self.lock:
+            return self.db.execute("DELETE FROM results WHERE version != ?", (version,)).rowcount
+
+
+class ResultCache:
+    """
+    Content-addressed cache of model service results: the key is the sha256 of the uploaded bytes,
+    the kind of result, its parameters (tier, ...) and the model version, so a repeated upload skips
+    detection and embedding entirely and replacing a model invalidates everything computed with it.
+
+    Entries live in a memory-bounded LRU with a TTL, optionally backed by a SharedStore
+    so several API workers share their results.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl_s: float,
+        versions: ModelVersions,
+        shared: SharedStore | None = None,
+        enabled: bool = True,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.versions = versions
+        self.shared = shared
+        self.enabled = enabled
+        self.entries: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self.size = 0
+        self.version: str | None = None
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ("hits", "shared_hits", "misses", "bypassed", "evictions", "expirations", "invalidations"), 0
+        )
+
+    async def get_or_compute(self, kind: str, digest: str, params: tuple, compute: Callable[[], Awaitable[Any]]) -> Any:
+        version = await self.versions.get() if self.enabled else None
+        if version is None:
+            self._count("bypassed")
+            return await compute()
+        if version != self.version:
+            await self._invalidate(version)
+
+        key = hashlib.sha256(repr((kind, digest, params, version, VALUE_FORMAT)).encode()).hexdigest()
+        value = await self._get(key)
+        if value is not None:
+            return decode_value(value)
+
+        self._count("misses")
+        result = await compute()
+        await self._put(key, version, encode_value(result))
+        return result
+
+    def _count(self, counter: str, n: int = 1):
+        with self.lock:
+            self.counters[counter] += n
+
+    async def _get(self, key: str) -> bytes | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires >= time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return value
+                self._remove(key)
+                self.counters["expirations"] += 1
+        if self.shared is not None:
+            value = await asyncio.to_thread(self.shared.get, key)
+            if value is not None:
+                self._count("shared_hits")
+                self._remember(key, value)
+                return value
+        return None
+
+    async def _put(self, key: str, version: str, value: bytes):
+        self._remember(key, value)
+        if self.shared is not None:
+            self._count("evictions", await asyncio.to_thread(self.shared.put, key, version, value, self.ttl_s))
+
+    def _remember(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, time.monotonic() + self.ttl_s)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+
+    def _remove(self, key: str):
+        value, _ = self.entries.pop(key)
+        self.size -= len(value)
+
+    async def _invalidate(self, version: str):
+        """A model changed: results of the previous models can never be hit again, free them."""
+        with self.lock:
+            if self.version is not None:
+                logger.info("Model version changed %s -> %s, dropping %d cached results",
+                            self.version, version, len(self.entries))
+                self.counters["invalidations"] += 1
+            self.entries.clear()
+            self.size = 0
+            self.version = version
+        if self.shared is not None:
+            await asyncio.to_thread(self.shared.drop_other_versions, version)
+
+    def stats(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+        hits = counters["hits"] + counters["shared_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            **counters,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "model_version": self.version,
+        }
+
+
+result_cache = ResultCache(
+    max_bytes=settings.result_cache_max_mb * 2**20,
+    ttl_s=settings.result_cache_ttl_s,
+    versions=ModelVersions([detection_client, embedding_client], settings.model_version_refresh_s),
+    shared=SharedStore(settings.result_cache_path, settings.result_cache_max_mb * 2**20) if settings.result_cache_path else None,
+    enabled=settings.result_cache_enabled,
+)
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = (502, 503, 504)
+
+
+class ServiceUnavailableError(Exception):
+    """A model service failed after all retries or its circuit breaker is open."""
+
+    def __init__(self, service: str, reason: str):
+        super().__init__(f"{service} unavailable: {reason}")
+        self.service = service
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after failure_threshold consecutive failed calls; while open calls fail fast.
+    After reset_s one trial call is let through (half-open), its outcome closes or reopens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int, reset_s: float):
+        self.failure_threshold = failure_threshold
+        self.reset_s = reset_s
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_s else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def end_call(self):
+        """A call let through has ended; one without an outcome (cancelled) leaves the trial to the next call."""
+        self.trial_running = False
+
+
+class ServiceClient:
+    """
+    Async client of one model service: a pooled keep-alive httpx.AsyncClient, per-call timeouts,
+    a semaphore bounding the calls in flight, retries with exponential backoff and jitter on
+    connection errors, timeouts and 502/503/504, and a circuit breaker around it all.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        timeout_s: float,
+        connect_timeout_s: float,
+        max_connections: int,
+        max_concurrency: int,
+        retries: int,
+        backoff_s: float,
+        breaker: CircuitBreaker,
+    ):
+        self.name = name
+        self.timeout = httpx.Timeout(timeout_s, connect=connect_timeout_s)
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.breaker = breaker
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.in_flight = 0
+        self.counters = dict.fromkeys(("calls", "retries", "failures", "rejected"), 0)
+
+    async def post(self, path: str, timeout_s: float | None = None, **kwargs: Any) -> httpx.Response:
+        if not self.breaker.allow():
+            self.counters["rejected"] += 1
+            raise ServiceUnavailableError(self.name, "circuit open")
+        timeout = httpx.Timeout(timeout_s, connect=self.timeout.connect) if timeout_s else self.timeout
+
+        self.counters["calls"] += 1
+        try:
+            async with self.semaphore:
+                self.in_flight += 1
+                try:
+                    response = await self._post_with_retries(path, timeout, **kwargs)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code < 500:  # the request was rejected, the service itself is fine
+                        self.breaker.record_success()
+                        raise
+                    self.breaker.record_failure()
+                    self.counters["failures"] += 1
+                    raise ServiceUnavailableError(self.name, repr(e)) from e
+                except httpx.TransportError as e:
+                    self.breaker.record_failure()
+                    self.counters["failures"] += 1
+                    raise ServiceUnavailableError(self.name, repr(e)) from e
+                finally:
+                    self.in_flight -= 1
+            self.breaker.record_success()
+            return response
+        finally:
+            # also on cancellation (BaseException), which is neither a success nor a failure
+            self.breaker.end_call()
+
+    async def _post_with_retries(self, path: str, timeout: httpx.Timeout, **kwargs: Any) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.post(path, timeout=timeout, **kwargs)
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    response.raise_for_status()
+                    return response
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            self.counters["retries"] += 1
+            delay = self.backoff_s * 2 ** attempt * (0.5 + random.random())
+            logger.warning("%s %s failed (attempt %d), retrying in %.2fs", self.name, path, attempt + 1, delay)
+            await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    def stats(self) -> dict:
+        return {**self.counters, "in_flight": self.in_flight, "breaker": self.breaker.state}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def _make_client(name: str, base_url: str) -> ServiceClient:
+    return ServiceClient(
+        name,
+        base_url,
+        timeout_s=settings.service_timeout_s,
+        connect_timeout_s=settings.service_connect_timeout_s,
+        max_connections=settings.service_max_connections,
+        max_concurrency=settings.service_max_concurrency,
+        retries=settings.service_retries,
+        backoff_s=settings.service_backoff_s,
+        breaker=CircuitBreaker(settings.breaker_failure_threshold, settings.breaker_reset_s),
+    )
+
+
+detection_client = _make_client("detection", settings.detection_url)
+embedding_client = _make_client("embedding", settings.embedding_url)
+
+
+async def close_service_clients():
+    await detection_client.aclose()
+    await embedding_client.aclose()
@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+from typing import Any, Dict, List
+
+ALIGNED_SIZE = 112
+
+TEMPLATE_112 = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041]
+], dtype=np.float32)
+
+def largest_face_id(detections: List[Dict[str, Any]]) -> int:
+    areas = [(d['bbox'][2] - d['bbox'][0]) * (d['bbox'][3] - d['bbox'][1]) for d in detections]
+    return int(np.argmax(areas))
+
+def select_faces(detections: List[Dict[str, Any]], max_faces: int | None = None, rank_by: str = "size") -> List[int]:
+    """
+    Ids of the detections to embed: all of them, or the top max_faces by box area ("size")
+    or detector confidence ("conf"). Returned in detection order.
+    """
+    if max_faces is None or max_faces >= len(detections):
+        return list(range(len(detections)))
+    if rank_by == "conf":
+        keys = [d['conf'] for d in detections]
+    else:
+        keys = [(d['bbox'][2] - d['bbox'][0]) * (d['bbox'][3] - d['bbox'][1]) for d in detections]
+    return sorted(np.argsort(keys, kind='stable')[::-1][:max(max_faces, 0)].tolist())
+
+def similarity_transforms(keypoints: np.ndarray, template: np.ndarray = TEMPLATE_112) -> np.ndarray:
+    """
+    Closed-form (Umeyama) least-squares similarity transforms for a batch of landmark sets.
+    keypoints: (N, 5, 2) landmarks, returns (N, 2, 3) matrices mapping them onto template.
+    Rows of degenerate landmark sets (all points equal) are NaN.
+    """
+    src = keypoints.astype(np.float64)
+    dst = template.astype(np.float64)
+    n = dst.shape[0]
+
+    src_mean = src.mean(axis=1)
+    dst_mean = dst.mean(axis=0)
+    src_c = src - src_mean[:, None, :]
+    dst_c = dst - dst_mean
+
+    cov = np.einsum('ki,nkj->nij', dst_c, src_c) / n
+    U, S, Vt = np.linalg.svd(cov)
+    d = np.sign(np.linalg.det(U) * np.linalg.det(Vt))
+    d[d == 0] = 1
+    D = np.stack([np.ones_like(d), d], axis=1)
+    R = U @ (D[:, :, None] * Vt)
+
+    src_var = (src_c ** 2).sum(axis=(1, 2)) / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = (S * D).sum(axis=1) / src_var
+    t = dst_mean - scale[:, None] * np.einsum('nij,nj->ni', R, src_mean)
+    return np.concatenate([scale[:, None, None] * R, t[:, :, None]], axis=2)
+
+def warp_faces(img: np.ndarray, transforms: np.ndarray, size: int = ALIGNED_SIZE) -> np.ndarray:
+    """Aligned (N, size, size, 3) uint8 crops of img, one per (2, 3) transform, same channel order as img."""
+    crops = np.empty((len(transforms), size, size, 3), dtype=np.uint8)
+    for crop, M in zip(crops, transforms):
+        cv2.warpAffine(img, M, (size, size), dst=crop, borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_LINEAR)
+    return crops
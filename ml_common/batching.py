@@ -0,0 +1,189 @@
+import asyncio
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+import numpy as np
+
+BATCHING_MODES = ("fixed", "adaptive")
+
+@dataclass
+class BatchingConfig:
+    """Batching settings of one model service, read from <PREFIX>_* environment variables by from_env."""
+    max_batch_size: int = 16
+    max_latency_ms: int = 300
+    mode: str = "fixed"
+    target_p99_ms: float = 300.0
+    max_inflight: int = 2
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "BatchingConfig":
+        config = cls(
+            max_batch_size=int(os.environ.get(f"{prefix}_MAX_BATCH_SIZE", cls.max_batch_size)),
+            max_latency_ms=int(os.environ.get(f"{prefix}_MAX_LATENCY_MS", cls.max_latency_ms)),
+            mode=os.environ.get(f"{prefix}_BATCHING_MODE", cls.mode).lower(),
+            target_p99_ms=float(os.environ.get(f"{prefix}_TARGET_P99_MS", cls.target_p99_ms)),
+            max_inflight=int(os.environ.get(f"{prefix}_MAX_INFLIGHT_BATCHES", cls.max_inflight)),
+        )
+        if config.mode not in BATCHING_MODES:
+            raise ValueError(f"{prefix}_BATCHING_MODE must be one of {list(BATCHING_MODES)}")
+        return config
+
+    def batch_api_options(self) -> dict:
+        """
+        @bentoml.api arguments of a batch endpoint fed by the AdaptiveBatcher in adaptive mode: it already
+        forms the batches, a second adaptive window in BentoML would only add its wait on top.
+        """
+        if self.mode == "adaptive":
+            return {}
+        return {"batchable": True, "max_batch_size": self.max_batch_size, "max_latency_ms": self.max_latency_ms}
+
+def next_batch_step(size: int, max_batch_size: int) -> int:
+    """Next batch size worth waiting for: sizes grow in powers of two, like the warmed-up shapes."""
+    step = 1
+    while step <= size:
+        step *= 2
+    return min(step, max_batch_size)
+
+class AdaptiveBatcher:
+    """
+    Groups single requests into batches with a window tuned to meet a target p99 latency.
+
+    The window is derived from the observed arrival rate (EWMA of inter-arrival times) and a
+    linear model of inference time per batch size, t(b) = a + c * b, fitted on the batches run so far:
+    waiting w seconds collects about 1 + rate * w requests, so w + t(1 + rate * w) <= target gives
+    w <= (target - a - c) / (1 + c * rate). The window is also closed as soon as the arrival rate
+    can no longer grow the batch to its next size step (the next power of two) before the window
+    ends: at low load a request would otherwise wait most of the budget for a batch that never forms.
+    A safety factor shrinks the budget when the observed p99 misses the target and slowly grows back
+    while it is met.
+    At most max_inflight batches run at once; under overload requests keep collecting while
+    the backend is busy, so batches grow with load instead of queueing behind each other.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[list], Awaitable[list]],
+        config: BatchingConfig,
+        history: int = 1000,
+    ):
+        self.run_batch = run_batch
+        self.config = config
+        self.target = config.target_p99_ms / 1000
+        self.max_window = config.max_latency_ms / 1000
+        self.pending: list[tuple[Any, asyncio.Future, float]] = []
+        self.flush_handle: asyncio.TimerHandle | None = None
+        self.inter_arrival: float | None = None
+        self.last_arrival: float | None = None
+        self.batch_timings: deque[tuple[int, float]] = deque(maxlen=200)
+        self.latencies: deque[float] = deque(maxlen=history)
+        self.safety = 1.0
+        self.batches = 0
+        self.in_flight = 0
+
+    @property
+    def arrival_rate(self) -> float:
+        return 1 / self.inter_arrival if self.inter_arrival else 0.0
+
+    def inference_model(self) -> tuple[float, float]:
+        """(a, c) of t(b) = a + c * b, least squares over recent batches."""
+        if not self.batch_timings:
+            return 0.0, 0.0
+        sizes, times = np.array(self.batch_timings, dtype=np.float64).T
+        if np.ptp(sizes) == 0:
+            return float(times.mean()), 0.0
+        c, a = np.polyfit(sizes, times, 1)
+        return max(float(a), 0.0), max(float(c), 0.0)
+
+    def window(self) -> float:
+        a, c = self.inference_model()
+        rate = self.arrival_rate
+        budget = self.target * self.safety
+        window = (budget - a - c) / (1 + c * rate)
+        if rate > 0:
+            window = min(window, (self.config.max_batch_size - 1) / rate)
+        return float(min(max(window, 0.0), self.max_window))
+
+    def wait(self, pending: int, age: float) -> float:
+        """
+        How much longer a batch of pending requests, the oldest waiting for age, should stay open:
+        until the end of the window, less the time the next size step needs to fill at the arrival rate.
+        """
+        rate = self.arrival_rate
+        if rate <= 0:
+            return 0.0
+        missing = next_batch_step(pending, self.config.max_batch_size) - pending
+        return self.window() - age - missing / rate
+
+    def p99(self) -> float:
+        return float(np.percentile(self.latencies, 99)) if self.latencies else 0.0
+
+    async def submit(self, item: Any) -> Any:
+        now = time.perf_counter()
+        if self.last_arrival is not None:
+            gap = now - self.last_arrival
+            self.inter_arrival = gap if self.inter_arrival is None else 0.9 * self.inter_arrival + 0.1 * gap
+        self.last_arrival = now
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future, now))
+        self._schedule()
+        return await future
+
+    def _schedule(self):
+        """Dispatch every batch that is full or whose oldest request used up its window."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        while self.pending and self.in_flight < self.config.max_inflight:
+            wait = self.wait(len(self.pending), time.perf_counter() - self.pending[0][2])
+            if len(self.pending) < self.config.max_batch_size and wait > 0:
+                self.flush_handle = asyncio.get_running_loop().call_later(wait, self._schedule)
+                return
+            batch, self.pending = self.pending[:self.config.max_batch_size], self.pending[self.config.max_batch_size:]
+            asyncio.ensure_future(self._run(batch, uncontended=self.in_flight == 0))
+            self.in_flight += 1
+
+    async def _run(self, batch: list[tuple[Any, asyncio.Future, float]], uncontended: bool):
+        tik = time.perf_counter()
+        try:
+            results = await self.run_batch([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.in_flight -= 1
+            self._schedule()
+        done = time.perf_counter()
+        if uncontended:  # batches that shared the backend would skew the inference model
+            self.batch_timings.append((len(batch), done - tik))
+        self.batches += 1
+        for (_, future, arrived), result in zip(batch, results):
+            self.latencies.append(done - arrived)
+            if not future.done():
+                future.set_result(result)
+
+        # AIMD on the latency budget: back off fast on a miss, recover slowly.
+        if len(self.latencies) >= 20:
+            if self.p99() > self.target:
+                self.safety = max(self.safety * 0.8, 0.1)
+            else:
+                self.safety = min(self.safety * 1.02, 1.0)
+
+    def stats(self) -> dict:
+        a, c = self.inference_model()
+        return {
+            "arrival_rate": self.arrival_rate,
+            "window_ms": self.window() * 1000,
+            "inference_ms_intercept": a * 1000,
+            "inference_ms_per_item": c * 1000,
+            "safety": self.safety,
+            "p99_ms": self.p99() * 1000,
+            "batches": self.batches,
+            "in_flight": self.in_flight,
+            "pending": len(self.pending),
+        }
@@ -0,0 +1,39 @@
+import io
+
+import cv2
+import numpy as np
+from PIL import Image as PILImage
+
+# JPEG is decoded straight at 1/2, 1/4 or 1/8 scale in the DCT domain, other formats are resized after decoding.
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+def oriented_size(data: bytes) -> tuple[int, int]:
+    """(height, width) of the encoded image after EXIF orientation, read from the header only."""
+    with PILImage.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        if img.getexif().get(EXIF_ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+    return height, width
+
+def pick_reduction(max_scale: float) -> int:
+    """Largest supported reduction factor that does not shrink the image more than max_scale."""
+    return max(f for f in REDUCED_FLAGS if f <= max(max_scale, 1))
+
+def decode_reduced(data: bytes, reduction: int = 1, size: tuple[int, int] | None = None) -> tuple[np.ndarray | None, float]:
+    """
+    Decode encoded image bytes to BGR at 1/reduction scale.
+    Returns the image and the factor that maps its coordinates back to the original image
+    (1.0 when not reduced), or (None, 1.0) when the bytes are not a readable image.
+    """
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), REDUCED_FLAGS[reduction])
+    if img is None or reduction == 1:
+        return img, 1.0
+    size = size or oriented_size(data)
+    return img, max(size) / max(img.shape[:2])
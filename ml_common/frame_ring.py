@@ -0,0 +1,91 @@
+import mmap
+import os
+import struct
+from collections import OrderedDict
+
+# Shared-memory handoff of encoded images from the API to the model services on the same host.
+# The API (face_recognition_api/app/services/frame_ring.py) writes every image into a ring file in a
+# directory both sides mount (tmpfs, /dev/shm) and sends the services only a handle:
+#     {"ring": file name, "token": ring id (hex), "offset": record offset, "length": image bytes, "seq": record seq}
+# File layout: a RING_HEADER (magic, version, token, capacity) in the first HEADER_SIZE bytes, then
+# records of a RECORD_HEADER (seq, length) followed by the image, each at a multiple of ALIGNMENT.
+# The writer zeroes the seq of a record when it releases it, before its space is reused.
+DEFAULT_RING_DIR = "/dev/shm/face-frames"
+RING_SUFFIX = ".ring"
+MAGIC = b"FACERING"
+VERSION = 1
+RING_HEADER = struct.Struct("<8sI4x16sQ")
+RECORD_HEADER = struct.Struct("<QQ")
+HEADER_SIZE = 64
+ALIGNMENT = 64
+
+
+class FrameUnavailable(Exception):
+    """The handle does not point to a live frame: unknown ring, ring recreated or record released."""
+
+
+class FrameReader:
+    """
+    Read side of the frame rings: the rings of a directory memory-mapped read-only (at most max_rings,
+    least recently used dropped), frames returned as memoryviews of the mapping, without a copy.
+    A view stays readable after the writer released the record, but its bytes may then be overwritten,
+    so the services check the frame with valid() once they decoded it and drop it when it was released.
+    """
+
+    def __init__(self, directory: str = DEFAULT_RING_DIR, max_rings: int = 16):
+        self.directory = directory
+        self.max_rings = max_rings
+        self.rings: OrderedDict[str, tuple] = OrderedDict()  # name -> (file, mmap, token)
+
+    def _ring(self, name: str, token: str):
+        if os.path.basename(name) != name or not name.endswith(RING_SUFFIX):
+            raise FrameUnavailable(f"invalid ring name {name!r}")
+        ring = self.rings.get(name)
+        # a ring whose file was removed (writer restarted) is mapped again from the new file
+        if ring is None or ring[2] != token or os.fstat(ring[0].fileno()).st_nlink == 0:
+            ring = self._open(name)
+        self.rings.move_to_end(name)
+        if ring[2] != token:
+            raise FrameUnavailable(f"ring {name} was recreated")
+        return ring
+
+    def _open(self, name: str):
+        self.rings.pop(name, None)
+        try:
+            file = open(os.path.join(self.directory, name), "rb")
+        except FileNotFoundError:
+            raise FrameUnavailable(f"ring {name} not found in {self.directory}") from None
+        try:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file, the writer is still creating it
+            file.close()
+            raise FrameUnavailable(f"ring {name} is not ready") from None
+        magic, version, token, _ = RING_HEADER.unpack_from(mapping, 0)
+        if magic != MAGIC or version != VERSION:
+            file.close()
+            raise FrameUnavailable(f"{name} is not a version {VERSION} frame ring")
+        ring = (file, mapping, token.hex())
+        self.rings[name] = ring
+        while len(self.rings) > self.max_rings:
+            # mappings are not closed explicitly: views handed out keep them alive until released
+            self.rings.popitem(last=False)[1][0].close()
+        return ring
+
+    def read(self, frame: dict) -> memoryview:
+        """The encoded image of a handle as a read-only view of the shared mapping."""
+        _, mapping, _ = self._ring(frame["ring"], frame["token"])
+        offset, length = int(frame["offset"]), int(frame["length"])
+        if offset < HEADER_SIZE or offset + RECORD_HEADER.size + length > len(mapping):
+            raise FrameUnavailable("frame outside the ring")
+        seq, stored_length = RECORD_HEADER.unpack_from(mapping, offset)
+        if seq != frame["seq"] or stored_length != length:
+            raise FrameUnavailable("frame was released")
+        start = offset + RECORD_HEADER.size
+        return memoryview(mapping)[start:start + length]
+
+    def valid(self, frame: dict) -> bool:
+        """Whether the frame is still held by the writer, i.e. a view read from it was not overwritten."""
+        ring = self.rings.get(frame["ring"])
+        if ring is None or ring[2] != frame["token"]:
+            return False
+        return RECORD_HEADER.unpack_from(ring[1], int(frame["offset"]))[0] == frame["seq"]
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import platform
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import onnxruntime as ort
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+MODEL_VARIANTS = ("fp32", "int8_dynamic", "int8_static")
+
+def _env_list(name: str, default: str) -> list[str]:
+    return [v.strip() for v in os.environ.get(name, default).split(",") if v.strip()]
+
+@dataclass
+class SessionConfig:
+    """ONNX Runtime session settings, read from ORT_* environment variables by from_env."""
+    providers: list[str] = field(default_factory=lambda: ["CUDAExecutionProvider", "CPUExecutionProvider"])
+    intra_op_threads: int = 0  # 0 lets ONNX Runtime decide
+    inter_op_threads: int = 0
+    execution_mode: str = "sequential"
+    optimization_level: str = "all"
+    cache_dir: str | None = None  # None puts the cache in .ort_cache next to the model, "" disables it
+    warmup_batch_sizes: list[int] | None = None  # None derives them from the service's max batch size
+
+    @classmethod
+    def from_env(cls) -> "SessionConfig":
+        config = cls(
+            providers=_env_list("ORT_PROVIDERS", "CUDAExecutionProvider,CPUExecutionProvider"),
+            intra_op_threads=int(os.environ.get("ORT_INTRA_OP_THREADS", 0)),
+            inter_op_threads=int(os.environ.get("ORT_INTER_OP_THREADS", 0)),
+            execution_mode=os.environ.get("ORT_EXECUTION_MODE", "sequential").lower(),
+            optimization_level=os.environ.get("ORT_GRAPH_OPTIMIZATION_LEVEL", "all").lower(),
+            cache_dir=os.environ.get("ORT_OPTIMIZED_MODEL_CACHE"),
+            warmup_batch_sizes=[int(v) for v in _env_list("ORT_WARMUP_BATCH_SIZES", "")] or None,
+        )
+        if config.execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"ORT_EXECUTION_MODE must be one of {list(EXECUTION_MODES)}")
+        if config.optimization_level not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"ORT_GRAPH_OPTIMIZATION_LEVEL must be one of {list(GRAPH_OPTIMIZATION_LEVELS)}")
+        return config
+
+    def batch_sizes(self, max_batch_size: int) -> list[int]:
+        """Batch sizes to warm up: ORT_WARMUP_BATCH_SIZES, or the powers of two below max_batch_size and itself."""
+        if self.warmup_batch_sizes:
+            return self.warmup_batch_sizes
+        sizes, size = [], 1
+        while size < max_batch_size:
+            sizes.append(size)
+            size *= 2
+        return sizes + [max(max_batch_size, 1)]
+
+def _cpu_signature() -> str:
+    """Architecture and instruction set extensions: optimized graphs can use layouts only some CPUs run."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = next((line.split(":", 1)[1].strip() for line in f if line.startswith(("flags", "Features"))), "")
+    except OSError:
+        flags = platform.processor()
+    return f"{platform.machine()}:{flags}"
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def model_version(model_paths: list[str], settings: str = "") -> str:
+    """
+    Short content hash of the loaded model files and the settings that change their outputs,
+    changes whenever any of them is replaced.
+    """
+    digests = sorted(_file_digest(path) for path in model_paths)
+    return hashlib.sha256("|".join([*digests, settings]).encode()).hexdigest()[:16]
+
+def session_providers(config: SessionConfig) -> list[str]:
+    """The configured providers this onnxruntime build has, in order; CPU when none of them."""
+    available = ort.get_available_providers()
+    return [p for p in config.providers if p in available] or ["CPUExecutionProvider"]
+
+def optimized_model_path(model_path: str, config: SessionConfig) -> str | None:
+    """
+    Location of the serialized optimized graph for this model and session config.
+    The name depends on the model contents, the ONNX Runtime version and device, the optimization
+    level, the providers the session actually gets (a CUDA graph is never loaded on a CPU-only host)
+    and the CPU's architecture and extensions, so any of them changing makes a fresh cache entry.
+    """
+    if config.cache_dir == "" or config.optimization_level == "disable":
+        return None
+    cache_dir = config.cache_dir or os.path.join(os.path.dirname(os.path.abspath(model_path)), ".ort_cache")
+    key = hashlib.sha256("|".join([
+        _file_digest(model_path),
+        ort.__version__,
+        ort.get_device(),
+        config.optimization_level,
+        ",".join(session_providers(config)),
+        _cpu_signature(),
+    ]).encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f"{name}.{key}.onnx")
+
+def resolve_model_path(model_path: str, variant: str = "fp32") -> str:
+    """Path of a model variant, e.g. yolov6s_face.onnx -> yolov6s_face.int8_static.onnx."""
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Model variant must be one of {list(MODEL_VARIANTS)}, got '{variant}'")
+    if variant == "fp32":
+        return model_path
+    stem, ext = os.path.splitext(model_path)
+    return f"{stem}.{variant}{ext}"
+
+def create_session(model_path: str, config: SessionConfig | None = None):
+    config = config or SessionConfig.from_env()
+    providers = session_providers(config)
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = config.intra_op_threads
+    options.inter_op_num_threads = config.inter_op_threads
+    options.execution_mode = EXECUTION_MODES[config.execution_mode]
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[config.optimization_level]
+
+    load_path = model_path
+    cached_path = optimized_model_path(model_path, config)
+    tmp_path = None
+    if cached_path and os.path.exists(cached_path):
+        # Already optimized for this runtime, skip the optimizer on load.
+        load_path = cached_path
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+    elif cached_path:
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+        options.optimized_model_filepath = tmp_path
+
+    tik = time.perf_counter()
+    session = ort.InferenceSession(
+        load_path,
+        sess_options=options,
+        providers=providers,
+    )
+    if tmp_path and os.path.exists(tmp_path):
+        os.replace(tmp_path, cached_path)  # atomic, concurrent workers never see a partial file
+
+    print(f"[INFO] ONNX provider: {session.get_providers()[0]}")
+    print(f"[INFO] Loaded {load_path} in {time.perf_counter() - tik:.2f}s")
+    return session
+
+def warmup(session, input_shapes: list[tuple], batch_sizes: list[int]):
+    """Run one inference for every (batch size, input shape) pair the service will serve."""
+    input_name = session.get_inputs()[0].name
+    tik = time.perf_counter()
+    for shape in input_shapes:
+        for batch_size in batch_sizes:
+            session.run(None, {input_name: np.zeros((batch_size, *shape), dtype=np.float32)})
+    print(f"[INFO] Warm-up of {len(input_shapes) * len(batch_sizes)} shapes took {time.perf_counter() - tik:.2f}s")
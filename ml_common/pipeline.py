@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("preprocess", "inference", "postprocess")
+
+class BufferPool:
+    """
+    Fixed set of reusable input buffers.
+    A buffer stays checked out from preprocessing until its inference finished,
+    so batches in flight in the pipeline never overwrite each other.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int):
+        self.free: queue.Queue = queue.Queue()
+        for _ in range(size):
+            self.free.put(factory())
+
+    def acquire(self) -> Any:
+        return self.free.get()
+
+    def release(self, buffer: Any):
+        self.free.put(buffer)
+
+class StagedPipeline:
+    """
+    Three-stage preprocess -> inference -> postprocess pipeline.
+    Every stage runs in its own thread, outside the event loop, so preprocessing of batch N+1,
+    inference of batch N and postprocessing of batch N-1 overlap.
+    Stages are connected with bounded queues: when inference falls behind, submit waits
+    instead of piling up preprocessed tensors in memory.
+    A batch whose caller was cancelled is dropped before its next stage, discard(stage, item) is
+    called with the output of the previous stage to release what it holds (e.g. pooled buffers).
+    """
+
+    def __init__(
+        self,
+        preprocess: Callable[[Any], Any],
+        infer: Callable[[Any], Any],
+        postprocess: Callable[[Any], Any],
+        queue_size: int = 2,
+        discard: Callable[[str, Any], None] | None = None,
+    ):
+        self.functions = dict(zip(STAGES, (preprocess, infer, postprocess)))
+        self.discard = discard
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=len(STAGES), thread_name_prefix="pipeline")
+        self.queues: dict[str, asyncio.Queue] = {}
+        self.busy_seconds = dict.fromkeys(STAGES, 0.0)
+        self.processed = dict.fromkeys(STAGES, 0)
+        self.started_at: float | None = None
+        self._workers: list[asyncio.Task] = []
+
+    def _start(self):
+        self.started_at = time.perf_counter()
+        self.queues = {stage: asyncio.Queue(maxsize=self.queue_size) for stage in STAGES}
+        for i, stage in enumerate(STAGES):
+            next_queue = self.queues[STAGES[i + 1]] if i + 1 < len(STAGES) else None
+            self._workers.append(asyncio.create_task(self._worker(stage, self.queues[stage], next_queue)))
+
+    async def _worker(self, stage: str, queue: asyncio.Queue, next_queue: asyncio.Queue | None):
+        while True:
+            item, future = await queue.get()
+            try:
+                await self._process(stage, item, future, next_queue)
+            except Exception:  # one batch never stops the stage
+                logger.exception("Pipeline %s stage failed on a batch", stage)
+
+    async def _process(self, stage: str, item: Any, future: asyncio.Future, next_queue: asyncio.Queue | None):
+        if future.done():  # cancelled by the caller
+            if stage != STAGES[0] and self.discard is not None:
+                self.discard(stage, item)
+            return
+        tik = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, self.functions[stage], item)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        finally:
+            self.busy_seconds[stage] += time.perf_counter() - tik
+            self.processed[stage] += 1
+        if next_queue is not None:
+            await next_queue.put((result, future))
+        elif not future.done():  # the caller may have been cancelled while the stage ran
+            future.set_result(result)
+
+    async def submit(self, item: Any) -> Any:
+        """Push one batch through all stages and wait for its postprocessed result."""
+        if not self._workers:
+            self._start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queues[STAGES[0]].put((item, future))
+        return await future
+
+    def stats(self) -> dict:
+        """Per-stage queue depth, processed batches and utilization (busy share of wall time)."""
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            stage: {
+                "queue_depth": self.queues[stage].qsize() if self.queues else 0,
+                "processed": self.processed[stage],
+                "utilization": self.busy_seconds[stage] / elapsed if elapsed else 0.0,
+            }
+            for stage in STAGES
+        }
+
+    def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        self.executor.shutdown(wait=False)
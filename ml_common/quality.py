@@ -0,0 +1,79 @@
+import math
+import os
+from dataclasses import dataclass, fields
+from typing import Any, Dict
+
+import cv2
+import numpy as np
+
+# weakest component of a face, reported as the reason it was rejected
+QUALITY_REASONS = ("small", "low_confidence", "pose", "blur")
+
+@dataclass(frozen=True)
+class QualityConfig:
+    """
+    Where every quality component scores 0 and where it reaches 1, linear in between (sharpness on a log scale).
+    Read from QUALITY_* environment variables by from_env.
+    """
+    min_face_px: float = 20  # shorter side of the detection box, in pixels of the original image
+    good_face_px: float = 80
+    min_conf: float = 0.4  # the detector's own threshold
+    good_conf: float = 0.8
+    max_yaw: float = 60  # degrees, the estimate of pose_angles; roll is removed by the alignment
+    max_pitch: float = 45
+    min_sharpness: float = 15  # variance of the Laplacian of the aligned 112x112 crop
+    good_sharpness: float = 150
+
+    @classmethod
+    def from_env(cls) -> "QualityConfig":
+        return cls(**{
+            field.name: float(os.environ.get(f"QUALITY_{field.name.upper()}", field.default)) for field in fields(cls)
+        })
+
+def _ramp(value: float, low: float, high: float) -> float:
+    return float(np.clip((value - low) / (high - low), 0.0, 1.0))
+
+def pose_angles(keypoints) -> tuple[float, float, float]:
+    """
+    Rough (yaw, pitch, roll) in degrees from the five landmarks (eyes, nose, mouth corners).
+    Roll is the angle of the eye line. In the roll-corrected frame, yaw follows the sideways offset of the
+    nose from the eye / mouth midline and pitch its height between the eye and mouth lines, both relative
+    to the frontal alignment template; a nose about half an eye distance in front of the face is assumed.
+    """
+    kps = np.asarray(keypoints, dtype=np.float64).reshape(5, 2)
+    left_eye, right_eye, nose, left_mouth, right_mouth = kps
+    eye_line = right_eye - left_eye
+    roll = math.atan2(eye_line[1], eye_line[0])
+    rotation = np.array([[math.cos(roll), math.sin(roll)], [-math.sin(roll), math.cos(roll)]])
+    eyes, mouth = (left_eye + right_eye) / 2, (left_mouth + right_mouth) / 2
+    eyes, mouth, nose = (rotation @ (p - eyes) for p in (eyes, mouth, nose))
+
+    eye_distance = max(float(np.linalg.norm(eye_line)), 1e-6)
+    face_height = mouth[1] - eyes[1]
+    if face_height <= 1e-6:  # mouth above the eyes: upside down or landmarks collapsed
+        return 90.0, 90.0, math.degrees(roll)
+    yaw = math.degrees(math.atan2(nose[0] - (eyes[0] + mouth[0]) / 2, 0.5 * eye_distance))
+    # the template's nose sits 0.494 of the way from the eye line down to the mouth line
+    pitch = math.degrees(math.atan2(0.494 * face_height - nose[1], 0.5 * eye_distance))
+    return yaw, pitch, math.degrees(roll)
+
+def sharpness(crop: np.ndarray) -> float:
+    """Variance of the Laplacian of an aligned crop: low for blurred, upscaled or featureless faces."""
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+def face_quality(detection: Dict[str, Any] | None, crop: np.ndarray, config: QualityConfig = QualityConfig()) -> Dict[str, Any]:
+    """
+    Quality of one face: its box size, detector confidence, pose and the sharpness of its aligned crop, each
+    scored in [0, 1]. The quality is the lowest score and the reason the component that has it. Without the
+    detection only the crop is scored.
+    """
+    scores = {"blur": _ramp(math.log1p(sharpness(crop)), math.log1p(config.min_sharpness), math.log1p(config.good_sharpness))}
+    if detection is not None:
+        x1, y1, x2, y2 = detection["bbox"]
+        yaw, pitch, _ = pose_angles(detection["keypoints"])
+        scores["small"] = _ramp(min(x2 - x1, y2 - y1), config.min_face_px, config.good_face_px)
+        scores["low_confidence"] = _ramp(detection["conf"], config.min_conf, config.good_conf)
+        scores["pose"] = 1.0 - max(min(abs(yaw) / config.max_yaw, 1.0), min(abs(pitch) / config.max_pitch, 1.0))
+    reason = min(scores, key=scores.get)
+    return {"quality": round(scores[reason], 4), "reason": reason}
@@ -0,0 +1,37 @@
+import os
+from dataclasses import dataclass, replace
+
+TIER_NAMES = ("fast", "balanced", "accurate")
+DEFAULT_TIER = "accurate"  # the behaviour of requests that do not ask for a tier
+
+@dataclass(frozen=True)
+class Tier:
+    """
+    Accuracy/cost trade-off a request can pick.
+    A variant of None means the service default (*_MODEL_VARIANT).
+    """
+    name: str
+    detector_size: int = 640  # longest side of the detector input, shape buckets are scaled to it
+    detection_variant: str | None = None
+    embedding_variant: str | None = None
+    flip_tta: bool = True  # embed the horizontally flipped face too and average
+
+DEFAULT_TIERS = {
+    "fast": Tier("fast", detector_size=320, flip_tta=False),
+    "balanced": Tier("balanced", detector_size=480, flip_tta=False),
+    "accurate": Tier("accurate"),
+}
+
+def tiers_from_env(default_detection_variant: str = "fp32", default_embedding_variant: str = "fp32") -> dict[str, Tier]:
+    """Tiers with TIER_<NAME>_DETECTOR_SIZE, _DETECTION_VARIANT, _EMBEDDING_VARIANT and _FLIP_TTA overrides applied."""
+    tiers = {}
+    for name, tier in DEFAULT_TIERS.items():
+        prefix = f"TIER_{name.upper()}"
+        tiers[name] = replace(
+            tier,
+            detector_size=int(os.environ.get(f"{prefix}_DETECTOR_SIZE", tier.detector_size)),
+            detection_variant=os.environ.get(f"{prefix}_DETECTION_VARIANT", tier.detection_variant or default_detection_variant),
+            embedding_variant=os.environ.get(f"{prefix}_EMBEDDING_VARIANT", tier.embedding_variant or default_embedding_variant),
+            flip_tta=os.environ.get(f"{prefix}_FLIP_TTA", str(tier.flip_tta)).lower() in ("1", "true", "yes"),
+        )
+    return tiers
@@ -0,0 +1,11 @@
+"""The API under test runs on SQLite and an in-memory Qdrant instead of Postgres and the Qdrant server."""
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'face_recognition_api'))
+
+for name in ('POSTGRES_HOST', 'POSTGRES_USER', 'POSTGRES_PASSWORD', 'POSTGRES_DB'):
+    os.environ.setdefault(name, 'test')
+os.environ.setdefault('DATABASE_URL', f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/api.db")
+os.environ.setdefault('QDRANT_LOCATION', ':memory:')
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ml_common'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'embedding_service'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from alignment import TEMPLATE_112, similarity_transforms, warp_faces
+from bench_alignment import crop_shift, landmark_rms
+from preprocess import extract_largest_face_aligned
+
+# (scale, angle in radians, centre) of well-conditioned faces: upright to tilted, 56 to 106 px between the eyes
+FACES = [(2.0, 0.0, (300, 200)), (3.0, 0.3, (400, 250)), (1.6, -0.25, (220, 310))]
+
+
+def face_keypoints(scale, angle, centre):
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]) * scale
+    return ((TEMPLATE_112 - 56) @ rotation.T + centre).astype(np.float32)
+
+
+def lmeds_transforms(keypoints):
+    return np.stack([cv2.estimateAffinePartial2D(k, TEMPLATE_112, method=cv2.LMEDS)[0] for k in keypoints])
+
+
+@pytest.fixture(scope="module")
+def image():
+    rng = np.random.default_rng(0)
+    return cv2.GaussianBlur(rng.integers(0, 256, (600, 800, 3), dtype=np.uint8), (9, 9), 0)
+
+
+def test_exact_landmarks_give_the_lmeds_transform(image):
+    keypoints = np.stack([face_keypoints(*face) for face in FACES])
+    transforms = similarity_transforms(keypoints)
+    assert crop_shift(transforms, lmeds_transforms(keypoints)).max() < 0.01
+
+    crops = warp_faces(image, transforms)
+    for crop, k in zip(crops, keypoints):
+        detection = {"bbox": [0, 0, 1, 1], "keypoints": k.ravel().tolist(), "conf": 0.9}
+        reference, _ = extract_largest_face_aligned(image, [detection])
+        assert np.abs(crop.astype(np.int16) - reference).max() <= 1
+
+
+def test_detector_rounded_landmarks_stay_within_a_pixel_of_lmeds():
+    keypoints = np.stack([face_keypoints(*face).round() for face in FACES])
+    transforms, lmeds = similarity_transforms(keypoints), lmeds_transforms(keypoints)
+    # least squares is the best fit of the landmarks, LMEDS can only match it
+    assert (landmark_rms(transforms, keypoints) <= landmark_rms(lmeds, keypoints) + 1e-3).all()
+    assert crop_shift(transforms, lmeds).max() < 1.0
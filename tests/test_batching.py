@@ -0,0 +1,52 @@
+import asyncio
+import gc
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ml_common'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from batching import AdaptiveBatcher, BatchingConfig
+from bench_batching import FixedWindowBatcher, make_trace, phase_stats, replay
+
+MAX_BATCH_SIZE = 16
+MAX_LATENCY_MS = 300
+TARGET_P99_MS = 200
+INTERCEPT_S, PER_ITEM_S = 0.02, 0.004
+PHASES = [(5, 2.0), (150, 1.5)]  # rate_rps, duration_s: a quiet and a busy phase
+
+
+@pytest.fixture(scope="module")
+def trace():
+    return make_trace(PHASES, seed=0)
+
+
+def run(batcher_cls, mode, trace):
+    config = BatchingConfig(MAX_BATCH_SIZE, MAX_LATENCY_MS, mode, TARGET_P99_MS)
+    # the objects of every collected test module would make a full collection during the replay a ~100 ms stall
+    gc.collect()
+    gc.freeze()
+    try:
+        result = asyncio.run(replay(batcher_cls, config, trace, INTERCEPT_S, PER_ITEM_S))
+    finally:
+        gc.unfreeze()
+    quiet = trace < PHASES[0][1]
+    return phase_stats(trace, *result, quiet), phase_stats(trace, *result, ~quiet), phase_stats(trace, *result, trace >= 0)
+
+
+def test_adaptive_batching_meets_the_p99_target(trace):
+    quiet, busy, total = run(AdaptiveBatcher, "adaptive", trace)
+    assert total["p99_ms"] <= TARGET_P99_MS
+    # a quiet stream is not held back for batches that never form, a busy one is batched
+    assert quiet["batch_size"] < 1.5
+    assert quiet["p99_ms"] < TARGET_P99_MS / 2
+    assert busy["batch_size"] >= 4
+    assert busy["rps"] >= 0.8 * PHASES[1][0]  # keeps up with the arrivals
+
+
+def test_fixed_window_waits_out_the_window(trace):
+    quiet, busy, total = run(FixedWindowBatcher, "fixed", trace)
+    assert quiet["p99_ms"] >= 0.9 * MAX_LATENCY_MS  # the first request of a window waits all of it
+    assert total["p99_ms"] > TARGET_P99_MS
+    assert busy["batch_size"] >= 0.8 * MAX_BATCH_SIZE
@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+import io
+import json
+import zipfile
+
+import httpx
+import numpy as np
+import pytest
+
+from app.main import app, lifespan
+from app.services import enrollment
+
+DETECTIONS = [{"bbox": [10, 10, 110, 110], "keypoints": [40, 50, 80, 50, 60, 70, 45, 90, 75, 90], "conf": 0.9}]
+
+
+async def detect_and_embed(image_bytes, **kwargs):
+    """Every image is a face of its own: unrelated random embeddings never pass the duplicate threshold."""
+    await asyncio.sleep(0.01)
+    if image_bytes == b"noface":
+        return [], {"error": "no_face"}
+    seed = int.from_bytes(hashlib.sha256(image_bytes).digest()[:8], "little")
+    return DETECTIONS, {"embedding": np.random.default_rng(seed).standard_normal(512).tolist(), "best_det_id": 0}
+
+
+@pytest.fixture(autouse=True)
+def fake_models(monkeypatch):
+    monkeypatch.setattr(enrollment, "detect_and_embed", detect_and_embed)
+
+
+def bulk_enroll(**request):
+    """Status lines of one /api/bulk_enroll call, read as the response streams."""
+    async def run():
+        async with lifespan(app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                async with client.stream("POST", "/api/bulk_enroll", **request) as response:
+                    assert response.status_code == 200
+                    return [json.loads(line) async for line in response.aiter_lines() if line]
+
+    return asyncio.run(run())
+
+
+def test_files_are_read_while_the_response_streams():
+    # the form files are closed when the handler returns, the images must outlive them
+    names = [f"files-{i}" for i in range(20)] + ["files-noface"]
+    files = [("files", (f"{i}.jpg", f"image {i}".encode())) for i in range(20)] + [("files", ("n.jpg", b"noface"))]
+    lines = bulk_enroll(data={"names": names}, files=files)
+
+    assert lines[-1]["summary"]["enrolled"] == 20
+    assert lines[-1]["summary"]["no_face"] == 1
+    assert lines[-1]["summary"]["error"] == 0
+    assert sorted(line["index"] for line in lines[:-1]) == list(range(21))
+
+
+def test_archive_is_read_while_the_response_streams():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        for i in range(10):
+            z.writestr(f"people/archive-{i}.jpg", f"archived {i}".encode())
+        z.writestr("__MACOSX/archive-0.jpg", b"resource fork")
+        z.writestr("readme.txt", b"not an image")
+    lines = bulk_enroll(files={"archive": ("people.zip", archive.getvalue())})
+
+    assert lines[-1]["summary"]["enrolled"] == 10
+    assert {line["name"] for line in lines[:-1]} == {f"archive-{i}" for i in range(10)}
@@ -0,0 +1,70 @@
+import itertools
+import uuid
+
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, PointIdsList, PointStruct, VectorParams
+
+from app.repositories.local_index import WRITTEN_AT, LocalIndex
+
+COLLECTION = "faces"
+DIM = 8
+
+vectors = np.random.default_rng(0).standard_normal((6, DIM))
+clock = itertools.count(1)
+
+
+@pytest.fixture
+def client():
+    client = QdrantClient(":memory:")
+    client.create_collection(COLLECTION, vectors_config=VectorParams(size=DIM, distance=Distance.COSINE))
+    return client
+
+
+def write(client, i: int, index: LocalIndex | None = None) -> str:
+    """Enrolls vector i like person_repo does, from this process when index is given and from another one otherwise."""
+    point_id, payload = str(uuid.uuid4()), {"name": str(i), WRITTEN_AT: next(clock)}
+    client.upsert(COLLECTION, points=[PointStruct(id=point_id, vector=vectors[i].tolist(), payload=payload)])
+    if index is not None:
+        index.upsert([point_id], vectors[i:i + 1], [payload])
+    return point_id
+
+
+def best(index: LocalIndex, client, i: int):
+    index.sync(client, COLLECTION)
+    hits = index.search(vectors[i:i + 1], threshold=0.9, limit=1)[0]
+    return hits[0][2]["name"] if hits else None
+
+
+def test_sync_catches_a_delete_and_an_enrollment_elsewhere(client):
+    first = write(client, 0)
+    write(client, 1)
+    index = LocalIndex(DIM, max_size=3, sync_s=0)
+    index.load(client, COLLECTION)
+    write(client, 2, index)
+    assert best(index, client, 2) == "2"
+
+    client.delete(COLLECTION, points_selector=PointIdsList(points=[first]))
+    write(client, 3)  # same point count as before
+    assert best(index, client, 3) == "3"
+    assert best(index, client, 0) is None
+
+
+def test_sync_reactivates_an_index_that_outgrew_max_size(client):
+    write(client, 0)
+    index = LocalIndex(DIM, max_size=2, sync_s=0)
+    index.load(client, COLLECTION)
+    extra = [write(client, 1, index), write(client, 2, index)]
+    assert not index.active
+
+    client.delete(COLLECTION, points_selector=PointIdsList(points=extra))
+    assert best(index, client, 0) == "0"
+    assert index.active
+
+
+def test_sync_leaves_an_index_that_was_never_loaded_alone(client):
+    write(client, 0)
+    index = LocalIndex(DIM, max_size=2, sync_s=0)
+    index.sync(client, COLLECTION)
+    assert not index.active
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ml_common'))
+from pipeline import STAGES, BufferPool, StagedPipeline
+
+QUEUE_SIZE = 2
+POOL_SIZE = QUEUE_SIZE + 2
+
+
+class Model:
+    """preprocess takes a pooled buffer that inference gives back, like the services do."""
+
+    def __init__(self):
+        self.pool = BufferPool(object, POOL_SIZE)
+        self.blocked = {stage: threading.Event() for stage in STAGES}
+        self.entered = {stage: threading.Event() for stage in STAGES}
+
+    def _stage(self, stage):
+        self.entered[stage].set()
+        if self.blocked[stage].is_set():
+            self.blocked[stage].clear()
+            assert self.released.wait(5)
+
+    def preprocess(self, item):
+        buffer = self.pool.acquire()
+        self._stage("preprocess")
+        return item, buffer
+
+    def infer(self, item):
+        value, buffer = item
+        try:
+            self._stage("inference")
+        finally:
+            self.pool.release(buffer)
+        return value
+
+    def postprocess(self, value):
+        self._stage("postprocess")
+        return value * 2
+
+    def discard(self, stage, item):
+        if stage == "inference":
+            self.pool.release(item[1])
+
+
+async def _cancel_in(stage):
+    model = Model()
+    model.released = threading.Event()
+    pipeline = StagedPipeline(model.preprocess, model.infer, model.postprocess, QUEUE_SIZE, model.discard)
+    try:
+        # more cancellations than the pool has buffers: a leak would block preprocess for good
+        for _ in range(POOL_SIZE + 2):
+            model.released.clear()
+            model.blocked[stage].set()
+            model.entered[stage].clear()
+            caller = asyncio.create_task(pipeline.submit(1))
+            assert await asyncio.to_thread(model.entered[stage].wait, 5)
+            caller.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await caller
+            model.released.set()
+
+        results = await asyncio.wait_for(asyncio.gather(*(pipeline.submit(i) for i in range(8))), timeout=5)
+        assert results == [2 * i for i in range(8)]
+        assert all(not worker.done() for worker in pipeline._workers)
+        assert model.pool.free.qsize() == POOL_SIZE
+    finally:
+        pipeline.close()
+
+
+@pytest.mark.parametrize("stage", STAGES)
+def test_cancelled_caller_does_not_stall_the_pipeline(stage):
+    asyncio.run(_cancel_in(stage))
+
+
+def test_failing_batch_fails_only_its_caller():
+    async def run():
+        def infer(item):
+            if item == "bad":
+                raise ValueError(item)
+            return item
+
+        pipeline = StagedPipeline(lambda item: item, infer, lambda item: item, QUEUE_SIZE)
+        try:
+            with pytest.raises(ValueError):
+                await pipeline.submit("bad")
+            assert await asyncio.wait_for(pipeline.submit("good"), timeout=5) == "good"
+        finally:
+            pipeline.close()
+
+    asyncio.run(run())
@@ -0,0 +1,142 @@
+import asyncio
+import json
+
+import pytest
+
+from app.services.service_client import CircuitBreaker, ServiceClient, ServiceUnavailableError
+
+DELAY = 0.05
+CALLS = 16
+
+
+class StubServer:
+    """HTTP/1.1 server with keep-alive answering after DELAY; counts connections, requests per path and requests in flight."""
+
+    def __init__(self):
+        self.connections = 0
+        self.requests = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                path = request_line.split()[1].decode()
+                length = 0
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    key, _, value = line.decode().partition(":")
+                    if key.lower() == "content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+
+                count = self.requests[path] = self.requests.get(path, 0) + 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                await asyncio.sleep(DELAY)
+                self.in_flight -= 1
+                status = "200 OK"
+                if path == "/down" or (path == "/flaky" and count <= 2):
+                    status = "503 Service Unavailable"
+                body = json.dumps({"path": path, "count": count}).encode()
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def with_stub(test):
+    """Runs test(stub, url) against a fresh stub server on a free local port."""
+    async def run():
+        stub = StubServer()
+        server = await asyncio.start_server(stub.handle, '127.0.0.1', 0)
+        try:
+            await test(stub, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}")
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(run())
+
+
+def make_client(url, max_concurrency=CALLS, retries=2, failure_threshold=3, reset_s=60.0):
+    return ServiceClient(
+        "stub", url, timeout_s=5, connect_timeout_s=1, max_connections=32, max_concurrency=max_concurrency,
+        retries=retries, backoff_s=0.01, breaker=CircuitBreaker(failure_threshold, reset_s=reset_s),
+    )
+
+
+async def call_round(client, path="/slow", n=CALLS):
+    return await asyncio.gather(*(client.post(path, json={"i": i}) for i in range(n)))
+
+
+def test_calls_overlap_on_kept_alive_connections():
+    async def test(stub, url):
+        client = make_client(url)
+        await call_round(client)
+        assert stub.max_in_flight == CALLS  # a slow call does not hold up the others
+        connections = stub.connections
+        await call_round(client)
+        assert stub.connections == connections
+        assert client.stats()["in_flight"] == 0
+        await client.aclose()
+
+    with_stub(test)
+
+
+def test_max_concurrency_bounds_the_calls_in_flight():
+    async def test(stub, url):
+        client = make_client(url, max_concurrency=4)
+        await call_round(client)
+        assert stub.max_in_flight == 4
+        assert stub.requests["/slow"] == CALLS
+        await client.aclose()
+
+    with_stub(test)
+
+
+def test_unavailable_answers_are_retried():
+    async def test(stub, url):
+        client = make_client(url, retries=2)
+        response = await client.post("/flaky", json={})
+        assert response.json()["count"] == 3
+        assert client.counters["retries"] == 2
+        assert client.breaker.state == "closed"
+        await client.aclose()
+
+    with_stub(test)
+
+
+def test_breaker_fails_fast_once_open():
+    async def test(stub, url):
+        client = make_client(url, retries=0, failure_threshold=3)
+        for _ in range(5):
+            with pytest.raises(ServiceUnavailableError):
+                await client.post("/down", json={})
+        assert stub.requests["/down"] == 3
+        assert client.counters["rejected"] == 2
+        assert client.breaker.state == "open"
+        await client.aclose()
+
+    with_stub(test)
+
+
+def test_breaker_closes_after_a_successful_trial():
+    async def test(stub, url):
+        client = make_client(url, retries=0, failure_threshold=1, reset_s=DELAY)
+        with pytest.raises(ServiceUnavailableError):
+            await client.post("/down", json={})
+        assert client.breaker.state == "open"
+        await asyncio.sleep(DELAY)
+        assert client.breaker.state == "half_open"
+        await client.post("/slow", json={})
+        assert client.breaker.state == "closed"
+        await client.aclose()
+
+    with_stub(test)